@@ -1,6 +1,7 @@
 import sys
 import os
 import datetime
+import logging
 import time
 import numpy as np
 from PyQt5 import QtWidgets, QtCore
@@ -10,81 +11,89 @@ from matplotlib.figure import Figure
 import serial
 import serial.tools.list_ports
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.ds102 import DS102
+from frog.liveview import LiveFrogMap
+from frog.logutil import setup_logging
+from frog.metrics import ScanMetrics
+from frog.spectrometer import SpectrometerSession
+from frog.tracefile import ColumnStore, TraceWriter, export_txt
+
 try:
     import seabreeze.spectrometers as sb
     seabreeze_imported = True
 except Exception:
     seabreeze_imported = False
 
-def log_to_file(logpath, message):
-    now = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-    with open(logpath, "a", encoding="utf-8") as lf:
-        lf.write(f"[{now}] {message}\n")
+logger = logging.getLogger("frog.measure")
+
+# 画面のログ表示: 更新間隔 [ms]、1 回に表示する最大行数、保持する最大行数
+LOG_DRAIN_MS = 200
+LOG_MAX_LINES = 200
+LOG_MAX_BLOCKS = 5000
+
+# 測定中の FROG マップの最大再描画回数 [回/s]
+LIVE_MAX_FPS = 5
 
-def move_stage_and_wait(ser, fspeed, pulses, direction, gui_log=None, file_log=None):
+# 1 点で複数フレームを平均するときの外れ値判定 [σ]
+CLIP_SIGMA = 3.0
+
+def move_stage_and_wait(stage, fspeed, pulses, direction, metrics=None, point=None):
+    """移動して停止を待つ。metrics を渡すと移動のスパン（move）を残す"""
     try:
         start_time = datetime.datetime.now()
-        msg = f"ステージ移動開始: fspeed={fspeed}, pulses={pulses}, direction={direction}"
-        if gui_log: gui_log(msg)
-        if file_log: file_log(msg)
-        cmd1 = f"AXIs1:Fspeed0 {fspeed}\r"
-        cmd2 = f"AXIs1:PULS {pulses}:GO {direction}\r"
-        ser.write(cmd1.encode('utf-8'))
-        ser.write(cmd2.encode('utf-8'))
-        for _ in range(120):
-            ser.write("AXIs1:MOTION?\r".encode('utf-8'))
-            resp = ser.readline().decode('utf-8').strip()
-            if resp == "0":
-                end_time = datetime.datetime.now()
-                msg2 = f"ステージ停止検出: {end_time.strftime('%H:%M:%S.%f')[:-3]}（移動に{(end_time - start_time).total_seconds():.2f}秒）"
-                if gui_log: gui_log(msg2)
-                if file_log: file_log(msg2)
-                return True
-            time.sleep(0.1)
-        msg3 = "ステージ移動タイムアウトエラー"
-        if gui_log: gui_log(msg3)
-        if file_log: file_log(msg3)
+        logger.debug(f"ステージ移動開始: fspeed={fspeed}, pulses={pulses}, direction={direction}")
+        t0 = time.perf_counter()
+        ok = stage.move(pulses, direction, fspeed)
+        if metrics is not None:
+            metrics.record("move", point, t0)
+        if ok:
+            end_time = datetime.datetime.now()
+            logger.debug(f"ステージ停止検出: {end_time.strftime('%H:%M:%S.%f')[:-3]}（移動に{(end_time - start_time).total_seconds():.2f}秒）")
+            return True
+        logger.error("ステージ移動タイムアウトエラー")
         return False
     except Exception as e:
-        msg4 = f"ステージ移動例外エラー: {e}"
-        if gui_log: gui_log(msg4)
-        if file_log: file_log(msg4)
+        logger.error(f"ステージ移動例外エラー: {e}")
         return False
 
 class MeasurementWorker(QtCore.QThread):
     progressChanged = QtCore.pyqtSignal(int)
-    logSignal = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal()
     dataSaved = QtCore.pyqtSignal(str)
-    dataUpdated = QtCore.pyqtSignal(int, object, object, object)
+    # 1 点取得するごと（点番号, 遅延[fs], スペクトル）
+    columnAcquired = QtCore.pyqtSignal(int, float, object)
     posUpdated = QtCore.pyqtSignal(int)
 
-    def __init__(self, ser, spectrometer, params, bg_data, parent=None):
+    def __init__(self, stage, session, params, parent=None):
         super().__init__(parent)
-        self.ser = ser
-        self.spectrometer = spectrometer
+        self.stage = stage
+        self.session = session
         self.params = params
-        self.bg_data = bg_data
+        self.metrics = None
         self._is_running = True
 
-        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.log_dir = os.path.join(current_dir, "log")
-        if not os.path.exists(self.log_dir):
-            os.makedirs(self.log_dir)
-        self.logpath = os.path.join(self.log_dir, f"{now}_FROG_gui.log")
-
     def stop(self):
         self._is_running = False
 
     def get_position(self):
         try:
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            pos = self.ser.readline().decode('utf-8').strip()
-            return int(pos)
+            return self.stage.position()
         except Exception:
             return None
 
+    def planned_delays(self):
+        """ライブ表示に使う遅延軸 [fs]"""
+        n = self.params['range_input'] // self.params['step_size']
+        return np.arange(max(n, 1)) * self.params['dt']
+
+    def trace_metadata(self):
+        """トレースファイルのヘッダに残す測定条件"""
+        meta = {k: v for k, v in self.params.items() if isinstance(v, (int, float, bool, str))}
+        meta['model'] = self.session.model
+        meta['background_subtracted'] = self.session.background is not None
+        return meta
+
     def run(self):
         step_size = self.params['step_size']
         range_input = self.params['range_input']
@@ -95,10 +104,13 @@ class MeasurementWorker(QtCore.QThread):
 
         loop_num = range_input // step_size
 
-        wavelengths = self.spectrometer.wavelengths()[1002:]
-        n_wl = len(wavelengths)
+        wavelengths = self.session.wavelengths
+        n_wl = self.session.n_pixels
         t_axis = [i * dt for i in range(loop_num)]
         data2d = np.zeros((loop_num, n_wl))  # shape: (loop_num, n_wl)
+        # 複数フレーム平均のときは画素ごとの分散も残す
+        n_average = self.params.get('n_average', 1)
+        var2d = np.full((loop_num, n_wl), np.nan) if n_average > 1 else None
 
         current_dir = os.path.dirname(os.path.abspath(__file__))
         data_dir = os.path.join(current_dir, "data")
@@ -107,83 +119,76 @@ class MeasurementWorker(QtCore.QThread):
         now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         file_name = os.path.join(data_dir, f"{now}_FROG.txt")
         file_name_csv = os.path.join(data_dir, f"{now}_FROG.csv")
-        self.logSignal.emit(f"測定データを {file_name} (txt) および {file_name_csv} (csv) に保存します")
-        log_to_file(self.logpath, f"測定データ保存先: {file_name} , {file_name_csv}")
+        file_name_trc = os.path.join(data_dir, f"{now}_FROG.frogtrc")
+        logger.info(f"測定データを {file_name_trc} に記録し、{file_name} (txt) および {file_name_csv} (csv) に保存します")
+        # 点ごと・フェーズごとの所要時間（GUI は self.metrics から p50/p95 を読む）
+        metrics = self.metrics = ScanMetrics(os.path.join(data_dir, f"{now}_FROG.metrics.npz"))
 
         try:
-            with open(file_name, "w", encoding="utf-8") as f, \
-                 open(file_name_csv, "w", encoding="utf-8", newline='') as fcsv:
-                # テキスト出力（従来形式）
-                header = "#delay/fs\t" + "\t".join(str(x) for x in wavelengths) + "\tmax_intensity\ttimestamp\n"
-                f.write(header)
-                # CSV形式ヘッダー
-                header_csv = ["Wavelength[nm]"] + [f"{t:.2f}" for t in t_axis]
-                fcsv.write(",".join(header_csv) + "\n")
-                y_mat = []
-                for i in range(loop_num):
-                    if not self._is_running:
-                        msg = "測定をユーザーが中断しました。"
-                        self.logSignal.emit(msg)
-                        log_to_file(self.logpath, msg)
-                        break
-                    if i > 0:
-                        ok = move_stage_and_wait(
-                            self.ser, fspeed, step_size, 0,
-                            gui_log=self.logSignal.emit,
-                            file_log=lambda m: log_to_file(self.logpath, m)
-                        )
-                        if not ok:
-                            msg = "ステージ移動失敗により測定中断"
-                            self.logSignal.emit(msg)
-                            log_to_file(self.logpath, msg)
+            self.session.set_integration_time_ms(integration_time_ms)
+            trace = TraceWriter(file_name_trc, wavelengths, metadata=self.trace_metadata(),
+                                variance=var2d is not None)
+            # CSV 用に波長×遅延へ転置した列をディスク上に足していく
+            columns = ColumnStore(file_name_csv + ".cols", wavelengths, capacity=loop_num)
+            # 最後の点まで測り終えたときだけトレースを完了扱いにする（中断・移動失敗は未完）
+            finished = False
+            with trace:
+                try:
+                    for i in range(loop_num):
+                        if not self._is_running:
+                            msg = "測定をユーザーが中断しました。"
+                            logger.info(msg)
                             break
-                    cur_pos = self.get_position()
-                    self.posUpdated.emit(cur_pos if cur_pos is not None else -999999)
-                    measure_start = datetime.datetime.now()
-                    msg1 = f"測定開始: index={i}, delay={t_axis[i]:.2f}fs, {measure_start.strftime('%H:%M:%S.%f')[:-3]}"
-                    self.logSignal.emit(msg1)
-                    log_to_file(self.logpath, msg1)
-                    self.spectrometer.integration_time_micros(integration_time_ms)
-                    time.sleep(integration_time_ms / 1000 + 0.2)
-                    y = self.spectrometer.intensities()[1002:]
-                    if self.bg_data is not None and len(y) == len(self.bg_data):
-                        y = np.array(y) - np.array(self.bg_data)
-                        msg_bg = f"BG減算: 測定点 {i} でBGスペクトルを引きました"
-                        self.logSignal.emit(msg_bg)
-                        log_to_file(self.logpath, msg_bg)
-                    max_int = np.nanmax(y)
-                    measure_end = datetime.datetime.now()
-                    msg2 = f"測定完了: index={i}, max_intensity={max_int:.2f}, {measure_end.strftime('%H:%M:%S.%f')[:-3]}（測定{(measure_end-measure_start).total_seconds():.2f}秒）"
-                    self.logSignal.emit(msg2)
-                    log_to_file(self.logpath, msg2)
-                    data2d[i, :] = y
-                    delay = t_axis[i]
-                    # テキスト形式
-                    f.write(
-                        f"{delay:.2f}\t" +
-                        "\t".join(str(v) for v in y) +
-                        f"\t{max_int:.2f}\t{measure_end.strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]}\n"
-                    )
-                    y_mat.append(list(y))
-                    self.progressChanged.emit(int((i + 1) / loop_num * 100))
-                    self.dataUpdated.emit(i, data2d, t_axis, wavelengths)
-                # ==== CSV形式出力 ====
-                if len(y_mat) > 0:
-                    y_mat = np.array(y_mat).T  # shape: (n_wl, n_times)
-                    for iw, wl in enumerate(wavelengths):
-                        vals = [f"{y:.4f}" for y in y_mat[iw]] if y_mat.shape[1] > 0 else []
-                        line = [f"{wl:.1f}"] + vals
-                        fcsv.write(",".join(line) + "\n")
+                        if i > 0:
+                            ok = move_stage_and_wait(self.stage, fspeed, step_size, 0, metrics, i)
+                            if not ok:
+                                msg = "ステージ移動失敗により測定中断"
+                                logger.warning(msg)
+                                break
+                        cur_pos = self.get_position()
+                        self.posUpdated.emit(cur_pos if cur_pos is not None else -999999)
+                        measure_start = datetime.datetime.now()
+                        point_start = time.perf_counter()
+                        msg1 = f"測定開始: index={i}, delay={t_axis[i]:.2f}fs, {measure_start.strftime('%H:%M:%S.%f')[:-3]}"
+                        logger.debug(msg1)
+                        # BG減算済みスペクトル（n_average 枚の σ クリップ平均）を data2d の行へ直接書き込む
+                        var = None if var2d is None else var2d[i]
+                        with metrics.span("acquire", i):
+                            y = self.session.read_averaged(n_average, out=data2d[i], var_out=var, clip_sigma=CLIP_SIGMA)
+                        if self.session.background is not None:
+                            msg_bg = f"BG減算: 測定点 {i} でBGスペクトルを引きました"
+                            logger.debug(msg_bg)
+                        max_int = np.nanmax(y)
+                        measure_end = datetime.datetime.now()
+                        msg2 = f"測定完了: index={i}, max_intensity={max_int:.2f}, {measure_end.strftime('%H:%M:%S.%f')[:-3]}（測定{(measure_end-measure_start).total_seconds():.2f}秒）"
+                        logger.debug(msg2)
+                        # バイナリで追記（従来の txt は測定後に書き出す）
+                        with metrics.span("write", i):
+                            trace.append(y, t_axis[i], measure_end.timestamp(), var)
+                            columns.append(y, t_axis[i])
+                        with metrics.span("update", i):
+                            self.progressChanged.emit(int((i + 1) / loop_num * 100))
+                            self.columnAcquired.emit(i, t_axis[i], y)
+                        metrics.record("point", i, point_start)
+                    else:
+                        finished = True
+                finally:
+                    metrics.save()
+                    logger.info(f"所要時間の記録: {metrics.path}")
+                    # 中断・エラー時もそこまでの点で CSV を残す
+                    if len(columns) > 0:
+                        columns.write_csv(file_name_csv)
+                    columns.close()
+                trace.close(complete=finished)
+                export_txt(file_name_trc, file_name)
                 cur_pos = self.get_position()
                 self.posUpdated.emit(cur_pos if cur_pos is not None else -999999)
                 msg_fin = "測定完了"
-                self.logSignal.emit(msg_fin)
-                log_to_file(self.logpath, msg_fin)
+                logger.info(msg_fin)
                 self.dataSaved.emit(file_name_csv)
         except Exception as e:
             msg_err = f"測定中エラー: {e}"
-            self.logSignal.emit(msg_err)
-            log_to_file(self.logpath, msg_err)
+            logger.error(msg_err)
         self.finished.emit()
 
 class FROG_GUI(QtWidgets.QWidget):
@@ -193,13 +198,12 @@ class FROG_GUI(QtWidgets.QWidget):
         self.setGeometry(200, 100, 1280, 900)
 
         # デバイス・データ
-        self.spectrometer = None
+        self.session = None
         self.ser = None
+        self.stage = None
         self.measure_thread = None
         self.home_position = 0
-        self.im = None
-        self.cbar = None
-        self.bg_data = None
+        self.live_map = None
         self.current_position = None
 
         layout = QtWidgets.QVBoxLayout()
@@ -259,7 +263,12 @@ class FROG_GUI(QtWidgets.QWidget):
         self.integration_time_input = QtWidgets.QSpinBox()
         self.integration_time_input.setRange(1, 5000)
         self.integration_time_input.setValue(100)
-        param_layout.addRow("積分時間 [ms]", self.integration_time_input)
+        # ドライバの integration_time_micros へ渡す値そのもの（従来から µs）
+        param_layout.addRow("積分時間 [µs]", self.integration_time_input)
+        self.n_average_input = QtWidgets.QSpinBox()
+        self.n_average_input.setRange(1, 1000)
+        self.n_average_input.setValue(1)
+        param_layout.addRow("平均フレーム数 [枚/点]", self.n_average_input)
         self.step_size_input = QtWidgets.QSpinBox()
         self.step_size_input.setValue(1)
         self.step_size_input.setRange(1, 10000)
@@ -317,6 +326,9 @@ class FROG_GUI(QtWidgets.QWidget):
         # 進捗
         self.progress = QtWidgets.QProgressBar()
         layout.addWidget(self.progress)
+        # フェーズごとの所要時間（直近の p50/p95 [ms]）
+        self.metrics_label = QtWidgets.QLabel("")
+        layout.addWidget(self.metrics_label)
 
         # ログ
         self.log_text = QtWidgets.QTextEdit()
@@ -325,9 +337,29 @@ class FROG_GUI(QtWidgets.QWidget):
 
         self.setLayout(layout)
 
+        # ログはファイルへまとめて書き、画面にはタイマーでまとめて流す
+        log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log")
+        os.makedirs(log_dir, exist_ok=True)
+        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.logs = setup_logging(os.path.join(log_dir, f"{now}_FROG_gui.log"))
+        self.log_buffer = self.logs.gui_buffer(logging.INFO)
+        self.log_text.document().setMaximumBlockCount(LOG_MAX_BLOCKS)
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.drain_log)
+        self.log_timer.start(LOG_DRAIN_MS)
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.timeout.connect(self.refresh_live_map)
+
     def log(self, message):
-        now = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        self.log_text.append(f"[{now}] {message}")
+        logger.info(message)
+
+    def drain_log(self):
+        """溜まったログをまとめて表示する（多すぎる分は省略）"""
+        lines, dropped = self.log_buffer.drain(LOG_MAX_LINES)
+        if dropped:
+            lines.insert(0, f"… {dropped} 行省略")
+        if lines:
+            self.log_text.append("\n".join(lines))
 
     def update_position_label(self, pos=None):
         if pos is not None and isinstance(pos, int):
@@ -339,8 +371,7 @@ class FROG_GUI(QtWidgets.QWidget):
             self.position_label.setText("現在位置: 未取得")
             return
         try:
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            cur = self.ser.readline().decode('utf-8').strip()
+            cur = self.stage.axis_query("POS?")
             self.current_position = int(cur)
             self.position_label.setText(f"現在位置: {cur}")
             self.position_input.setValue(int(cur))
@@ -354,12 +385,9 @@ class FROG_GUI(QtWidgets.QWidget):
             return
         val = self.position_input.value()
         try:
-            cmd = f"AXIs1:POS={val}\r"
-            self.ser.write(cmd.encode('utf-8'))
+            self.stage.send(f"AXIs1:POS={val}")
             self.log(f"現在位置を {val} に手動設定しました")
-            time.sleep(0.3)
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            cur = self.ser.readline().decode('utf-8').strip()
+            cur = self.stage.axis_query("POS?")
             try:
                 new_pos = int(cur)
             except Exception:
@@ -381,9 +409,9 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log("seabreezeライブラリがインストールされていません")
             return
         try:
-            devices = sb.list_devices()
-            if devices:
-                self.spectrometer = sb.Spectrometer(devices[0])
+            session = SpectrometerSession.open()
+            if session is not None:
+                self.session = session
                 self.status_label.setText("USB4000 接続済み")
                 self.log("USB4000 に接続しました")
             else:
@@ -399,6 +427,7 @@ class FROG_GUI(QtWidgets.QWidget):
             if device_name in port.description:
                 try:
                     self.ser = serial.Serial(port.device, baudrate=9600, timeout=1)
+                    self.stage = DS102(self.ser)
                     self.status_label.setText(f"DS102 接続: {port.device}")
                     self.log(f"DS102 ({port.device}) に接続しました")
                     self.update_position_label()
@@ -413,8 +442,7 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log("DS102が接続されていません")
             return
         try:
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            cur = self.ser.readline().decode('utf-8').strip()
+            cur = self.stage.axis_query("POS?")
             self.home_position = int(cur)
             self.home_label.setText(f"HOME: {self.home_position}")
             self.log(f"HOME位置を {self.home_position} に設定しました")
@@ -422,14 +450,17 @@ class FROG_GUI(QtWidgets.QWidget):
         except Exception as e:
             self.log(f"HOME位置設定エラー: {e}")
 
+    def integration_time_ms(self):
+        """積分時間の入力 [µs] を ms にする"""
+        return self.integration_time_input.value() / 1000
+
     def measure_bg(self):
-        if not self.spectrometer:
+        if not self.session:
             self.log("USB4000が接続されていません")
             return
-        integration_time_ms = self.integration_time_input.value()
-        self.spectrometer.integration_time_micros(integration_time_ms)
-        time.sleep(integration_time_ms / 1000 + 0.2)
-        self.bg_data = self.spectrometer.intensities()[1002:]
+        integration_time_ms = self.integration_time_ms()
+        self.session.set_integration_time_ms(integration_time_ms)
+        self.session.measure_background()
         self.log("BG測定完了・BGスペクトルを記憶しました")
 
     def move_stage_manual(self):
@@ -443,25 +474,19 @@ class FROG_GUI(QtWidgets.QWidget):
         fspeed = self.fspeed_input.value()
         msg = f"手動ステージ移動: {pulses} パルス (fspeed={fspeed})"
         self.log(msg)
-        move_stage_and_wait(
-            self.ser, fspeed, abs(pulses),
-            0 if pulses >= 0 else 1,
-            gui_log=self.log
-        )
+        move_stage_and_wait(self.stage, fspeed, abs(pulses), 0 if pulses >= 0 else 1)
         self.update_position_label()
 
     def test_measurement(self):
-        if not self.spectrometer:
+        if not self.session:
             self.log("USB4000が接続されていません")
             return
-        integration_time_ms = self.integration_time_input.value()
+        integration_time_ms = self.integration_time_ms()
         try:
-            self.spectrometer.integration_time_micros(integration_time_ms)
-            time.sleep(integration_time_ms / 1000 + 0.2)
-            wavelengths = self.spectrometer.wavelengths()[1002:]
-            intensities = self.spectrometer.intensities()[1002:]
-            if self.bg_data is not None and len(intensities) == len(self.bg_data):
-                intensities = np.array(intensities) - np.array(self.bg_data)
+            self.session.set_integration_time_ms(integration_time_ms)
+            wavelengths = self.session.wavelengths
+            intensities = self.session.read().copy()
+            if self.session.background is not None:
                 self.log("BG減算：テスト測定でBGスペクトルを引きました")
             self.ax.clear()
             self.ax.plot(wavelengths, intensities, label="Test Spectrum")
@@ -470,12 +495,7 @@ class FROG_GUI(QtWidgets.QWidget):
             self.ax.set_ylabel("Intensity")
             self.ax.legend()
 
-            self.im_ax.clear()
-            self.im_ax.set_title("Time-Wavelength Map (FROG)")
-            self.im_ax.set_xlabel("Delay [fs]")
-            self.im_ax.set_ylabel("Wavelength [nm]")
-            self.im = None
-            self.cbar = None
+            self.clear_live_map()
 
             self.canvas.draw()
             max_int = np.nanmax(intensities)
@@ -485,25 +505,28 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log(f"テスト測定エラー: {e}")
 
     def start_measurement(self):
-        if not self.spectrometer or not self.ser:
+        if not self.session or not self.ser:
             self.log("デバイスが接続されていません")
             return
-        self.im = None
-        self.cbar = None
         params = {
-            'integration_time_ms': self.integration_time_input.value(),
+            'integration_time_ms': self.integration_time_ms(),
+            'n_average': self.n_average_input.value(),
             'step_size': self.step_size_input.value(),
             'range_input': self.range_input.value(),
             'home_position': self.home_position,
             'fspeed': self.fspeed_input.value(),
             'dt': 2 * self.step_size_input.value() * 10 ** (-6) / 299792458 * 10 ** 15
         }
-        self.measure_thread = MeasurementWorker(self.ser, self.spectrometer, params, self.bg_data)
+        self.measure_thread = MeasurementWorker(self.stage, self.session, params)
         self.measure_thread.progressChanged.connect(self.progress.setValue)
-        self.measure_thread.logSignal.connect(self.log)
         self.measure_thread.finished.connect(self.measurement_finished)
         self.measure_thread.dataSaved.connect(self.data_saved)
-        self.measure_thread.dataUpdated.connect(self.update_imshow)
+        self.measure_thread.columnAcquired.connect(self.add_live_column)
+        self.clear_live_map()
+        self.live_map = LiveFrogMap(self.im_ax, self.session.wavelengths, self.measure_thread.planned_delays(),
+                                    max_fps=LIVE_MAX_FPS)
+        self.canvas.draw_idle()
+        self.live_timer.start(int(1000 / LIVE_MAX_FPS))
         self.measure_thread.posUpdated.connect(self.update_position_label)
         self.progress.setValue(0)
         self.measure_btn.setEnabled(False)
@@ -517,6 +540,10 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log("中断要求を送信しました")
 
     def measurement_finished(self):
+        self.live_timer.stop()
+        if self.live_map is not None:
+            self.live_map.refresh(force=True)
+        self.update_metrics_label()
         self.measure_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         self.log("測定スレッド終了")
@@ -525,29 +552,35 @@ class FROG_GUI(QtWidgets.QWidget):
     def data_saved(self, filepath):
         self.log(f"データ保存完了: {filepath}")
 
-    def update_imshow(self, idx, arr, t_axis, wavelengths):
-        arr = np.array(arr)
-        if arr.shape[0] < 2:
-            return
-        vmax = np.nanmax(arr)
-        vmin = np.nanmin(arr)
-        if self.im is None or self.cbar is None:
-            self.im_ax.clear()
-            self.im = self.im_ax.imshow(
-                arr.T, aspect='auto', origin='lower',
-                extent=[t_axis[0], t_axis[arr.shape[0]-1], wavelengths[0], wavelengths[-1]],
-                interpolation='nearest', vmin=vmin, vmax=vmax
-            )
-            self.im_ax.set_title("Time-Wavelength Map (FROG)")
-            self.im_ax.set_xlabel("Delay [fs]")
-            self.im_ax.set_ylabel("Wavelength [nm]")
-            self.cbar = self.figure.colorbar(self.im, ax=self.im_ax, orientation='vertical')
-        else:
-            self.im.set_data(arr.T)
-            self.im.set_extent([t_axis[0], t_axis[arr.shape[0]-1], wavelengths[0], wavelengths[-1]])
-            self.im.set_clim(vmin, vmax)
-            self.cbar.update_normal(self.im)
-        self.canvas.draw()
+    def clear_live_map(self):
+        if self.live_map is not None:
+            self.live_map.remove()
+            self.live_map = None
+        self.im_ax.clear()
+        self.im_ax.set_title("Time-Wavelength Map (FROG)")
+        self.im_ax.set_xlabel("Delay [fs]")
+        self.im_ax.set_ylabel("Wavelength [nm]")
+
+    def add_live_column(self, idx, delay, spectrum):
+        # 列を書き込むだけ。描画は live_timer が上限フレームレートで行う
+        if self.live_map is not None:
+            self.live_map.add_column(delay, spectrum)
+
+    def refresh_live_map(self):
+        if self.live_map is not None:
+            self.live_map.refresh()
+        self.update_metrics_label()
+
+    def update_metrics_label(self):
+        metrics = self.measure_thread.metrics if self.measure_thread is not None else None
+        if metrics is not None and len(metrics):
+            self.metrics_label.setText("p50/p95 [ms]  " + metrics.format_live())
+
+    def closeEvent(self, event):
+        self.log_timer.stop()
+        self.drain_log()
+        self.logs.close()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
@@ -4,13 +4,19 @@ Created on 2023/11/08
 @author: Kitayama Daisuke
 ''' 
 
-import time,serial,os,datetime
+import time,serial,os,datetime,sys,logging
 import serial.tools.list_ports
 import pyvisa as visa
 import seabreeze.spectrometers as sb
+import numpy as np
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.ds102 import DS102
+from frog.logutil import setup_logging
+from frog.spectrometer import SpectrometerSession
+
 #ログファイルの設定。ログファイルは同じディレクトリ内のlogというフォルダに保存。フォルダがなければ作成
 current_dir = os.path.dirname(os.path.abspath(__file__))
 log_dir = os.path.join(current_dir, "log")
@@ -19,10 +25,12 @@ if not os.path.exists(log_dir):
 log_file = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_FROG.log")
 log_path = os.path.join(log_dir, log_file)
 
+# 書き込みはバックグラウンドでまとめて行う（終了時に残りを書き出す）
+setup_logging(log_path)
+logger = logging.getLogger("frog.measure")
+
 def log(message):
-    with open(log_path, "a",encoding='utf-8') as lf:
-        timestamp = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        lf.write(f"[{timestamp}] {message}\n")
+    logger.info(message)
 
 print("╔════════════════════════════════════════════╗")
 print("║    ~ FROG Measurement Program ~  ver 3.0   ║")
@@ -52,7 +60,7 @@ def check_device_parameters(ser):
 
 def check_parameter(ser, command, parameter_name):
     ser.write(command.encode('utf-8'))
-    response = ser.readline().decode('utf-8')
+    response = ser.read_until(b'\r').decode('utf-8')
     print(f"{parameter_name}: {response}")
     log(f"{parameter_name}: {response}")
 
@@ -90,17 +98,15 @@ def open_serial_connection(com_port):
 
 
 def move_stage(ser, fspeed, pulses, direction):
-    send_command(ser, f"AXIs1:Fspeed0 {fspeed}\r")
-    send_command(ser, f"AXIs1:PULS {pulses}:GO {direction}\r")
+    """移動して停止を待つ。タイムアウトしたら False"""
     print(" Moving...")
-
-    while True:
-        command = "AXIs1:MOTION?\r" 
-        ser.write(command.encode('utf-8'))
-        response = ser.readline().decode('utf-8').strip()
-        if "0" in response:
-            print(f" Paused")
-            break
+    # 移動時間を見積もって直前まで待ち、その後 SB1 のビジービットで停止を検出
+    if DS102(ser).move(pulses, direction, fspeed, timeout=60):
+        print(f" Paused")
+        return True
+    print(" Timeout")
+    log("Stage move timeout")
+    return False
 
 
 def send_command(ser, command):
@@ -148,6 +154,7 @@ def main():
     print("Connected to spectrometer USB4000.")
     print("-----------------------------------------")
     log("Connected to spectrometer USB4000.")
+    session = SpectrometerSession(spectrometer)
 
     # DS102への接続
     print("\n>> Connection test for SURUGA SEIKI DS102 USB Serial Port....")
@@ -246,15 +253,15 @@ def main():
     print(">> Move the stage to any position and measure with USB4000.")
 
     while True:
-        input_time = input(">> Integration time (/ms): ")
+        input_time = input(">> Integration time (/us): ")
         try:
-            integration_time_ms = int(input_time)
+            integration_time_us = int(input_time)
             break
         except ValueError:
             print("Invalid input. Please enter an integer.")
 
-    previous_integration_time_ms = integration_time_ms
-    log(f"Set Integration Time: {integration_time_ms} ms")
+    previous_integration_time_us = integration_time_us
+    log(f"Set Integration Time: {integration_time_us} us")
 
     while True:
         X = input(">> STEP SIZE (/pulse) [type 'ok' to finish, 'ORG' to set the ORIGINAL POINT]: ")
@@ -262,13 +269,13 @@ def main():
             print("Current position is set to the HOME POINT.")
             #現在の座標を確認し、ホームポジションに設定
             ser.write("AXIs1:POS?\r".encode('utf-8'))
-            current_position = int(ser.readline().decode('utf-8').strip())
+            current_position = int(ser.read_until(b'\r').decode('utf-8').strip())
             ser.write(f"AXIs1:HOMEP {current_position}\r".encode('utf-8'))
             log(f"Set HOME POSITION: {current_position}")
 
             #ホームポジションの確認
             ser.write("AXIs1:HOMEPosition?\r".encode('utf-8'))
-            home_position = int(ser.readline().decode('utf-8').strip())
+            home_position = int(ser.read_until(b'\r').decode('utf-8').strip())
             log(f"HOME POSITION: {home_position}")
 
             break
@@ -294,47 +301,44 @@ def main():
         input_time = input(">> Press Enter to measurement (or input the new integration time): ")
 
         if input_time == "":
-            integration_time_ms = previous_integration_time_ms
+            integration_time_us = previous_integration_time_us
         else:
             try:
-                integration_time_ms = int(input_time)
-                previous_integration_time_ms = integration_time_ms  
-                log(f"Set Integration Time: {integration_time_ms} ms")
+                integration_time_us = int(input_time)
+                previous_integration_time_us = integration_time_us  
+                log(f"Set Integration Time: {integration_time_us} us")
             except ValueError:
                 print("Invalid input. Please enter an integer.")
                 continue
 
-        spectrometer.integration_time_micros(integration_time_ms)
+        session.set_integration_time_ms(integration_time_us / 1000)
         print("Measuring...")
-        time.sleep(integration_time_ms / 1000 + 0.2)
-
-        spectrum = spectrometer.spectrum()
-        spectrum_max = spectrum[1]
+        spectrum_max = session.frames.acquire()
 
         max_intensity = max(spectrum_max[1000:1200])  # 390nm-500nmの範囲の最大強度を取得
 
         # 現在の座標をCPとする
         ser.write("AXIs1:POS?\r".encode('utf-8'))
-        CP = int(ser.readline().decode('utf-8').strip())
+        CP = int(ser.read_until(b'\r').decode('utf-8').strip())
         # 座標を時間軸に変換
         CP_time = 2 * CP * 10**(-6) / 299792458 * 10**15
 
         print("-------------------------------------------")
         check_current_position(ser)
         print(f"Time axis: {CP_time:.2f} fs")
-        print(f"Integration time: {integration_time_ms} ms")
+        print(f"Integration time: {integration_time_us} us")
         print(f"Max intensity: {max_intensity:.2f}")
         print("-------------------------------------------\n")
         log("-------------------------------------------")
         log(f"Time axis: {CP_time:.2f} fs")
-        log(f"Integration time: {integration_time_ms} ms")
+        log(f"Integration time: {integration_time_us} us")
         log(f"Max intensity: {max_intensity:.2f}")
         log("-------------------------------------------")
 
     
     #original pointの確認
     ser.write("AXIs1:ORG?\r".encode('utf-8'))
-    original_position = int(ser.readline().decode('utf-8').strip())
+    original_position = int(ser.read_until(b'\r').decode('utf-8').strip())
 
     print("\n>> Finish the setting of the ORIGIN POINT")
     print("-----------------------------------------")
@@ -430,8 +434,12 @@ def main():
             print("Invalid input. Please enter 'yes' or 'no'.")
     log(f"Measurement range is '{range_input * dt:.2f} fs'")    
     end_point = range_input + int(home_position)
+    #1点あたりの平均フレーム数（2以上なら外れ値を除いて平均し、分散も保存）
+    frames_input = input(">> Frames to average per point (default 1): ").strip()
+    n_average = int(frames_input) if frames_input.isdigit() and int(frames_input) > 0 else 1
+    log(f"Frames per point: {n_average}")
     #測定時間の概算
-    estimated_time = range_input / step_size * ((integration_time_ms / 1000) + 3)#3秒はステージの移動時間
+    estimated_time = range_input / step_size * ((n_average * integration_time_us / 1e6) + 3)#3秒はステージの移動時間
     #分、秒に変換
     estimated_time = divmod(estimated_time, 60)
     estimated_time = f"{int(estimated_time[0]):02d}:{int(estimated_time[1]):02d}"
@@ -458,7 +466,8 @@ def main():
     print(f"Step size: {step_size}")
     print(f"Measurement interval: {dt:.2f} fs")
     print(f"Measurement range is '{range_input * dt:.2f} fs'")
-    print(f"Integration time: {integration_time_ms} ms")
+    print(f"Integration time: {integration_time_us} us")
+    print(f"Frames per point: {n_average}")
     print(f"Start point: {home_position}")
     print(f"End point: {end_point}")
     print(f"Estimated time: {estimated_time}")
@@ -468,7 +477,7 @@ def main():
     log(f"Step size: {step_size}")
     log(f"Measurement interval: {dt:.2f} fs")
     log(f"Measurement range is '{range_input * dt:.2f} fs'")
-    log(f"Integration time: {integration_time_ms} ms")
+    log(f"Integration time: {integration_time_us} us")
     log(f"Start point: {home_position}")
     log(f"End point: {end_point}")
     log("-----------------------------------------------")
@@ -504,16 +513,21 @@ def main():
     # プログレスバーの設定
     bar_format = '{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]'
 
+    session.set_integration_time_ms(integration_time_us / 1000)
+    # 平均するときは画素ごとの分散を同じ形式で別ファイルに保存
+    var_file_name = file_name.replace("_FROG.txt", "_FROG_var.txt")
+    fv = open(var_file_name, "w") if n_average > 1 else None
+    var = np.empty(session.n_pixels) if n_average > 1 else None
     with open(file_name, "w") as f:
         f.write("\t")
-        x = spectrometer.wavelengths()[1002:]
+        x = session.wavelengths
         for x_value in x:
             f.write(str(x_value) + "\t")
         f.write("\n")
+        if fv:
+            fv.write("\t" + "".join(str(x_value) + "\t" for x_value in x) + "\n")
 
         for i in tqdm(range(int(loop_num)), bar_format=bar_format, ncols=75):
-            spectrometer.integration_time_micros(int(integration_time_ms))
-            time.sleep(int(integration_time_ms)/1000 + 1)
             #残り時間の計算
             elapsed_time = time.time() - start
             remaining_time = (elapsed_time / (i + 1)) * (loop_num - i - 1)
@@ -522,7 +536,7 @@ def main():
             #残り時間の表示
             print(f"Remaining time: {remaining_time}")
 
-            y = spectrometer.intensities()[1002:]  # 390nm以降の範囲のintensityを取得
+            y = session.read_averaged(n_average, var_out=var)  # 390nm以降の範囲のintensityを取得
 
             # スペクトラム書き込み
             delay = int(i) * dt
@@ -530,21 +544,34 @@ def main():
             for y_value in y:
                 f.write(str(y_value) + "\t")
             f.write("\n")
+            if fv:
+                fv.write(str(delay) + "\t" + "".join(str(v) + "\t" for v in var) + "\n")
 
-            # ステージ移動
-            move_stage(ser, fspeed=1000, pulses=step_size, direction=0)
+            # ステージ移動（止まらなければ以降の点は位置がずれるので測定を打ち切る）
+            ok = move_stage(ser, fspeed=1000, pulses=step_size, direction=0)
             log(f"Measuring at {i * step_size} pulse")
             log(f"Move stage {step_size} pulse")
             check_current_position(ser)
+            if not ok:
+                print(f"\nStage move timeout: measurement aborted after {i + 1} points")
+                log(f"Measurement aborted: stage move timeout after {i + 1} points")
+                completed = False
+                break
+        else:
+            completed = True
+    if fv:
+        fv.close()
+        log(f"Variance saved as '{var_file_name}'")
 
     elapsed_time = time.time() - start
+    status = "Measurement completed !!." if completed else "Measurement aborted (stage move timeout)."
     print("-----------------------------------------------")
-    print("\nMeasurement completed !!.")
+    print(f"\n{status}")
     print("-----------------------------------------------")
     print(f"Elapsed time: {format_time(elapsed_time)}")
     print(f"Data saved as '{file_name}'")
     log("-----------------------------------------------")
-    log("Measurement completed !!.")
+    log(status)
     log("-----------------------------------------------")
     log(f"Elapsed time: {format_time(elapsed_time)}")
     log(f"Data saved as '{file_name}'")
@@ -552,14 +579,11 @@ def main():
     # ホームポジションに戻る
     print("\n>> Move to the HOME POSITION")
     log("Move to the HOME POSITION")
-    send_command(ser, f"AXIs1:GO 3\r")
     print("Moving...")
-    while True:
-        send_command(ser, f"AXIs1:MOTION?\r")    
-        response = ser.readline().decode('utf-8').strip()
-        if "0" in response:
-            print(f"Paused")
-            break
+    stage = DS102(ser)
+    stage.start_command("GO 3")
+    if stage.wait_motion(timeout=120):
+        print(f"Paused")
 
     check_current_position(ser)
     
@@ -1,11 +1,14 @@
 import sys
+import os
 import numpy as np
-import pandas as pd
 from PyQt5 import QtWidgets
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.datacache import load_cached
+
 class CSVImshowGUI(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
@@ -54,15 +57,16 @@ class CSVImshowGUI(QtWidgets.QWidget):
             return
         self.file_label.setText(fname)
         try:
-            df = pd.read_csv(fname, index_col=None)
-            if df.shape[1] < 3:
+            # 2 回目以降はキャッシュの memmap を開くだけ
+            delays, wavelengths, intensity = load_cached(fname)
+            if len(delays) < 2:
                 QtWidgets.QMessageBox.warning(self, "エラー", "列数が不足しています。")
                 return
 
-            # 1列目：波長, 2列目以降：各時刻(fs)の強度
-            self.wavelengths = np.array(df.iloc[:, 0].values.astype(float))
-            self.t_axis = np.array([float(h) for h in df.columns[1:]])
-            self.data = df.iloc[:, 1:].values.astype(float)
+            # 強度は [波長本数, 時刻本数] で持つ
+            self.wavelengths = wavelengths
+            self.t_axis = delays
+            self.data = intensity.T
 
             # 波長を昇順でリストにしてプルダウンへ
             wl_list = list(np.round(np.sort(self.wavelengths), 2))
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import sys
-import csv
-import codecs
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 from PyQt5.QtWidgets import (
@@ -9,67 +8,18 @@ from PyQt5.QtWidgets import (
     QVBoxLayout, QWidget, QMessageBox
 )
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.loader import load_frog
+
 def load_data(filename):
     """
-    - UTF-8 BOM, Shift_JIS など自動判別
-    - 空行スキップ
-    - 1行目が全セル float なら「波長行」とみなす
-    - 2行目以降を intensity rows として読み込み
-    - 時間軸は行番号を使う
+    frog.loader で読み込む（txt / csv / frogtrc の形式は自動判別）
+    - 戻り値は (波長, 遅延（昇順）, 強度 (遅延数, 波長数))
     """
-    # 1) 文字コード判別＋CSV読み込み
-    encodings = ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']
-    rows = None
-    for enc in encodings:
-        try:
-            with codecs.open(filename, 'r', encoding=enc) as f:
-                reader = csv.reader(f)
-                rows = [r for r in reader if any(cell.strip() for cell in r)]
-            break
-        except:
-            rows = None
-    if not rows or len(rows) < 2:
+    delays, wavelengths, intensity = load_frog(filename).sorted()
+    if len(delays) == 0:
         raise ValueError("データ行がありません。\nファイルに2行目以降の数値があるかご確認ください。")
-
-    # 2) 1行目を float にできるか試す
-    first = rows[0]
-    try:
-        float_vals = list(map(float, first))
-        # 全部 float に変換できた → 波長行とみなす
-        wavelengths = float_vals
-        data_rows = rows[1:]
-        # 時間軸は行番号(0,1,2...)
-        times = list(range(len(data_rows)))
-    except:
-        # 1行目がヘッダ文字列の場合 ("step", "178.2",...)
-        header = [c.strip().lower() for c in first]
-        if header[0] not in ('step','time','t'):
-            raise ValueError("1行目がfloatでも'data'でもありません。\nstep,波長… の形式か、全floatの波長行を想定しています。")
-        try:
-            wavelengths = list(map(float, first[1:]))
-        except Exception as e:
-            raise ValueError(f"波長ヘッダのパース失敗: {e}")
-        # 2行目以降は [time, ints…]
-        data_rows = rows[1:]
-        times = []
-        for r in data_rows:
-            try:
-                times.append(float(r[0]))
-            except:
-                times.append(float('nan'))
-
-    # 3) 強度データ部分を float 配列に
-    intensity = []
-    for r in data_rows:
-        vals = r[1:] if len(r) > 1 else []
-        try:
-            intensity.append(list(map(float, vals)))
-        except Exception as e:
-            print(f"パースエラー: {e} 行={r}")
-    if not intensity:
-        raise ValueError("強度データが一つも読み込めませんでした")
-
-    return wavelengths, times, intensity
+    return wavelengths, delays, intensity
 
 class App(QMainWindow):
     def __init__(self):
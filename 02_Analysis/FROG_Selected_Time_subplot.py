@@ -1,29 +1,16 @@
 import sys
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QPushButton, QVBoxLayout, QWidget, QLabel, QListWidget
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.loader import load_frog
+
 def load_data(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-
-    # 波長軸を抽出
-    wavelengths = list(map(float, lines[0].strip().split()[0:]))
-
-    # 強度のデータを抽出
-    intensity_data = []
-    times = []
-    for line in lines[1:]:
-        values = line.strip().split()
-        # 1列目の時間を抽出
-        time = float(values[0])
-        # 時間軸を追加
-        times.append(time)
-        # 2列目以降の強度を抽出
-        intensities = list(map(float, values[1:]))
-        intensity_data.append(intensities)
-
-    return wavelengths, times, np.array(intensity_data)
+    # 形式（Ver3.0 の txt・GUI の txt / csv など）は frog.loader が判別する
+    delays, wavelengths, intensity = load_frog(filename)
+    return wavelengths.tolist(), delays.tolist(), intensity
 
 class App(QMainWindow):
     def __init__(self):
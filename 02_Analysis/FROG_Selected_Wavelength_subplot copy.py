@@ -1,23 +1,16 @@
 import sys
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QPushButton, QVBoxLayout, QWidget, QLabel, QListWidget
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.loader import load_frog
+
 def load_data(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-
-    wavelengths = list(map(float, lines[0].strip().split()[1:]))
-    intensity_data = []
-    times = []
-    for line in lines[1:]:
-        values = line.strip().split()
-        time = float(values[0])
-        times.append(time)
-        intensities = list(map(float, values[1:]))
-        intensity_data.append(intensities)
-
-    return wavelengths, times, np.array(intensity_data)
+    # 形式（Ver3.0 の txt・GUI の txt / csv など）は frog.loader が判別する
+    delays, wavelengths, intensity = load_frog(filename)
+    return wavelengths.tolist(), delays.tolist(), intensity
 
 class App(QMainWindow):
     def __init__(self):
@@ -1,192 +1,81 @@
 import sys
 import os
 import datetime
-import time
+import logging
 import numpy as np
-import pandas as pd
 import matplotlib
 matplotlib.use('Qt5Agg')
 from PyQt5 import QtWidgets, QtCore
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
-from scipy.optimize import curve_fit
 import serial
 import serial.tools.list_ports
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.aio import AsyncStage, EventLoopThread
+from frog.ds102 import DS102
+from frog.checkpoint import Checkpoint
+from frog.datacache import load_cached
+from frog.engine import ScanEngine, make_hdr
+from frog.fitting import MODELS, fit_curves, initial_guess
+from frog.liveview import LiveFrogMap
+from frog.logutil import setup_logging
+from frog.spectrometer import SpectrometerSession
+
 try:
     import seabreeze.spectrometers as sb
     seabreeze_imported = True
 except Exception:
     seabreeze_imported = False
 
-def log_to_file(logpath, message):
-    now = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-    with open(logpath, "a", encoding="utf-8") as lf:
-        lf.write(f"[{now}] {message}\n")
-
-def move_stage_and_wait(ser, fspeed, pulses, direction, gui_log=None, file_log=None):
-    try:
-        start_time = datetime.datetime.now()
-        msg = f"ステージ移動開始: fspeed={fspeed}, pulses={pulses}, direction={direction}"
-        if gui_log: gui_log(msg)
-        if file_log: file_log(msg)
-        cmd1 = f"AXIs1:Fspeed0 {fspeed}\r"
-        cmd2 = f"AXIs1:PULS {pulses}:GO {direction}\r"
-        ser.write(cmd1.encode('utf-8'))
-        ser.write(cmd2.encode('utf-8'))
-        for _ in range(120):
-            ser.write("AXIs1:MOTION?\r".encode('utf-8'))
-            resp = ser.readline().decode('utf-8').strip()
-            if resp == "0":
-                end_time = datetime.datetime.now()
-                msg2 = f"ステージ停止検出: {end_time.strftime('%H:%M:%S.%f')[:-3]}（移動に{(end_time - start_time).total_seconds():.2f}秒）"
-                if gui_log: gui_log(msg2)
-                if file_log: file_log(msg2)
-                return True
-            time.sleep(0.1)
-        msg3 = "ステージ移動タイムアウトエラー"
-        if gui_log: gui_log(msg3)
-        if file_log: file_log(msg3)
-        return False
-    except Exception as e:
-        msg4 = f"ステージ移動例外エラー: {e}"
-        if gui_log: gui_log(msg4)
-        if file_log: file_log(msg4)
-        return False
-
-def gaussian(x, a, mu, sigma, c):
-    return a * np.exp(-0.5 * ((x - mu) / sigma) ** 2) + c
+logger = logging.getLogger("frog.measure")
+
+# 画面のログ表示: 更新間隔 [ms]、1 回に表示する最大行数、保持する最大行数
+LOG_DRAIN_MS = 200
+LOG_MAX_LINES = 200
+LOG_MAX_BLOCKS = 5000
+
+# 測定中の FROG マップの最大再描画回数 [回/s]
+LIVE_MAX_FPS = 5
+
+# 往復スキャンの復路に使うバックラッシュのオフセット表（python -m frog.passes で作る）
+BACKLASH_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backlash.txt")
+# 測定データの保存先
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
 class MeasurementWorker(QtCore.QThread):
+    """frog.engine.ScanEngine を別スレッドで実行し、コールバックを Qt のシグナルにつなぐ"""
     progressChanged = QtCore.pyqtSignal(int)
-    logSignal = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal()
     dataSaved = QtCore.pyqtSignal(str)
-    dataUpdated = QtCore.pyqtSignal(int, object, object, object)
+    # 1 点取得するごと（点番号, 遅延[fs], スペクトル）
+    columnAcquired = QtCore.pyqtSignal(int, float, object)
     posUpdated = QtCore.pyqtSignal(int)
 
-    def __init__(self, ser, spectrometer, params, bg_data, parent=None):
+    def __init__(self, stage, session, params, parent=None, resume_from=None):
         super().__init__(parent)
-        self.ser = ser
-        self.spectrometer = spectrometer
-        self.params = params
-        self.bg_data = bg_data
-        self._is_running = True
+        self.engine = ScanEngine(
+            stage, session, params, DATA_DIR, backlash_table=BACKLASH_TABLE, resume_from=resume_from,
+            on_progress=self.progressChanged.emit,
+            on_column=self.columnAcquired.emit,
+            on_position=lambda pos: self.posUpdated.emit(pos if pos is not None else -999999),
+            on_saved=self.dataSaved.emit,
+        )
 
-        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.log_dir = os.path.join(current_dir, "log")
-        if not os.path.exists(self.log_dir):
-            os.makedirs(self.log_dir)
-        self.logpath = os.path.join(self.log_dir, f"{now}_FROG_gui.log")
+    @property
+    def metrics(self):
+        return self.engine.metrics
 
     def stop(self):
-        self._is_running = False
+        self.engine.stop()
 
-    def get_position(self):
-        try:
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            pos = self.ser.readline().decode('utf-8').strip()
-            return int(pos)
-        except Exception:
-            return None
+    def planned_delays(self):
+        """ライブ表示に使う遅延軸 [fs]"""
+        return self.engine.planned_delays()
 
     def run(self):
-        step_size = self.params['step_size']
-        range_input = self.params['range_input']
-        integration_time_ms = self.params['integration_time_ms']
-        home_position = self.params['home_position']
-        dt = self.params['dt']
-        fspeed = self.params['fspeed']
-
-        loop_num = range_input // step_size
-
-        wavelengths = self.spectrometer.wavelengths()[1002:]
-        n_wl = len(wavelengths)
-        t_axis = [i * dt for i in range(loop_num)]
-        data2d = np.zeros((loop_num, n_wl))
-
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        data_dir = os.path.join(current_dir, "data")
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = os.path.join(data_dir, f"{now}_FROG.txt")
-        file_name_csv = os.path.join(data_dir, f"{now}_FROG.csv")
-        self.logSignal.emit(f"測定データを {file_name} (txt) および {file_name_csv} (csv) に保存します")
-        log_to_file(self.logpath, f"測定データ保存先: {file_name} , {file_name_csv}")
-
-        try:
-            with open(file_name, "w", encoding="utf-8") as f, \
-                 open(file_name_csv, "w", encoding="utf-8", newline='') as fcsv:
-                header = "#delay/fs\t" + "\t".join(str(x) for x in wavelengths) + "\tmax_intensity\ttimestamp\n"
-                f.write(header)
-                header_csv = ["Wavelength[nm]"] + [f"{t:.2f}" for t in t_axis]
-                fcsv.write(",".join(header_csv) + "\n")
-                y_mat = []
-                for i in range(loop_num):
-                    if not self._is_running:
-                        msg = "測定をユーザーが中断しました。"
-                        self.logSignal.emit(msg)
-                        log_to_file(self.logpath, msg)
-                        break
-                    if i > 0:
-                        ok = move_stage_and_wait(
-                            self.ser, fspeed, step_size, 0,
-                            gui_log=self.logSignal.emit,
-                            file_log=lambda m: log_to_file(self.logpath, m)
-                        )
-                        if not ok:
-                            msg = "ステージ移動失敗により測定中断"
-                            self.logSignal.emit(msg)
-                            log_to_file(self.logpath, msg)
-                            break
-                    cur_pos = self.get_position()
-                    self.posUpdated.emit(cur_pos if cur_pos is not None else -999999)
-                    measure_start = datetime.datetime.now()
-                    msg1 = f"測定開始: index={i}, delay={t_axis[i]:.2f}fs, {measure_start.strftime('%H:%M:%S.%f')[:-3]}"
-                    self.logSignal.emit(msg1)
-                    log_to_file(self.logpath, msg1)
-                    self.spectrometer.integration_time_micros(integration_time_ms)
-                    time.sleep(integration_time_ms / 1000 + 0.2)
-                    y = self.spectrometer.intensities()[1002:]
-                    if self.bg_data is not None and len(y) == len(self.bg_data):
-                        y = np.array(y) - np.array(self.bg_data)
-                        msg_bg = f"BG減算: 測定点 {i} でBGスペクトルを引きました"
-                        self.logSignal.emit(msg_bg)
-                        log_to_file(self.logpath, msg_bg)
-                    max_int = np.nanmax(y)
-                    measure_end = datetime.datetime.now()
-                    msg2 = f"測定完了: index={i}, max_intensity={max_int:.2f}, {measure_end.strftime('%H:%M:%S.%f')[:-3]}（測定{(measure_end-measure_start).total_seconds():.2f}秒）"
-                    self.logSignal.emit(msg2)
-                    log_to_file(self.logpath, msg2)
-                    data2d[i, :] = y
-                    delay = t_axis[i]
-                    f.write(
-                        f"{delay:.2f}\t" +
-                        "\t".join(str(v) for v in y) +
-                        f"\t{max_int:.2f}\t{measure_end.strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]}\n"
-                    )
-                    y_mat.append(list(y))
-                    self.progressChanged.emit(int((i + 1) / loop_num * 100))
-                    self.dataUpdated.emit(i, data2d, t_axis, wavelengths)
-                if len(y_mat) > 0:
-                    y_mat = np.array(y_mat).T
-                    for iw, wl in enumerate(wavelengths):
-                        vals = [f"{y:.4f}" for y in y_mat[iw]] if y_mat.shape[1] > 0 else []
-                        line = [f"{wl:.1f}"] + vals
-                        fcsv.write(",".join(line) + "\n")
-                cur_pos = self.get_position()
-                self.posUpdated.emit(cur_pos if cur_pos is not None else -999999)
-                msg_fin = "測定完了"
-                self.logSignal.emit(msg_fin)
-                log_to_file(self.logpath, msg_fin)
-                self.dataSaved.emit(file_name_csv)
-        except Exception as e:
-            msg_err = f"測定中エラー: {e}"
-            self.logSignal.emit(msg_err)
-            log_to_file(self.logpath, msg_err)
+        self.engine.run()
         self.finished.emit()
 
 class CSVGraphPanel(QtWidgets.QWidget):
@@ -237,6 +126,9 @@ class CSVGraphPanel(QtWidgets.QWidget):
         self.fit_btn = QtWidgets.QPushButton("フィット＆FWHM計算")
         self.fit_btn.clicked.connect(self.do_fit_fwhm)
         fit_layout.addWidget(self.fit_btn)
+        self.model_combo = QtWidgets.QComboBox()
+        self.model_combo.addItems(list(MODELS))
+        fit_layout.addWidget(self.model_combo)
         fit_layout.addWidget(QtWidgets.QLabel("A:"))
         self.init_a = QtWidgets.QLineEdit("max")
         self.init_a.setMaximumWidth(70)
@@ -246,13 +138,16 @@ class CSVGraphPanel(QtWidgets.QWidget):
         self.init_mu.setMaximumWidth(70)
         fit_layout.addWidget(self.init_mu)
         fit_layout.addWidget(QtWidgets.QLabel("σ:"))
-        self.init_sigma = QtWidgets.QLineEdit("10")
+        self.init_sigma = QtWidgets.QLineEdit("auto")
         self.init_sigma.setMaximumWidth(70)
         fit_layout.addWidget(self.init_sigma)
         fit_layout.addWidget(QtWidgets.QLabel("c:"))
         self.init_c = QtWidgets.QLineEdit("min")
         self.init_c.setMaximumWidth(70)
         fit_layout.addWidget(self.init_c)
+        self.chirp_btn = QtWidgets.QPushButton("波長ごとにフィット")
+        self.chirp_btn.clicked.connect(self.plot_chirp_map)
+        fit_layout.addWidget(self.chirp_btn)
         fit_layout.addStretch()
         main_layout.addLayout(fit_layout)
         self.fwhm_label = QtWidgets.QLabel("FWHM: -")
@@ -289,14 +184,15 @@ class CSVGraphPanel(QtWidgets.QWidget):
             return
         self.file_label.setText(fname)
         try:
-            df = pd.read_csv(fname, index_col=None)
-            if df.shape[1] < 3:
+            # 2 回目以降はキャッシュの memmap を開くだけ
+            delays, wavelengths, intensity = load_cached(fname)
+            if len(delays) < 2:
                 QtWidgets.QMessageBox.warning(self, "エラー", "列数が不足しています。")
                 return
 
-            self.wavelengths = np.array(df.iloc[:, 0].values.astype(float))
-            self.t_axis = np.array([float(h) for h in df.columns[1:]])
-            self.data = df.iloc[:, 1:].values.astype(float)
+            self.wavelengths = wavelengths
+            self.t_axis = delays
+            self.data = intensity.T
 
             wl_list = list(np.round(np.sort(self.wavelengths), 2))
             self.wl_min_combo.clear()
@@ -401,25 +297,74 @@ class CSVGraphPanel(QtWidgets.QWidget):
             QtWidgets.QMessageBox.warning(self, "エラー", "先に時間積算プロットを実行してください。")
             return
         try:
-            a0 = np.max(y) if self.init_a.text() == "max" else float(self.init_a.text())
-            mu0 = x[np.argmax(y)] if self.init_mu.text() == "center" else float(self.init_mu.text())
-            sigma0 = float(self.init_sigma.text())
-            c0 = np.min(y) if self.init_c.text() == "min" else float(self.init_c.text())
-            p0 = [a0, mu0, sigma0, c0]
-            popt, _ = curve_fit(gaussian, x, y, p0=p0, maxfev=10000)
-            fit_curve = gaussian(x, *popt)
-            FWHM = 2.3548 * abs(popt[2])
+            # 空欄・max / center / auto / min はモーメントからの初期値
+            a0, mu0, w0, c0 = initial_guess(x, y[None])[0]
+            a0 = a0 if self.init_a.text() in ("", "max") else float(self.init_a.text())
+            mu0 = mu0 if self.init_mu.text() in ("", "center") else float(self.init_mu.text())
+            w0 = w0 if self.init_sigma.text() in ("", "auto") else 2.3548 * float(self.init_sigma.text())
+            c0 = c0 if self.init_c.text() in ("", "min") else float(self.init_c.text())
+            model = self.model_combo.currentText()
+            result = fit_curves(x, y, model, p0=[a0, mu0, w0, c0])
+            if not result.converged[0]:
+                raise RuntimeError("収束しませんでした")
+            x_fit = np.linspace(x.min(), x.max(), 400)
             ax = self.int_figure.gca()
-            ax.plot(x, fit_curve, 'r--', label="Gaussian Fit")
+            ax.plot(x_fit, result.curve(x_fit)[0], 'r--', label=f"{model} Fit")
             ax.legend()
             self.int_canvas.draw()
-            self.fwhm_label.setText(f"FWHM = {FWHM:.2f} fs")
+            self.fwhm_label.setText(f"FWHM = {result.fwhm[0]:.2f} ± {result.errors['fwhm'][0]:.2f} fs, "
+                                    f"中心 {result.center[0]:.2f} ± {result.errors['center'][0]:.2f} fs")
         except Exception as e:
             self.fwhm_label.setText("フィット失敗: " + str(e))
 
+    def plot_chirp_map(self):
+        """選んだ波長範囲の各波長を遅延方向に一度にフィットし、中心遅延と FWHM を波長に対して描く"""
+        if self.data is None or self.wavelengths is None or self.t_axis is None:
+            QtWidgets.QMessageBox.warning(self, "エラー", "まずCSVファイルを読み込んでください。")
+            return
+        try:
+            wl_min = float(self.wl_min_combo.currentText())
+            wl_max = float(self.wl_max_combo.currentText())
+        except Exception:
+            QtWidgets.QMessageBox.warning(self, "エラー", "波長の選択が不正です。")
+            return
+        if wl_min > wl_max:
+            wl_min, wl_max = wl_max, wl_min
+        idx = np.where((self.wavelengths >= wl_min) & (self.wavelengths <= wl_max))[0]
+        if len(idx) == 0:
+            QtWidgets.QMessageBox.warning(self, "エラー", "指定範囲にデータがありません。")
+            return
+        model = self.model_combo.currentText()
+        try:
+            result = fit_curves(self.t_axis, self.data[idx, :], model)
+        except ValueError as e:
+            self.fwhm_label.setText("フィット失敗: " + str(e))
+            return
+        valid = result.valid
+        wl = self.wavelengths[idx][valid]
+        self.int_figure.clf()
+        ax = self.int_figure.add_subplot(111)
+        ax.errorbar(wl, result.center[valid], yerr=result.errors["center"][valid], fmt='o', ms=3, label="中心遅延")
+        ax.set_xlabel("Wavelength [nm]")
+        ax.set_ylabel("Delay [fs]")
+        ax.set_title(f"波長ごとの {model} フィット（{wl_min:.2f}〜{wl_max:.2f} nm）")
+        ax.grid(True)
+        ax2 = ax.twinx()
+        ax2.plot(wl, result.fwhm[valid], 'r.', label="FWHM")
+        ax2.set_ylabel("FWHM [fs]")
+        self.int_canvas.draw()
+        self.fwhm_label.setText(f"{len(idx)} 波長中 {int(valid.sum())} 本をフィット（{result.elapsed * 1000:.0f} ms）")
+
 class FROG_GUI(QtWidgets.QWidget):
+    # 非同期のステージ移動が終わったとき（成功したか, 例外メッセージ）
+    stageMoved = QtCore.pyqtSignal(bool, str)
+
     def __init__(self):
         super().__init__()
+        # 手動移動などの装置操作はこのイベントループで実行し、GUI スレッドを止めない
+        self.bridge = EventLoopThread()
+        self.astage = None
+        self.stageMoved.connect(self.stage_move_finished)
         self.setWindowTitle("FROG Measurement & CSV Analysis GUI")
         self.setGeometry(100, 50, 1300, 950)
         tabs = QtWidgets.QTabWidget()
@@ -431,6 +376,19 @@ class FROG_GUI(QtWidgets.QWidget):
         main_layout.addWidget(tabs)
         self.setLayout(main_layout)
 
+        # ログはファイルへまとめて書き、画面にはタイマーでまとめて流す
+        log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log")
+        os.makedirs(log_dir, exist_ok=True)
+        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.logs = setup_logging(os.path.join(log_dir, f"{now}_FROG_gui.log"))
+        self.log_buffer = self.logs.gui_buffer(logging.INFO)
+        self.log_text.document().setMaximumBlockCount(LOG_MAX_BLOCKS)
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.drain_log)
+        self.log_timer.start(LOG_DRAIN_MS)
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.timeout.connect(self.refresh_live_map)
+
     def create_measure_tab(self):
         tab = QtWidgets.QWidget()
         layout = QtWidgets.QVBoxLayout(tab)
@@ -475,7 +433,12 @@ class FROG_GUI(QtWidgets.QWidget):
         self.integration_time_input = QtWidgets.QSpinBox()
         self.integration_time_input.setRange(1, 5000)
         self.integration_time_input.setValue(100)
-        param_layout.addRow("積分時間 [ms]", self.integration_time_input)
+        # ドライバの integration_time_micros へ渡す値そのもの（従来から µs）
+        param_layout.addRow("積分時間 [µs]", self.integration_time_input)
+        self.n_average_input = QtWidgets.QSpinBox()
+        self.n_average_input.setRange(1, 1000)
+        self.n_average_input.setValue(1)
+        param_layout.addRow("平均フレーム数 [枚/点]", self.n_average_input)
         self.step_size_input = QtWidgets.QSpinBox()
         self.step_size_input.setValue(1)
         self.step_size_input.setRange(1, 10000)
@@ -488,6 +451,27 @@ class FROG_GUI(QtWidgets.QWidget):
         self.fspeed_input.setValue(1000)
         self.fspeed_input.setRange(10, 20000)
         param_layout.addRow("移動速度 [fspeed]", self.fspeed_input)
+        self.fly_scan_check = QtWidgets.QCheckBox("連続スキャン（ステージ移動中に連続取得）")
+        param_layout.addRow("スキャン方式", self.fly_scan_check)
+        self.adaptive_check = QtWidgets.QCheckBox("適応サンプリング（粗く測ってから信号のある所を細かく）")
+        param_layout.addRow("遅延点", self.adaptive_check)
+        self.coarse_step_input = QtWidgets.QSpinBox()
+        self.coarse_step_input.setValue(5)
+        self.coarse_step_input.setRange(1, 10000)
+        param_layout.addRow("粗いステップ [pulse]", self.coarse_step_input)
+        self.hdr_check = QtWidgets.QCheckBox("HDR（点ごとに積分時間を自動調整。積分時間は上限）")
+        param_layout.addRow("露光", self.hdr_check)
+        self.hdr_bracket_input = QtWidgets.QSpinBox()
+        self.hdr_bracket_input.setRange(1, 64)
+        self.hdr_bracket_input.setValue(1)
+        param_layout.addRow("ブラケット倍率（1 で無効）", self.hdr_bracket_input)
+        self.n_passes_input = QtWidgets.QSpinBox()
+        self.n_passes_input.setRange(1, 20)
+        self.n_passes_input.setValue(1)
+        param_layout.addRow("パス数", self.n_passes_input)
+        self.bidirectional_check = QtWidgets.QCheckBox("往復スキャン（復路でも取得し、オフセット表で補正）")
+        self.bidirectional_check.setChecked(True)
+        param_layout.addRow("パス方向", self.bidirectional_check)
         layout.addLayout(param_layout)
         bg_layout = QtWidgets.QHBoxLayout()
         self.bg_btn = QtWidgets.QPushButton("BG測定")
@@ -515,29 +499,42 @@ class FROG_GUI(QtWidgets.QWidget):
         self.stop_btn.setEnabled(False)
         self.stop_btn.clicked.connect(self.stop_measurement)
         ctrl_layout.addWidget(self.stop_btn)
+        self.resume_btn = QtWidgets.QPushButton("中断した測定を再開")
+        self.resume_btn.clicked.connect(self.resume_measurement)
+        ctrl_layout.addWidget(self.resume_btn)
         self.test_btn = QtWidgets.QPushButton("テスト測定（1点取得）")
         self.test_btn.clicked.connect(self.test_measurement)
         ctrl_layout.addWidget(self.test_btn)
         layout.addLayout(ctrl_layout)
         self.progress = QtWidgets.QProgressBar()
         layout.addWidget(self.progress)
+        # フェーズごとの所要時間（直近の p50/p95 [ms]）
+        self.metrics_label = QtWidgets.QLabel("")
+        layout.addWidget(self.metrics_label)
         self.log_text = QtWidgets.QTextEdit()
         self.log_text.setReadOnly(True)
         layout.addWidget(self.log_text)
-        self.spectrometer = None
+        self.session = None
+        self.hdr_background = None
         self.ser = None
+        self.stage = None
         self.measure_thread = None
         self.home_position = 0
-        self.im = None
-        self.cbar = None
-        self.bg_data = None
+        self.live_map = None
         self.current_position = None
         return tab
 
     # 測定タブ用のメソッド（省略なし、前回の通りです）
     def log(self, message):
-        now = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        self.log_text.append(f"[{now}] {message}")
+        logger.info(message)
+
+    def drain_log(self):
+        """溜まったログをまとめて表示する（多すぎる分は省略）"""
+        lines, dropped = self.log_buffer.drain(LOG_MAX_LINES)
+        if dropped:
+            lines.insert(0, f"… {dropped} 行省略")
+        if lines:
+            self.log_text.append("\n".join(lines))
 
     def update_position_label(self, pos=None):
         if pos is not None and isinstance(pos, int):
@@ -549,8 +546,7 @@ class FROG_GUI(QtWidgets.QWidget):
             self.position_label.setText("現在位置: 未取得")
             return
         try:
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            cur = self.ser.readline().decode('utf-8').strip()
+            cur = self.stage.axis_query("POS?")
             self.current_position = int(cur)
             self.position_label.setText(f"現在位置: {cur}")
             self.position_input.setValue(int(cur))
@@ -564,12 +560,9 @@ class FROG_GUI(QtWidgets.QWidget):
             return
         val = self.position_input.value()
         try:
-            cmd = f"AXIs1:POS={val}\r"
-            self.ser.write(cmd.encode('utf-8'))
+            self.stage.send(f"AXIs1:POS={val}")
             self.log(f"現在位置を {val} に手動設定しました")
-            time.sleep(0.3)
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            cur = self.ser.readline().decode('utf-8').strip()
+            cur = self.stage.axis_query("POS?")
             try:
                 new_pos = int(cur)
             except Exception:
@@ -591,9 +584,9 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log("seabreezeライブラリがインストールされていません")
             return
         try:
-            devices = sb.list_devices()
-            if devices:
-                self.spectrometer = sb.Spectrometer(devices[0])
+            session = SpectrometerSession.open()
+            if session is not None:
+                self.session = session
                 self.status_label.setText("USB4000 接続済み")
                 self.log("USB4000 に接続しました")
             else:
@@ -609,6 +602,8 @@ class FROG_GUI(QtWidgets.QWidget):
             if device_name in port.description:
                 try:
                     self.ser = serial.Serial(port.device, baudrate=9600, timeout=1)
+                    self.stage = DS102(self.ser)
+                    self.astage = AsyncStage(self.stage)
                     self.status_label.setText(f"DS102 接続: {port.device}")
                     self.log(f"DS102 ({port.device}) に接続しました")
                     self.update_position_label()
@@ -623,8 +618,7 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log("DS102が接続されていません")
             return
         try:
-            self.ser.write("AXIs1:POS?\r".encode('utf-8'))
-            cur = self.ser.readline().decode('utf-8').strip()
+            cur = self.stage.axis_query("POS?")
             self.home_position = int(cur)
             self.home_label.setText(f"HOME: {self.home_position}")
             self.log(f"HOME位置を {self.home_position} に設定しました")
@@ -632,14 +626,24 @@ class FROG_GUI(QtWidgets.QWidget):
         except Exception as e:
             self.log(f"HOME位置設定エラー: {e}")
 
+    def integration_time_ms(self):
+        """積分時間の入力 [µs] を ms にする"""
+        return self.integration_time_input.value() / 1000
+
     def measure_bg(self):
-        if not self.spectrometer:
+        if not self.session:
             self.log("USB4000が接続されていません")
             return
-        integration_time_ms = self.integration_time_input.value()
-        self.spectrometer.integration_time_micros(integration_time_ms)
-        time.sleep(integration_time_ms / 1000 + 0.2)
-        self.bg_data = self.spectrometer.intensities()[1002:]
+        integration_time_ms = self.integration_time_ms()
+        if self.hdr_check.isChecked():
+            # HDR では積分時間の段ごとに BG を取り、オフセットと暗電流を当てはめる
+            params = {'integration_time_ms': integration_time_ms, 'n_average': self.n_average_input.value()}
+            hdr = make_hdr(self.session, params)
+            self.hdr_background = hdr.measure_background()
+            self.log(f"BG測定完了・HDR 用に {len(hdr.ladder)} 段の積分時間で BG を記憶しました")
+            return
+        self.session.set_integration_time_ms(integration_time_ms)
+        self.session.measure_background()
         self.log("BG測定完了・BGスペクトルを記憶しました")
 
     def move_stage_manual(self):
@@ -653,25 +657,40 @@ class FROG_GUI(QtWidgets.QWidget):
         fspeed = self.fspeed_input.value()
         msg = f"手動ステージ移動: {pulses} パルス (fspeed={fspeed})"
         self.log(msg)
-        move_stage_and_wait(
-            self.ser, fspeed, abs(pulses),
-            0 if pulses >= 0 else 1,
-            gui_log=self.log
+        self.move_btn.setEnabled(False)
+        self.bridge.submit(
+            self.astage.move(abs(pulses), 0 if pulses >= 0 else 1, fspeed),
+            done_callback=self._emit_stage_moved
         )
+
+    def _emit_stage_moved(self, future):
+        # イベントループのスレッドから呼ばれるので、シグナル経由で GUI スレッドへ渡す
+        try:
+            self.stageMoved.emit(bool(future.result()), "")
+        except Exception as e:
+            self.stageMoved.emit(False, str(e))
+
+    def stage_move_finished(self, ok, error):
+        if error:
+            self.log(f"ステージ移動エラー: {error}")
+        elif not ok:
+            self.log("ステージ移動タイムアウト")
+        else:
+            self.log(f"ステージ移動完了 ({self.stage.last_move_time:.3f} s)")
+        if not (self.measure_thread and self.measure_thread.isRunning()):
+            self.move_btn.setEnabled(True)
         self.update_position_label()
 
     def test_measurement(self):
-        if not self.spectrometer:
+        if not self.session:
             self.log("USB4000が接続されていません")
             return
-        integration_time_ms = self.integration_time_input.value()
+        integration_time_ms = self.integration_time_ms()
         try:
-            self.spectrometer.integration_time_micros(integration_time_ms)
-            time.sleep(integration_time_ms / 1000 + 0.2)
-            wavelengths = self.spectrometer.wavelengths()[1002:]
-            intensities = self.spectrometer.intensities()[1002:]
-            if self.bg_data is not None and len(intensities) == len(self.bg_data):
-                intensities = np.array(intensities) - np.array(self.bg_data)
+            self.session.set_integration_time_ms(integration_time_ms)
+            wavelengths = self.session.wavelengths
+            intensities = self.session.read().copy()
+            if self.session.background is not None:
                 self.log("BG減算：テスト測定でBGスペクトルを引きました")
             self.ax.clear()
             self.ax.plot(wavelengths, intensities, label="Test Spectrum")
@@ -679,12 +698,7 @@ class FROG_GUI(QtWidgets.QWidget):
             self.ax.set_xlabel("Wavelength [nm]")
             self.ax.set_ylabel("Intensity")
             self.ax.legend()
-            self.im_ax.clear()
-            self.im_ax.set_title("Time-Wavelength Map (FROG)")
-            self.im_ax.set_xlabel("Delay [fs]")
-            self.im_ax.set_ylabel("Wavelength [nm]")
-            self.im = None
-            self.cbar = None
+            self.clear_live_map()
             self.canvas.draw()
             max_int = np.nanmax(intensities)
             self.log(f"テスト測定完了: 最大強度={max_int:.1f}")
@@ -693,28 +707,61 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log(f"テスト測定エラー: {e}")
 
     def start_measurement(self):
-        if not self.spectrometer or not self.ser:
+        if not self.session or not self.ser:
             self.log("デバイスが接続されていません")
             return
-        self.im = None
-        self.cbar = None
         params = {
-            'integration_time_ms': self.integration_time_input.value(),
+            'integration_time_ms': self.integration_time_ms(),
+            'n_average': self.n_average_input.value(),
             'step_size': self.step_size_input.value(),
             'range_input': self.range_input.value(),
             'home_position': self.home_position,
             'fspeed': self.fspeed_input.value(),
+            'fly_scan': self.fly_scan_check.isChecked(),
+            'adaptive': self.adaptive_check.isChecked() and not self.fly_scan_check.isChecked(),
+            'coarse_step': self.coarse_step_input.value(),
+            'hdr': self.hdr_check.isChecked() and not self.fly_scan_check.isChecked(),
+            'hdr_bracket': self.hdr_bracket_input.value(),
+            'n_passes': self.n_passes_input.value(),
+            'bidirectional': self.bidirectional_check.isChecked(),
+            'hdr_background': self.hdr_background,
             'dt': 2 * self.step_size_input.value() * 10 ** (-6) / 299792458 * 10 ** 15
         }
-        self.measure_thread = MeasurementWorker(self.ser, self.spectrometer, params, self.bg_data)
+        self.start_worker(params)
+
+    def resume_measurement(self):
+        """チェックポイントを選んで、HOME で位置を確かめてから続きの点を測る"""
+        if not self.session or not self.ser:
+            self.log("デバイスが接続されていません")
+            return
+        fname, _ = QtWidgets.QFileDialog.getOpenFileName(self, "チェックポイントを開く", DATA_DIR,
+                                                         "Checkpoint (*.checkpoint.npz)")
+        if not fname:
+            return
+        try:
+            checkpoint = Checkpoint.load(fname)
+        except Exception as e:
+            self.log(f"チェックポイント読み込みエラー: {e}")
+            return
+        self.log(f"{checkpoint.files.get('trace')} の {checkpoint.n_done} 点目から再開します")
+        self.start_worker(None, resume_from=checkpoint)
+
+    def start_worker(self, params, resume_from=None):
+        self.measure_thread = MeasurementWorker(self.stage, self.session, params, resume_from=resume_from)
         self.measure_thread.progressChanged.connect(self.progress.setValue)
-        self.measure_thread.logSignal.connect(self.log)
         self.measure_thread.finished.connect(self.measurement_finished)
         self.measure_thread.dataSaved.connect(self.data_saved)
-        self.measure_thread.dataUpdated.connect(self.update_imshow)
+        self.measure_thread.columnAcquired.connect(self.add_live_column)
+        self.clear_live_map()
+        self.live_map = LiveFrogMap(self.im_ax, self.session.wavelengths, self.measure_thread.planned_delays(),
+                                    max_fps=LIVE_MAX_FPS)
+        self.canvas.draw_idle()
+        self.live_timer.start(int(1000 / LIVE_MAX_FPS))
         self.measure_thread.posUpdated.connect(self.update_position_label)
         self.progress.setValue(0)
         self.measure_btn.setEnabled(False)
+        self.resume_btn.setEnabled(False)
+        self.move_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
         self.log("測定を開始します")
         self.measure_thread.start()
@@ -725,7 +772,13 @@ class FROG_GUI(QtWidgets.QWidget):
             self.log("中断要求を送信しました")
 
     def measurement_finished(self):
+        self.live_timer.stop()
+        if self.live_map is not None:
+            self.live_map.refresh(force=True)
+        self.update_metrics_label()
         self.measure_btn.setEnabled(True)
+        self.resume_btn.setEnabled(True)
+        self.move_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         self.log("測定スレッド終了")
         self.update_position_label()
@@ -733,29 +786,38 @@ class FROG_GUI(QtWidgets.QWidget):
     def data_saved(self, filepath):
         self.log(f"データ保存完了: {filepath}")
 
-    def update_imshow(self, idx, arr, t_axis, wavelengths):
-        arr = np.array(arr)
-        if arr.shape[0] < 2:
-            return
-        vmax = np.nanmax(arr)
-        vmin = np.nanmin(arr)
-        if self.im is None or self.cbar is None:
-            self.im_ax.clear()
-            self.im = self.im_ax.imshow(
-                arr.T, aspect='auto', origin='lower',
-                extent=[t_axis[0], t_axis[arr.shape[0]-1], wavelengths[0], wavelengths[-1]],
-                interpolation='nearest', vmin=vmin, vmax=vmax
-            )
-            self.im_ax.set_title("Time-Wavelength Map (FROG)")
-            self.im_ax.set_xlabel("Delay [fs]")
-            self.im_ax.set_ylabel("Wavelength [nm]")
-            self.cbar = self.figure.colorbar(self.im, ax=self.im_ax, orientation='vertical')
-        else:
-            self.im.set_data(arr.T)
-            self.im.set_extent([t_axis[0], t_axis[arr.shape[0]-1], wavelengths[0], wavelengths[-1]])
-            self.im.set_clim(vmin, vmax)
-            self.cbar.update_normal(self.im)
-        self.canvas.draw()
+    def clear_live_map(self):
+        if self.live_map is not None:
+            self.live_map.remove()
+            self.live_map = None
+        self.im_ax.clear()
+        self.im_ax.set_title("Time-Wavelength Map (FROG)")
+        self.im_ax.set_xlabel("Delay [fs]")
+        self.im_ax.set_ylabel("Wavelength [nm]")
+
+    def add_live_column(self, idx, delay, spectrum):
+        # 列を書き込むだけ。描画は live_timer が上限フレームレートで行う
+        if self.live_map is not None:
+            self.live_map.add_column(delay, spectrum)
+
+    def refresh_live_map(self):
+        if self.live_map is not None:
+            self.live_map.refresh()
+        self.update_metrics_label()
+
+    def update_metrics_label(self):
+        metrics = self.measure_thread.metrics if self.measure_thread is not None else None
+        if metrics is not None and len(metrics):
+            self.metrics_label.setText("p50/p95 [ms]  " + metrics.format_live())
+
+    def closeEvent(self, event):
+        if self.astage is not None:
+            self.astage.close()
+        self.bridge.stop()
+        self.log_timer.stop()
+        self.drain_log()
+        self.logs.close()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
@@ -5,13 +5,18 @@ Created on 2023/11/08
 Improved & refactored 2025/05/15
 '''
 
-import time, serial, os, datetime
+import time, serial, os, datetime, sys, logging
 import serial.tools.list_ports
 import pyvisa as visa
 import seabreeze.spectrometers as sb
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frog.ds102 import DS102
+from frog.logutil import setup_logging
+from frog.spectrometer import SpectrometerSession
+
 # ログファイル設定
 current_dir = os.path.dirname(os.path.abspath(__file__))
 log_dir = os.path.join(current_dir, "log")
@@ -20,10 +25,12 @@ if not os.path.exists(log_dir):
 log_file = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_FROG.log")
 log_path = os.path.join(log_dir, log_file)
 
+# 書き込みはバックグラウンドでまとめて行う（終了時に残りを書き出す）
+setup_logging(log_path)
+logger = logging.getLogger("frog.measure")
+
 def log(message):
-    with open(log_path, "a", encoding='utf-8') as lf:
-        timestamp = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        lf.write(f"[{timestamp}] {message}\n")
+    logger.info(message)
 
 def format_time(seconds):
     hours, remainder = divmod(seconds, 3600)
@@ -40,6 +47,7 @@ class StageController:
         self.device_name = device_name
         self.com_port = self.find_device_port()
         self.ser = None
+        self.ds102 = None
 
     def find_device_port(self):
         ports = serial.tools.list_ports.comports()
@@ -53,6 +61,7 @@ class StageController:
             raise RuntimeError(f"Device port for '{self.device_name}' not found.")
         try:
             self.ser = serial.Serial(self.com_port, baudrate=9600, timeout=1)
+            self.ds102 = DS102(self.ser)
             return True
         except Exception as e:
             log(f"Error opening serial port: {e}")
@@ -62,18 +71,22 @@ class StageController:
         self.ser.write(command.encode('utf-8'))
 
     def readline(self):
-        return self.ser.readline().decode('utf-8').strip()
+        # DS102 の応答は CR 終端
+        return self.ser.read_until(b'\r').decode('utf-8').strip()
 
     def move_stage(self, fspeed, pulses, direction):
-        self.send_command(f"AXIs1:Fspeed0 {fspeed}\r")
-        self.send_command(f"AXIs1:PULS {pulses}:GO {direction}\r")
+        """移動して停止を待つ。タイムアウトしたら False"""
         print(" Moving stage...")
-        while True:
-            self.send_command("AXIs1:MOTION?\r")
-            response = self.readline()
-            if "0" in response:
-                print(" Paused")
-                break
+        if self.ds102.move(pulses, direction, fspeed, timeout=60):
+            print(" Paused")
+            return True
+        print(" Timeout")
+        log("Stage move timeout")
+        return False
+
+    def return_home(self):
+        self.ds102.start_command("GO 3")
+        return self.ds102.wait_motion(timeout=120)
 
     def check_current_position(self):
         self.send_command("AXIs1:POS?\r")
@@ -110,6 +123,7 @@ class SpectrometerController:
     def __init__(self, target_model_name='USB4000'):
         self.target_model_name = target_model_name
         self.spectrometer = None
+        self.session = None
 
     def connect(self):
         devices = sb.list_devices()
@@ -117,21 +131,26 @@ class SpectrometerController:
             spec = sb.Spectrometer(device)
             if spec.model == self.target_model_name:
                 self.spectrometer = spec
+                self.session = SpectrometerSession(spec)
                 return True
         return False
 
     def set_integration_time(self, integration_time_ms):
-        self.spectrometer.integration_time_micros(integration_time_ms * 1000)
+        self.session.set_integration_time_ms(integration_time_ms)
 
     def get_spectrum(self):
         return self.spectrometer.spectrum()
 
     def get_wavelengths(self):
-        return self.spectrometer.wavelengths()
+        return self.session.wavelengths
 
     def get_intensities(self):
         return self.spectrometer.intensities()
 
+    def acquire(self):
+        """ステージ静定後の新しいフレーム（ROI）を取得"""
+        return self.session.read()
+
     def close(self):
         if self.spectrometer:
             self.spectrometer.close()
@@ -234,53 +253,55 @@ def main():
     start = time.time()
     bar_format = '{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]'
 
+    spectro.set_integration_time(integration_time_ms)
     with open(file_name, "w", encoding="utf-8") as f:
         f.write("\t")
-        x = spectro.get_wavelengths()[1002:]
+        x = spectro.get_wavelengths()
         for x_value in x:
             f.write(str(x_value) + "\t")
         f.write("\n")
         for i in tqdm(range(int(loop_num)), bar_format=bar_format, ncols=75):
-            spectro.set_integration_time(integration_time_ms)
-            time.sleep(integration_time_ms/1000 + 1)
             elapsed_time = time.time() - start
             remaining_time = (elapsed_time / (i + 1)) * (loop_num - i - 1)
             remaining_time = divmod(remaining_time, 60)
             remaining_time = f"{int(remaining_time[0]):02d}:{int(remaining_time[1]):02d}"
             print(f"Remaining time: {remaining_time}")
-            y = spectro.get_intensities()[1002:]
+            y = spectro.acquire()
             delay = int(i) * dt
             f.write(str(delay) + "\t")
             for y_value in y:
                 f.write(str(y_value) + "\t")
             f.write("\n")
-            # ステージ移動
-            stage.move_stage(fspeed=1000, pulses=step_size, direction=0)
+            # ステージ移動（止まらなければ以降の点は位置がずれるので測定を打ち切る）
+            ok = stage.move_stage(fspeed=1000, pulses=step_size, direction=0)
             log(f"Measuring at {i * step_size} pulse")
             log(f"Move stage {step_size} pulse")
             stage.check_current_position()
+            if not ok:
+                print(f"\nStage move timeout: measurement aborted after {i + 1} points")
+                log(f"Measurement aborted: stage move timeout after {i + 1} points")
+                completed = False
+                break
+        else:
+            completed = True
 
     elapsed_time = time.time() - start
+    status = "Measurement completed !!." if completed else "Measurement aborted (stage move timeout)."
     print("-----------------------------------------------")
-    print("\nMeasurement completed !!.")
+    print(f"\n{status}")
     print("-----------------------------------------------")
     print(f"Elapsed time: {format_time(elapsed_time)}")
     print(f"Data saved as '{file_name}'")
-    log("Measurement completed !!.")
+    log(status)
     log(f"Elapsed time: {format_time(elapsed_time)}")
     log(f"Data saved as '{file_name}'")
 
     # ホームポジションに戻る
     print("\n>> Move to the HOME POSITION")
     log("Move to the HOME POSITION")
-    stage.send_command(f"AXIs1:GO 3\r")
     print("Moving...")
-    while True:
-        stage.send_command(f"AXIs1:MOTION?\r")
-        response = stage.readline()
-        if "0" in response:
-            print("Paused")
-            break
+    if stage.return_home():
+        print("Paused")
     stage.check_current_position()
 
     print("\n>> Program exit")
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+FROG 測定・解析スクリプトから共通に使うモジュール群
+
+各スクリプトはリポジトリ直下を sys.path に追加してから import する。
+"""
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio による DS102 の非同期移動（GUI の手動移動用）
+
+ブロッキングなドライバ呼び出しは装置ごとに 1 本のスレッド（executor）で実行し、
+予測移動時間の間は executor を空けておく。GUI からは EventLoopThread 経由でコルーチンを投入する。
+測定のスキャンループは frog.engine（スレッドのパイプライン）が受け持つ。
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncStage:
+    """frog.ds102.DS102 の移動を非同期にする（呼び出しは専用スレッド 1 本に直列化する）"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ds102")
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def move(self, pulses, direction, fspeed, timeout=12.0):
+        """移動して停止を待つ。予測移動時間の間は executor を空けておく"""
+        predicted = await self._call(self.stage.start_move, pulses, direction, fspeed)
+        await asyncio.sleep(max(0.0, predicted * self.stage.wake_margin - self.stage.query_latency))
+        return await self._call(self.stage.wait_motion, timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class EventLoopThread:
+    """バックグラウンドスレッドでイベントループを回し、GUI から仕事を投げ込むための橋渡し
+
+    submit() は concurrent.futures.Future を返す。結果の通知は done_callback に渡した
+    関数から Qt のシグナルを emit すれば GUI スレッドへ届く。
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="frog-asyncio", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro, done_callback=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if done_callback is not None:
+            future.add_done_callback(done_callback)
+        return future
+
+    def stop(self, timeout=2.0):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if not self.loop.is_running():
+            self.loop.close()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+データディレクトリ全体のまとめ解析（プロセスプール）
+
+01_Mesurement/data と bata/data（または指定したディレクトリ・ファイル）の FROG データを
+全て読み、ファイルごとに
+    BG 補正（既定は最初の遅延のスペクトルを引き、その遅延は除く。frog.preprocess）
+    → 波長方向のマージナルと、信号のある波長帯だけを足した遅延方向のマージナル
+    → それぞれのガウスフィット（frog.fitting）で 遅延のピーク・FWHM [fs] と 中心波長・スペクトル幅 [nm]
+を計算し、1 つの CSV にまとめる。--png を付けると BG 補正後のマップと遅延マージナル＋
+フィットを Agg で PNG に描く。ファイルはプロセスプールで並列に処理する。
+GUI が同じ測定を .txt と .csv の両方に書いたものは 1 つだけ解析する（frogtrc > txt > csv）。
+
+    python -m frog.batch
+    python -m frog.batch bata/data --png --output-dir batch_out
+    python -m frog.batch 01_Mesurement/data --background edges --workers 4
+"""
+
+import argparse
+import csv
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from frog.fitting import fit_curves
+from frog.loader import load_frog
+from frog.preprocess import BACKGROUNDS, signal_support, subtract_background
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIRS = (os.path.join(REPO_DIR, "01_Mesurement", "data"), os.path.join(REPO_DIR, "bata", "data"))
+
+# 同じ測定が複数の形式で残っているときに使う順
+EXTENSIONS = (".frogtrc", ".txt", ".csv")
+
+# 信号のある波長帯がこの点数に満たなければ（ノイズの 1 画素だけ等）遅延フィットをしない
+MIN_BAND_POINTS = 10
+
+# フィットの初期値で、オフセットに使うパーセンタイル（負のスパイクに引っ張られないよう最小値は使わない）
+OFFSET_PERCENTILE = 5
+
+COLUMNS = (
+    "file", "format", "n_delays", "n_wavelengths", "delay_unit",
+    "peak_delay", "delay_fwhm", "peak_delay_raw", "center_wavelength", "spectral_fwhm",
+    "peak_intensity", "elapsed_ms", "error",
+)
+
+
+def find_files(paths):
+    """ディレクトリ（直下）とファイルから、測定ごとに 1 つのデータファイルを選ぶ"""
+    found = {}
+    for path in paths:
+        names = [path] if os.path.isfile(path) else [os.path.join(path, n) for n in sorted(os.listdir(path))]
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in EXTENSIONS:
+                continue
+            rank = EXTENSIONS.index(ext.lower())
+            if stem not in found or rank < found[stem][0]:
+                found[stem] = (rank, name)
+    return [name for _, name in sorted(found.values(), key=lambda v: v[1])]
+
+
+def fit_gaussian(x, y):
+    """(中心, FWHM, FitResult)。点が足りない・フィットが有効でない（FitResult.valid）・幅が範囲外なら例外"""
+    if len(x) < 5:
+        raise ValueError(f"フィットには 5 点以上必要です（{len(x)} 点）")
+    # 初期値はピークとそこから続く半値以上の幅から（狭い山ではモーメントの初期値がノイズに引っ張られる）
+    k = int(np.argmax(y))
+    c0 = float(np.percentile(y, OFFSET_PERCENTILE))
+    above = y >= c0 + 0.5 * (y[k] - c0)
+    lo = hi = k
+    while lo > 0 and above[lo - 1]:
+        lo -= 1
+    while hi < len(x) - 1 and above[hi + 1]:
+        hi += 1
+    fwhm0 = max(float(x[hi] - x[lo]), float(np.min(np.abs(np.diff(x)))))
+    fit = fit_curves(x, y[None], "gaussian", p0=[y[k] - c0, x[k], fwhm0, c0])
+    center, fwhm = float(fit.center[0]), float(fit.fwhm[0])
+    # 山の無いデータでは幅が発散したり中心が範囲の外へ出たり、1 点だけのノイズに合ったりする
+    spacing = float(np.median(np.abs(np.diff(x))))
+    if not fit.valid[0] or fwhm > float(x.max() - x.min()) or fwhm < 2 * spacing:
+        raise ValueError(f"フィットが有効ではありません（中心 {center:.4g}, FWHM {fwhm:.4g}）")
+    return center, fwhm, fit
+
+
+def analyze_file(path, background="first", png_dir=None):
+    """1 ファイルを解析して COLUMNS の dict を返す（失敗は error 列へ）"""
+    t0 = time.perf_counter()
+    row = dict.fromkeys(COLUMNS, "")
+    row["file"] = path
+    try:
+        data = load_frog(path).sorted()
+        row.update(format=data.format, delay_unit=data.delay_unit,
+                   n_delays=data.shape[0], n_wavelengths=data.shape[1])
+        corrected = subtract_background(data, background)
+        spectral_marginal = corrected.intensity.sum(axis=0, dtype=np.float64)
+        # 信号の無い波長のノイズを足し込まないよう、遅延マージナルは信号のある波長帯だけで取る
+        wl_lo, wl_hi, _ = signal_support(corrected.wavelengths, spectral_marginal)
+        band = (corrected.wavelengths >= wl_lo) & (corrected.wavelengths <= wl_hi)
+        delay_marginal = corrected.intensity[:, band].sum(axis=1, dtype=np.float64)
+        row["peak_intensity"] = float(corrected.intensity.max())
+        row["peak_delay_raw"] = float(corrected.delays[np.argmax(delay_marginal)])
+        errors = []
+        delay_fit = None
+        try:
+            if band.sum() < MIN_BAND_POINTS:
+                raise ValueError(f"信号のある波長帯がありません（{int(band.sum())} 点）")
+            row["peak_delay"], row["delay_fwhm"], delay_fit = fit_gaussian(corrected.delays, delay_marginal)
+        except (ValueError, RuntimeError) as e:
+            errors.append(f"遅延フィット: {e}")
+        try:
+            row["center_wavelength"], row["spectral_fwhm"], _ = fit_gaussian(corrected.wavelengths, spectral_marginal)
+        except (ValueError, RuntimeError) as e:
+            errors.append(f"波長フィット: {e}")
+        row["error"] = "; ".join(errors)
+        if png_dir and min(corrected.shape) > 1:
+            render_png(os.path.join(png_dir, os.path.splitext(os.path.basename(path))[0] + ".png"),
+                       corrected, delay_marginal, delay_fit)
+    except (ValueError, OSError) as e:
+        row["error"] = str(e)
+    row["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return row
+
+
+def render_png(path, data, delay_marginal, delay_fit=None):
+    """BG 補正後のマップ（data は subtract_background の結果）と遅延マージナルを Agg で描く（pyplot は使わない）"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(11, 4.5))
+    FigureCanvasAgg(fig)
+    ax_map, ax_marginal = fig.subplots(1, 2, gridspec_kw={"width_ratios": [3, 2]})
+    im = ax_map.imshow(
+        data.intensity.T, aspect='auto', origin='lower', interpolation='nearest',
+        extent=[data.delays[0], data.delays[-1], data.wavelengths[0], data.wavelengths[-1]],
+    )
+    ax_map.set_xlabel(f"Delay [{data.delay_unit}]")
+    ax_map.set_ylabel("Wavelength [nm]")
+    ax_map.set_title(os.path.basename(data.path))
+    fig.colorbar(im, ax=ax_map)
+    ax_marginal.plot(data.delays, delay_marginal, "o", ms=3, label="marginal")
+    if delay_fit is not None:
+        x = np.linspace(data.delays[0], data.delays[-1], 400)
+        ax_marginal.plot(x, delay_fit.curve(x)[0], "r--", label=f"Gaussian FWHM {delay_fit.fwhm[0]:.1f}")
+    ax_marginal.set_xlabel(f"Delay [{data.delay_unit}]")
+    ax_marginal.set_ylabel("Integrated Intensity")
+    ax_marginal.grid(True)
+    ax_marginal.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+def _analyze(args):
+    return analyze_file(*args)
+
+
+def run_batch(files, background="first", png_dir=None, workers=None):
+    """files を並列に解析し、files と同じ順の行のリストを返す"""
+    if png_dir:
+        os.makedirs(png_dir, exist_ok=True)
+    jobs = [(path, background, png_dir) for path in files]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        return [_analyze(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_analyze, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+def write_table(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: (f"{v:.6g}" if isinstance(v, float) else v) for k, v in row.items()})
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FROG データをまとめて解析し、1 つの表にする")
+    parser.add_argument("paths", nargs="*", help="データディレクトリまたはファイル（既定は 01_Mesurement/data と bata/data）")
+    parser.add_argument("--output-dir", default=".", help="まとめの CSV（と PNG）の出力先")
+    parser.add_argument("--background", choices=BACKGROUNDS, default="first",
+                        help="first: 最初の遅延を引く, edges: 最初と最後の平均を引く, none: 引かない")
+    parser.add_argument("--png", action="store_true", help="ファイルごとに PNG を描く")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定は CPU 数）")
+    args = parser.parse_args(argv)
+
+    files = find_files(args.paths or [d for d in DATA_DIRS if os.path.isdir(d)])
+    if not files:
+        print("解析するファイルがありません")
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    png_dir = os.path.join(args.output_dir, "png") if args.png else None
+    t0 = time.perf_counter()
+    rows = run_batch(files, args.background, png_dir, args.workers)
+    elapsed = time.perf_counter() - t0
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = write_table(rows, os.path.join(args.output_dir, f"{now}_FROG_batch.csv"))
+    failed = [row for row in rows if row["error"]]
+    for row in failed:
+        print(f"{os.path.basename(row['file'])}: {row['error']}")
+    print(f"{len(rows)} ファイル（エラー・フィットできなかったもの {len(failed)}）, {elapsed:.2f} 秒 → {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
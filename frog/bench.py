@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+測定フローのスループット計測（エミュレータ使用）
+
+frog.emulator の DS102 / USB4000 に遅延を設定してスキャンを実行し、点数/秒と
+1 点あたりの内訳（move / settle / integrate / transfer / background / write / log / plot）を
+JSON で出力する。前回の JSON を --compare に渡すと点数/秒の変化を表示する。
+
+    python -m frog.bench --flows ver3.0 ver3.1 gui2.0 --points 40 --integration-ms 10 --json bench.json
+    python -m frog.bench --compare bench_old.json --json bench_new.json
+
+フロー:
+    ver3.0  01_Mesurement/FROG_Ver3.0.py を擬似端末の DS102 につないで実行（input() には設定値を順に返す）
+    ver3.1  bata/FROG_Ver3.1_refactored.py を同じように実行（1 点 1 フレーム）
+    gui2.0  bata/FROG_Measure_GUI_ver.2.0.py が使う frog.engine.ScanEngine.run() をそのまま実行
+
+点数/秒は測定ループの区間だけで計る（ver3.x はスクリプトのログの "Measurement started" から完了まで）。
+ver3.x のステージ速度はスクリプトに書かれた値（1000 pps）で、--fspeed は gui2.0 だけに効く。
+スクリプトの DS102 は擬似端末越しに動くため、ver3.x の内訳は integrate / transfer だけになる。
+内訳は各スレッドでかかった時間の合計なので、パイプライン化した gui2.0 では合計が経過時間を超える。
+"""
+
+import argparse
+import builtins
+import contextlib
+import json
+import logging
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from frog import emulator, logutil
+from frog.ds102 import DS102
+from frog.emulator import DS102Model, EmulatedSerial, FS_PER_PULSE, MockSpectrometer
+from frog.logutil import setup_logging
+from frog.spectrometer import SpectrometerSession
+
+PHASES = ("move", "settle", "integrate", "transfer", "background", "write", "log", "plot")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# GUI ver.2.0 のライブ表示の上限 [回/s]
+LIVE_MAX_FPS = 5
+
+# 点数/秒がこれ以上下がったら --compare で遅くなったと表示する
+REGRESSION_TOLERANCE = 0.10
+
+
+class PhaseTimer:
+    """フェーズごとの所要時間を集計する（どのスレッドから呼んでもよい）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.totals[phase] += seconds
+            self.counts[phase] += 1
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - t0)
+
+    def summary(self, n_points):
+        return {
+            phase: {
+                "total_s": round(self.totals[phase], 6),
+                "per_point_ms": round(1000 * self.totals[phase] / max(n_points, 1), 4),
+                "calls": self.counts[phase],
+            }
+            for phase in PHASES
+        }
+
+
+class TimedStage(DS102):
+    """停止待ちを、エミュレータ上の移動終了時刻で move と settle に分けて計る"""
+
+    def __init__(self, ser, model, timer, **kwargs):
+        super().__init__(ser, **kwargs)
+        self.model = model
+        self.timer = timer
+
+    def start_move(self, pulses, direction, fspeed):
+        with self.timer.span("move"):
+            return super().start_move(pulses, direction, fspeed)
+
+    def wait_motion(self, timeout=12.0):
+        t0 = time.perf_counter()
+        ok = super().wait_motion(timeout)
+        end = time.perf_counter()
+        motion_end = self.model._t0 + self.model._duration
+        moving = min(max(motion_end - t0, 0.0), end - t0)
+        self.timer.add("move", moving)
+        self.timer.add("settle", end - t0 - moving)
+        return ok
+
+
+class TimedSpectrometer:
+    """MockSpectrometer の intensities() を露光待ち（integrate）と転送（transfer）に分けて計る"""
+
+    def __init__(self, spectrometer, timer):
+        self._spec = spectrometer
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._spec, name)
+
+    def intensities(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        y = self._spec.intensities(*args, **kwargs)
+        total = time.perf_counter() - t0
+        transfer = min(total, self._spec.transfer_time)
+        self._timer.add("integrate", total - transfer)
+        self._timer.add("transfer", transfer)
+        return y
+
+
+class TimedSession(SpectrometerSession):
+    """BG 減算を background として計る"""
+
+    def __init__(self, spectrometer, timer, **kwargs):
+        super().__init__(spectrometer, **kwargs)
+        self.timer = timer
+
+    def _subtract(self, out, subtract_background):
+        if subtract_background and self.background is not None:
+            with self.timer.span("background"):
+                np.subtract(out, self.background, out=out)
+        return out
+
+    def read(self, out=None, settled=True, subtract_background=True):
+        out = super().read(out, settled, subtract_background=False)
+        return self._subtract(out, subtract_background)
+
+    def read_averaged(self, n_frames, out=None, var_out=None, settled=True,
+                      subtract_background=True, **kwargs):
+        out = super().read_averaged(n_frames, out, var_out, settled, subtract_background=False, **kwargs)
+        return self._subtract(out, subtract_background)
+
+
+class TimedLogger:
+    """logger の呼び出しを log として計る"""
+
+    def __init__(self, logger, timer):
+        self._logger = logger
+        self._timer = timer
+
+    def __getattr__(self, name):
+        attr = getattr(self._logger, name)
+        if name not in ("debug", "info", "warning", "error", "exception", "log"):
+            return attr
+
+        def timed(*args, **kwargs):
+            with self._timer.span("log"):
+                return attr(*args, **kwargs)
+        return timed
+
+
+class Devices:
+    """1 回のフロー分のエミュレータ一式（計測用ラッパー付き）"""
+
+    def __init__(self, config):
+        timer = PhaseTimer()
+        self.model = DS102Model(settle_time=config["settle_ms"] / 1000, baudrate=config["baudrate"])
+        self.serial = EmulatedSerial(self.model)
+        self.stage = TimedStage(self.serial, self.model, timer)
+        self.mock = MockSpectrometer(self.model, zero_position=config["points"] * config["step"] / 2,
+                                     transfer_time=config["transfer_ms"] / 1000, seed=0)
+        self.spectrometer = TimedSpectrometer(self.mock, timer)
+        self.session = TimedSession(self.spectrometer, timer)
+        # 積分時間の校正と BG 取得は計測に含めない
+        self.session.set_integration_time_ms(config["integration_ms"])
+        self.session.measure_background()
+
+    def use_timer(self, timer):
+        self.stage.timer = timer
+        self.spectrometer._timer = timer
+        self.session.timer = timer
+
+
+class ScanWindow(logging.Handler):
+    """スクリプトのログから測定ループの区間と点数を拾い、その間だけ timer に計上する"""
+
+    def __init__(self, dev, timer):
+        super().__init__()
+        self.dev = dev
+        self.timer = timer
+        self.start = self.end = None
+        self.points = 0
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message == "Measurement started":
+            # Ver3.0 はファイルを作った後にもう一度出すので、最後のものから数える
+            self.start, self.points = time.perf_counter(), 0
+            self.dev.use_timer(self.timer)
+        elif self.start is None or self.end is not None:
+            return
+        elif message.startswith("Measuring at "):
+            self.points += 1
+        elif message.startswith(("Measurement completed", "Measurement aborted (")):
+            self.end = time.perf_counter()
+            self.dev.use_timer(PhaseTimer())
+
+
+@contextlib.contextmanager
+def _emulated(dev):
+    """dev のエミュレータを擬似端末の DS102 と seabreeze としてつなぎ、終わったら元に戻す"""
+    import serial.tools.list_ports
+
+    comports = serial.tools.list_ports.comports
+    modules = {name: sys.modules.get(name) for name in ("seabreeze", "seabreeze.spectrometers")}
+    link, _ = emulator.install(dev.model, dev.spectrometer)
+    try:
+        yield link
+    finally:
+        link.close()
+        serial.tools.list_ports.comports = comports
+        for name, module in modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+@contextlib.contextmanager
+def _scripted_input(answers):
+    """input() に answers を順に返す（足りなくなったら止める）"""
+    pending = list(answers)
+
+    def scripted(prompt=""):
+        if not pending:
+            raise RuntimeError(f"想定していない入力待ちです: {prompt!r}")
+        return pending.pop(0)
+
+    saved = builtins.input
+    builtins.input = scripted
+    try:
+        yield
+    finally:
+        builtins.input = saved
+
+
+@contextlib.contextmanager
+def _captured_logging():
+    """スクリプトが import 時に呼ぶ setup_logging() を拾い、終わったら閉じる"""
+    sessions = []
+
+    def capture(*args, **kwargs):
+        sessions.append(real(*args, **kwargs))
+        return sessions[-1]
+
+    real = logutil.setup_logging
+    logutil.setup_logging = capture
+    try:
+        yield
+    finally:
+        logutil.setup_logging = real
+        for session in sessions:
+            session.close()
+
+
+def run_script(dev, config, workdir, timer, script, answers):
+    """測定スクリプトそのものをエミュレータにつないで実行する
+
+    スクリプトは workdir に写してから実行する（data/ と log/ が workdir にできる）。
+    計るのはログの "Measurement started" から完了（または中断）までで、
+    スクリプトの DS102 は擬似端末越しに動くため内訳は integrate / transfer だけになる。
+    """
+    path = shutil.copy(os.path.join(REPO_ROOT, script), workdir)
+    window = ScanWindow(dev, timer)
+    dev.use_timer(PhaseTimer())
+    measure = logging.getLogger("frog.measure")
+    measure.addHandler(window)
+    saved_argv = sys.argv
+    sys.argv = [path]
+    try:
+        with open(os.path.join(workdir, "script.out"), "w", encoding="utf-8") as out, \
+                contextlib.redirect_stdout(out), contextlib.redirect_stderr(out), \
+                _emulated(dev), _scripted_input(answers), _captured_logging():
+            runpy.run_path(path, run_name="__main__")
+    finally:
+        sys.argv = saved_argv
+        measure.removeHandler(window)
+    if window.start is None or window.end is None:
+        raise RuntimeError(f"{script} の測定ループが最後まで実行されませんでした（{workdir}/script.out を参照）")
+    return window.points, window.end - window.start
+
+
+def run_ver30(dev, config, workdir, timer):
+    """01_Mesurement/FROG_Ver3.0.py（積分時間は µs で入力）"""
+    step = config["step"]
+    answers = [
+        "pass",                                        # DS102 の初期化
+        str(round(config["integration_ms"] * 1000)),   # 積分時間 [us]
+        "ok",                                          # 今の位置をホームにする
+        str(step), "n",                                # ステップ
+        str(config["points"] * step), "no",            # 測定範囲 [pulse]
+        str(config["n_average"]),                      # 平均フレーム数
+        "",                                            # 測定開始
+    ]
+    return run_script(dev, config, workdir, timer, os.path.join("01_Mesurement", "FROG_Ver3.0.py"), answers)
+
+
+def run_ver31(dev, config, workdir, timer):
+    """bata/FROG_Ver3.1_refactored.py（積分時間は ms の整数、1 点 1 フレーム）"""
+    step = config["step"]
+    answers = [
+        "pass",
+        str(max(1, round(config["integration_ms"]))),
+        str(step),
+        str(config["points"] * step),
+    ]
+    return run_script(dev, config, workdir, timer, os.path.join("bata", "FROG_Ver3.1_refactored.py"), answers)
+
+
+def run_gui2(dev, config, workdir, timer):
+    """GUI ver.2.0 と同じ frog.engine.ScanEngine.run() を同じスレッドで実行する"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from frog import engine
+    from frog.liveview import LiveFrogMap
+    from frog.tracefile import ColumnStore, TraceWriter
+
+    class TimedTraceWriter(TraceWriter):
+        def append(self, *args, **kwargs):
+            with timer.span("write"):
+                return super().append(*args, **kwargs)
+
+    class TimedColumnStore(ColumnStore):
+        def append(self, *args, **kwargs):
+            with timer.span("write"):
+                return super().append(*args, **kwargs)
+
+        def write_csv(self, path):
+            with timer.span("write"):
+                return super().write_csv(path)
+
+    params = {
+        'integration_time_ms': config["integration_ms"],
+        'n_average': config["n_average"],
+        'step_size': config["step"],
+        'range_input': config["points"] * config["step"],
+        'home_position': 0,
+        'fspeed': config["fspeed"],
+        'fly_scan': False,
+        'dt': config["step"] * FS_PER_PULSE,
+    }
+    fig, ax = plt.subplots()
+    acquired = []
+
+    def on_column(i, delay, column):
+        with timer.span("plot"):
+            live.add_column(delay, column)
+            if live.refresh():
+                fig.canvas.draw()
+        acquired.append(i)
+
+    scan = engine.ScanEngine(dev.stage, dev.session, params, os.path.join(workdir, "data"), on_column=on_column)
+    live = LiveFrogMap(ax, dev.session.wavelengths, scan.planned_delays(), max_fps=LIVE_MAX_FPS)
+    saved = engine.TraceWriter, engine.ColumnStore, engine.logger
+    engine.TraceWriter, engine.ColumnStore = TimedTraceWriter, TimedColumnStore
+    engine.logger = TimedLogger(engine.logger, timer)
+    t0 = time.perf_counter()
+    try:
+        scan.run()
+    finally:
+        wall = time.perf_counter() - t0
+        engine.TraceWriter, engine.ColumnStore, engine.logger = saved
+    with timer.span("plot"):
+        live.refresh(force=True)
+        fig.canvas.draw()
+    plt.close(fig)
+    return len(acquired), wall
+
+
+FLOWS = {
+    "ver3.0": run_ver30,
+    "ver3.1": run_ver31,
+    "gui2.0": run_gui2,
+}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_flow(name, config):
+    """1 フローを実行して結果の dict を返す（各フローは (点数, スキャンの経過時間) を返す）"""
+    timer = PhaseTimer()
+    with tempfile.TemporaryDirectory(prefix="frog-bench-") as workdir:
+        logs = setup_logging(os.path.join(workdir, "bench.log"), level=logging.DEBUG)
+        dev = Devices(config)
+        dev.use_timer(timer)
+        try:
+            n_points, wall = FLOWS[name](dev, config, workdir, timer)
+        finally:
+            logs.close()
+    return {
+        "flow": name,
+        "points": n_points,
+        "wall_s": round(wall, 6),
+        "points_per_s": round(n_points / wall, 4) if wall > 0 else None,
+        "phases": timer.summary(n_points),
+    }
+
+
+def compare(results, baseline):
+    """baseline（以前の JSON）と点数/秒を比べた行のリスト"""
+    old = {r["flow"]: r for r in baseline.get("results", []) if "points_per_s" in r}
+    lines = []
+    for r in results:
+        if r["flow"] not in old or not r.get("points_per_s"):
+            continue
+        before, after = old[r["flow"]]["points_per_s"], r["points_per_s"]
+        change = after / before - 1
+        mark = "  ← 遅くなっています" if change < -REGRESSION_TOLERANCE else ""
+        lines.append(f"{r['flow']:8s} {before:8.2f} → {after:8.2f} 点/s ({change:+.1%}){mark}")
+    return lines
+
+
+def format_table(results):
+    head = f"{'flow':8s} {'点/s':>8s} " + " ".join(f"{p:>10s}" for p in PHASES)
+    lines = [head, "-" * len(head)]
+    for r in results:
+        cells = " ".join(f"{r['phases'][p]['per_point_ms']:10.2f}" for p in PHASES)
+        lines.append(f"{r['flow']:8s} {r['points_per_s']:8.2f} {cells}")
+    lines.append("（各フェーズは 1 点あたり [ms]）")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="エミュレータ上で測定フローのスループットを計測する")
+    parser.add_argument("--flows", nargs="+", default=list(FLOWS), choices=list(FLOWS))
+    parser.add_argument("--points", type=int, default=40, help="測定点数")
+    parser.add_argument("--step", type=int, default=1, help="ステップ [pulse]")
+    parser.add_argument("--integration-ms", type=float, default=10.0, help="積分時間 [ms]")
+    parser.add_argument("--n-average", type=int, default=1, help="1 点あたりの平均フレーム数")
+    parser.add_argument("--fspeed", type=int, default=1000, help="ステージ速度 [pps]")
+    parser.add_argument("--settle-ms", type=float, default=0.0, help="停止後にビジーが落ちるまで [ms]")
+    parser.add_argument("--transfer-ms", type=float, default=4.0, help="1 フレームの転送時間 [ms]")
+    parser.add_argument("--baudrate", type=int, default=9600, help="DS102 の通信速度（応答遅延）")
+    parser.add_argument("--json", help="結果を書き出す JSON")
+    parser.add_argument("--compare", help="比較する以前の JSON")
+    args = parser.parse_args(argv)
+
+    config = {
+        "points": args.points, "step": args.step, "integration_ms": args.integration_ms,
+        "n_average": args.n_average, "fspeed": args.fspeed, "settle_ms": args.settle_ms,
+        "transfer_ms": args.transfer_ms, "baudrate": args.baudrate,
+    }
+    results = [run_flow(name, config) for name in args.flows]
+    report = {"config": config, "environment": environment(), "results": results}
+    print("\n".join(format_table(results)))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print("\n".join(compare(results, json.load(f))))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"-> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+中断したステップスキャンを再開するためのチェックポイント
+
+測定中は CHECKPOINT_INTERVAL 秒ごとと終了時に、測定条件・トレースに書き終えた点数・
+スキャン原点とステージ位置・BG を <データ名>.checkpoint.npz に書く（最後まで測れたら消す）。
+ステージのタイムアウトや中断で止まったスキャンは、HOME へ戻って位置を確かめてから
+次の遅延の点から同じトレースファイルに続けて測る:
+
+    python -m frog.engine --resume data/20250515_183554_FROG.checkpoint.npz
+    python -m frog.checkpoint data/20250515_183554_FROG.checkpoint.npz     # 内容の表示
+"""
+
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+
+from frog.hdr import BackgroundModel
+
+EXTENSION = ".checkpoint.npz"
+
+# 測定中にチェックポイントを書き直す間隔 [s]
+CHECKPOINT_INTERVAL = 1.0
+
+
+class Checkpoint:
+    """ステップスキャン 1 本分の再開情報
+
+    origin はスキャン位置 0 の絶対位置 [pulse]、position は最後に記録したステージ位置。
+    files は ScanEngine の出力ファイル（trace, csv, txt, base）。
+    """
+
+    def __init__(self, path, params, files, origin, n_done=0, position=None,
+                 background=None, hdr_background=None):
+        self.path = path
+        self.params = {k: v for k, v in params.items() if v is None or isinstance(v, (int, float, bool, str))}
+        self.files = dict(files)
+        self.origin = origin
+        self.n_done = n_done
+        self.position = position
+        self.background = background
+        self.hdr_background = hdr_background
+        self.updated = None
+
+    def save(self):
+        """一時ファイルに書いてから置き換える（書き込み中に落ちても前の内容が残る）"""
+        self.updated = datetime.datetime.now().isoformat(timespec="seconds")
+        state = {
+            "params": self.params, "files": self.files, "origin": self.origin, "n_done": self.n_done,
+            "position": self.position, "updated": self.updated,
+        }
+        arrays = {"state": np.array(json.dumps(state, ensure_ascii=False))}
+        if self.background is not None:
+            arrays["background"] = self.background
+        if self.hdr_background is not None:
+            arrays["hdr_offset"] = self.hdr_background.offset
+            arrays["hdr_dark_rate"] = self.hdr_background.dark_rate
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.path)
+        return self.path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            state = json.loads(str(f["state"]))
+            background = f["background"] if "background" in f.files else None
+            hdr_background = BackgroundModel(f["hdr_offset"], f["hdr_dark_rate"]) if "hdr_offset" in f.files else None
+        checkpoint = cls(path, state["params"], state["files"], state["origin"], state["n_done"],
+                         state.get("position"), background, hdr_background)
+        checkpoint.updated = state.get("updated")
+        return checkpoint
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="チェックポイントの内容を表示する")
+    parser.add_argument("paths", nargs="+", help="*.checkpoint.npz")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        cp = Checkpoint.load(path)
+        print(f"{path}: {cp.n_done} 点まで記録（{cp.updated}）, 原点 {cp.origin} pulse, 最終位置 {cp.position} pulse")
+        print(f"  トレース: {cp.files.get('trace')}")
+        print(f"  BG: {'あり' if cp.background is not None else 'なし'}, HDR BG: {'あり' if cp.hdr_background is not None else 'なし'}")
+
+
+if __name__ == "__main__":
+    main()
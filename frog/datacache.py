@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+読み込んだ FROG データの配列キャッシュ
+
+txt / csv を frog.loader で一度読んだら、遅延・波長・強度を .npy にしてキャッシュ
+ディレクトリ（FROG_CACHE_DIR、既定は ~/.cache/frog）に置き、次からは np.load の
+mmap_mode="r" で開くだけにする。エントリは元ファイルの絶対パスと内容のハッシュ（blake2b）
+ごとに 1 つ（<パスのハッシュ>.<内容のハッシュ>/）で、大きさと更新時刻も控えておく。
+大きさと更新時刻が同じならそのまま使い、違えばハッシュを取り直して内容が変わって
+いれば読み直す（コピーや touch だけなら読み直さない）。
+書いたエントリは置き換えない（Windows では memmap で開いている .npy を消せない）。内容が
+変われば新しいエントリを作り、同じファイルの古いエントリを消す。消しきれなければ meta.json
+だけ消して無効にし、後の evict() で消し直す。
+合計が max_bytes を超えたら、最後に使ってから長いエントリから消す（LRU）。
+frogtrc はもともと memmap で開けるのでキャッシュしない。
+
+    data = load_cached("bata/data/20250516_144423_FROG.csv")
+    delays, wavelengths, intensity = data          # intensity は読み取り専用の memmap
+
+    python -m frog.datacache bata/data/*.csv       # 先に読んでおく
+    python -m frog.datacache --list
+    python -m frog.datacache --clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from frog.loader import FrogData, load_frog, sniff_format
+
+# キャッシュの置き場所と合計の上限 [byte]
+CACHE_DIR = os.environ.get("FROG_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "frog")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# エントリの形式が変わったら上げる（古いエントリは読み直しになる）
+CACHE_VERSION = 2
+
+ARRAYS = ("delays", "wavelengths", "intensity")
+HASH_BLOCK = 1 << 20
+
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DataCache:
+    """元ファイルの版ごとのキャッシュエントリ（<cache_dir>/<パスのハッシュ>.<内容のハッシュ>/）"""
+
+    def __init__(self, cache_dir=None, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def path_key(path):
+        return hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=12).hexdigest()
+
+    def entry_dir(self, path, digest):
+        return os.path.join(self.cache_dir, f"{self.path_key(path)}.{digest}")
+
+    def versions(self, path):
+        """path のエントリ（版ごと）のディレクトリのリスト"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        prefix = self.path_key(path) + "."
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.startswith(prefix)]
+
+    @staticmethod
+    def _read_meta(entry):
+        try:
+            with open(os.path.join(entry, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _open(self, entry, meta):
+        arrays = [np.load(os.path.join(entry, f"{name}.npy"), mmap_mode="r") for name in ARRAYS]
+        return FrogData(*arrays, meta["format"], meta["delay_unit"], meta["source"])
+
+    def _valid(self, entry):
+        meta = self._read_meta(entry)
+        return meta if meta is not None and meta.get("version") == CACHE_VERSION else None
+
+    def lookup(self, path):
+        """有効なエントリがあれば FrogData（memmap）、無ければ None"""
+        st = os.stat(path)
+        candidates = []
+        for entry in self.versions(path):
+            meta = self._valid(entry)
+            if meta is not None and meta["size"] == st.st_size:
+                candidates.append((entry, meta))
+        if not candidates:
+            return None
+        for entry, meta in candidates:
+            if meta["mtime_ns"] == st.st_mtime_ns:
+                break
+        else:
+            digest = file_digest(path)
+            for entry, meta in candidates:
+                if meta["digest"] == digest:
+                    break
+            else:
+                return None
+            # 内容は同じ（コピーや touch）なので控えだけ直す
+            meta["mtime_ns"] = st.st_mtime_ns
+            self._write_meta(entry, meta)
+        try:
+            data = self._open(entry, meta)
+        except (OSError, ValueError):
+            return None
+        # 最後に使った時刻（LRU の順番）
+        os.utime(os.path.join(entry, "meta.json"))
+        return data
+
+    @staticmethod
+    def _write_meta(entry, meta):
+        tmp = os.path.join(entry, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(entry, "meta.json"))
+
+    def store(self, path, data):
+        """data を path のエントリとして書き、memmap で開き直したものを返す"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        st = os.stat(path)
+        meta = {
+            "version": CACHE_VERSION, "source": os.path.abspath(path), "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns, "digest": file_digest(path),
+            "format": data.format, "delay_unit": data.delay_unit,
+        }
+        entry = self.entry_dir(path, meta["digest"])
+        if self._valid(entry) is not None:
+            # 同じ内容の版がある（開かれているかもしれないので書き直さない）
+            self._write_meta(entry, meta)
+        else:
+            # 一時ディレクトリに書いてから新しい名前に移す（既存のエントリは置き換えない）
+            self.discard(entry)
+            tmp = tempfile.mkdtemp(prefix=".tmp", dir=self.cache_dir)
+            try:
+                for name, array in zip(ARRAYS, data):
+                    np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+                self._write_meta(tmp, meta)
+                os.replace(tmp, entry)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+        for old in self.versions(path):
+            if old != entry:
+                self.discard(old)
+        self.evict(keep=entry)
+        return self._open(entry, meta)
+
+    def load(self, path):
+        data = self.lookup(path)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        return self.store(path, load_frog(path))
+
+    def entries(self):
+        """[(最後に使った時刻, 大きさ [byte], エントリ, meta)]（古い順）"""
+        out = []
+        if not os.path.isdir(self.cache_dir):
+            return out
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp") or not os.path.isdir(entry):
+                continue
+            meta = self._read_meta(entry)
+            size = sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+            used = os.path.getmtime(os.path.join(entry, "meta.json")) if meta else 0.0
+            out.append((used, size, entry, meta))
+        out.sort(key=lambda e: e[0])
+        return out
+
+    @staticmethod
+    def discard(entry):
+        """エントリを消す。消しきれなければ（開かれている memmap）meta.json を消して無効にしておく"""
+        try:
+            os.remove(os.path.join(entry, "meta.json"))
+        except OSError:
+            pass
+        shutil.rmtree(entry, ignore_errors=True)
+        return not os.path.exists(entry)
+
+    def evict(self, keep=None):
+        """無効なエントリと、合計が max_bytes 以下になるまで古いエントリを消す。消した数を返す"""
+        entries = self.entries()
+        total = sum(size for _, size, _, _ in entries)
+        removed = 0
+        for _, size, entry, meta in entries:
+            live = meta is not None and meta.get("version") == CACHE_VERSION
+            if entry == keep or (live and total <= self.max_bytes):
+                continue
+            if self.discard(entry):
+                total -= size
+                removed += 1
+        return removed
+
+    def clear(self):
+        for _, _, entry, _ in self.entries():
+            self.discard(entry)
+
+
+_default_cache = None
+
+
+def load_cached(path, cache=None):
+    """load_frog と同じ FrogData を返す（txt / csv はキャッシュの memmap、frogtrc はそのまま）"""
+    global _default_cache
+    if sniff_format(path)[0] == "frogtrc":
+        return load_frog(path)
+    if cache is None:
+        if _default_cache is None:
+            _default_cache = DataCache()
+        cache = _default_cache
+    return cache.load(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FROG データの配列キャッシュを作る・表示する・消す")
+    parser.add_argument("paths", nargs="*", help="キャッシュに入れるデータファイル")
+    parser.add_argument("--cache-dir", default=None, help=f"キャッシュの場所（既定 {CACHE_DIR}）")
+    parser.add_argument("--max-mb", type=float, default=CACHE_MAX_BYTES / 2**20, help="キャッシュの上限 [MB]")
+    parser.add_argument("--list", action="store_true", help="エントリを一覧する")
+    parser.add_argument("--clear", action="store_true", help="全て消す")
+    args = parser.parse_args(argv)
+    cache = DataCache(args.cache_dir, int(args.max_mb * 2**20))
+    if args.clear:
+        cache.clear()
+        print(f"{cache.cache_dir} を空にしました")
+    for path in args.paths:
+        t0 = time.perf_counter()
+        try:
+            data = load_cached(path, cache)
+        except (ValueError, OSError) as e:
+            print(f"{path}: 読めません（{e}）")
+            continue
+        print(f"{os.path.basename(path)}: {data.format}, {data.shape}, {(time.perf_counter() - t0) * 1000:.1f} ms")
+    if args.list:
+        cache.evict()
+        entries = cache.entries()
+        for used, size, _, meta in entries:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(used))
+            print(f"{stamp}  {size / 2**20:8.2f} MB  {meta['source'] if meta else '(壊れたエントリ)'}")
+        print(f"{len(entries)} 件, {sum(e[1] for e in entries) / 2**20:.1f} MB / {cache.max_bytes / 2**20:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+SURUGA SEIKI DS102 ステージコントローラ
+
+移動完了は、パルス数・速度・加減速から移動時間を見積もってその直前まで眠り、
+その後 SB1? のビジービットを詰めて問い合わせて検出する。
+応答は CR 終端なので readline() ではなく read_until(b'\\r') で読む
+（readline() は LF を待ってタイムアウトまで戻らない）。
+"""
+
+import math
+import threading
+import time
+
+# ステータス1 (SB1?) のビット（DS102PythonSample_J_V100/main.py の update_status と同じ）
+SB1_BUSY = 0x40         # 動作中
+SB1_ORIGIN = 0x10       # 原点検出
+SB1_LIMIT = 0x02 | 0x04 # 機械リミット検出
+
+# DS102 サンプルプログラムの既定値
+DEFAULT_LSPEED = 100    # 初速度 L [pps]
+DEFAULT_RATE_MS = 100   # 加減速レート R [ms]
+
+
+def predict_move_time(pulses, fspeed, lspeed=DEFAULT_LSPEED, rate_ms=DEFAULT_RATE_MS):
+    """台形駆動での移動時間 [s] を見積もる
+
+    L から F までの加速（減速）に rate_ms かかるとみなし、
+    加減速だけで距離が足りる場合は三角駆動として解く。
+    """
+    pulses = abs(pulses)
+    if pulses == 0:
+        return 0.0
+    if fspeed <= lspeed or rate_ms <= 0:
+        return pulses / max(fspeed, lspeed)
+    t_acc = rate_ms / 1000
+    acc = (fspeed - lspeed) / t_acc
+    d_acc = (fspeed ** 2 - lspeed ** 2) / (2 * acc)
+    if pulses >= 2 * d_acc:
+        return 2 * t_acc + (pulses - 2 * d_acc) / fspeed
+    v_peak = math.sqrt(lspeed ** 2 + acc * pulses)
+    return 2 * (v_peak - lspeed) / acc
+
+
+def decode_sb1(value):
+    """SB1? の応答を状態文字列にする"""
+    if value & SB1_BUSY:
+        return "busy"
+    if value & SB1_ORIGIN:
+        return "origin"
+    if value & SB1_LIMIT:
+        return "limit"
+    return "stop"
+
+
+class DS102:
+    """DS102 の 1 軸を扱うラッパー"""
+
+    def __init__(self, ser, axis=1, lspeed=DEFAULT_LSPEED, rate_ms=DEFAULT_RATE_MS,
+                 wake_margin=0.9, poll_interval=0.002):
+        self.ser = ser
+        self.axis = axis
+        self.lspeed = lspeed
+        self.rate_ms = rate_ms
+        self.wake_margin = wake_margin      # 予測時間のこの割合まで眠る
+        self.poll_interval = poll_interval  # 起床後の問い合わせ間隔 [s]
+        self.query_latency = 0.0            # 1 回の問い合わせにかかった時間（実測）
+        self.move_started = None
+        self.predicted_time = 0.0
+        self.last_move_time = None          # 直前の移動にかかった時間（実測）[s]
+        # 複数スレッドから使われても送信と応答の読み取りが混ざらないようにする
+        self.lock = threading.RLock()
+
+    def send(self, command):
+        with self.lock:
+            self.ser.write(f"{command}\r".encode('utf-8'))
+
+    def query(self, command):
+        t0 = time.perf_counter()
+        with self.lock:
+            self.send(command)
+            resp = self.ser.read_until(b'\r').decode('utf-8').strip()
+        self.query_latency = time.perf_counter() - t0
+        return resp
+
+    def axis_query(self, command):
+        return self.query(f"AXIs{self.axis}:{command}")
+
+    def position(self):
+        return int(self.axis_query("POS?"))
+
+    def status(self):
+        """SB1? の値（int）を返す"""
+        return int(self.axis_query("SB1?"))
+
+    def is_busy(self):
+        return bool(self.status() & SB1_BUSY)
+
+    def start_move(self, pulses, direction, fspeed):
+        """移動を開始し、見積もった移動時間 [s] を返す"""
+        with self.lock:
+            self.send(f"AXIs{self.axis}:Fspeed0 {fspeed}")
+            self.send(f"AXIs{self.axis}:PULS {pulses}:GO {direction}")
+        self.move_started = time.perf_counter()
+        self.predicted_time = predict_move_time(pulses, fspeed, self.lspeed, self.rate_ms)
+        return self.predicted_time
+
+    def start_command(self, command, predicted_time=0.0):
+        """GO 3（HOME復帰）など任意の駆動コマンドを送る"""
+        self.send(f"AXIs{self.axis}:{command}")
+        self.move_started = time.perf_counter()
+        self.predicted_time = predicted_time
+
+    def wait_motion(self, timeout=12.0):
+        """停止するまで待つ。停止を検出したら True、timeout なら False
+
+        予測終了時刻の手前（問い合わせ 1 回分を差し引く）まで眠り、
+        その後はビジービットを詰めて問い合わせる。
+        """
+        start = self.move_started if self.move_started is not None else time.perf_counter()
+        wake = start + self.predicted_time * self.wake_margin - self.query_latency
+        delay = wake - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        deadline = start + max(timeout, self.predicted_time * 2)
+        while True:
+            try:
+                busy = self.is_busy()
+            except ValueError:
+                busy = True
+            if not busy:
+                self.last_move_time = time.perf_counter() - start
+                self.move_started = None
+                return True
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def move(self, pulses, direction, fspeed, timeout=12.0):
+        self.start_move(pulses, direction, fspeed)
+        return self.wait_motion(timeout)
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+DS102 / USB4000 のエミュレータ（実機なしでの動作確認・ベンチマーク用）
+
+DS102Model は AXIs1: 系のコマンド（Fspeed0 / PULS / GO / STOP / POS? / SB1? / MOTION? /
+HOMEP / ORG? …）を解釈し、台形駆動の移動時間（frog.ds102.predict_move_time）に従って
+位置とビジービットを時間とともに変える。つなぎ方は 2 通り:
+
+    PtyDS102      擬似端末（/dev/pts/N）を作って応答する。serial.Serial(port) でそのまま開ける
+    EmulatedSerial  同じプロセス内で pyserial の Serial の代わりに使う（スレッド・端末なし）
+
+MockSpectrometer は seabreeze の Spectrometer と同じ呼び出し（wavelengths / intensities /
+integration_time_micros / trigger_mode …）を持ち、その時点のステージ位置に対応する
+SHG-FROG のスペクトルに暗電流・読み出しノイズ・ショットノイズ・飽和を付けて返す。
+フリーランではフレーム周期の境界まで待ってから返すので、古いフレームの扱いも実機と同じになる。
+
+既存のスクリプトをそのまま動かすには:
+
+    python -m frog.emulator bata/FROG_Measure_GUI_ver.2.0.py
+
+で擬似端末の DS102 を立て、ポート一覧と seabreeze を差し替えてからスクリプトを実行する。
+"""
+
+import argparse
+import math
+import os
+import re
+import runpy
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+from frog.ds102 import DEFAULT_LSPEED, DEFAULT_RATE_MS, SB1_BUSY, SB1_ORIGIN, predict_move_time
+
+DS102_DESCRIPTION = "SURUGA SEIKI DS102 USB Serial Port"
+DS102_IDN = "SURUGA,DS102,0,1.00"
+
+# 遅延 [fs] = 2 × 移動量 [µm] / c（1 pulse = 1 µm）
+FS_PER_PULSE = 2 * 1e-6 / 299792458 * 1e15
+
+_COMMAND = re.compile(r"^([A-Za-z]+[0-9]*)(\?)?(?:[ =](.*))?$")
+
+
+class DS102Model:
+    """DS102 1 軸分の状態（位置・速度・移動中かどうか）と、コマンドの解釈"""
+
+    def __init__(self, position=0, fspeed=1000, lspeed=DEFAULT_LSPEED, rate_ms=DEFAULT_RATE_MS,
+                 settle_time=0.0, limits=(-100000, 100000), baudrate=9600, clock=time.perf_counter):
+        self.fspeed = fspeed
+        self.lspeed = lspeed
+        self.rate_ms = rate_ms
+        self.settle_time = settle_time      # 停止後にビジーが落ちるまでの時間 [s]
+        self.limits = limits
+        self.baudrate = baudrate
+        self.clock = clock
+        self.home = 0
+        self.settings = {
+            "UNIT": "0", "SELSP": "0", "RESOLUT": "1", "MEMSW0": "3", "DRDIV": "0",
+            "CWSOFTLIMITENABLE": "0", "CCWSOFTLIMITENABLE": "0",
+        }
+        self._lock = threading.Lock()
+        self._start_pos = position
+        self._target = position
+        self._t0 = clock()
+        self._duration = 0.0
+        self._pulses = 0
+
+    # --- 運動 ---------------------------------------------------------------
+
+    def _travelled(self, elapsed, distance):
+        """台形駆動で elapsed 秒後に進んだ距離（pulse, 符号なし）"""
+        if elapsed >= self._duration:
+            return distance
+        v0, vf = self.lspeed, max(self.fspeed, self.lspeed)
+        t_acc = self.rate_ms / 1000
+        if vf <= v0 or t_acc <= 0:
+            return vf * elapsed
+        acc = (vf - v0) / t_acc
+        t_half = self._duration / 2
+        t_ramp = min(t_acc, t_half)
+        v_top = v0 + acc * t_ramp
+        if elapsed <= t_ramp:
+            return v0 * elapsed + 0.5 * acc * elapsed ** 2
+        d_ramp = v0 * t_ramp + 0.5 * acc * t_ramp ** 2
+        t_cruise = self._duration - 2 * t_ramp
+        if elapsed <= t_ramp + t_cruise:
+            return d_ramp + v_top * (elapsed - t_ramp)
+        t_dec = elapsed - t_ramp - t_cruise
+        return min(distance, d_ramp + v_top * t_cruise + v_top * t_dec - 0.5 * acc * t_dec ** 2)
+
+    def position_at(self, now=None):
+        """時刻 now の位置 [pulse]（移動中は小数）"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            distance = abs(self._target - self._start_pos)
+            if distance == 0:
+                return float(self._target)
+            moved = self._travelled(max(0.0, now - self._t0), distance)
+            return self._start_pos + math.copysign(min(moved, distance), self._target - self._start_pos)
+
+    @property
+    def position(self):
+        return int(round(self.position_at()))
+
+    def is_busy(self, now=None):
+        now = self.clock() if now is None else now
+        return now - self._t0 < self._duration + self.settle_time
+
+    def start_move(self, target):
+        target = int(min(max(target, self.limits[0]), self.limits[1]))
+        now = self.clock()
+        start = self.position_at(now)
+        with self._lock:
+            self._start_pos = start
+            self._target = target
+            self._t0 = now
+            self._duration = predict_move_time(target - start, self.fspeed, self.lspeed, self.rate_ms)
+
+    def stop(self):
+        pos = self.position_at()
+        with self._lock:
+            self._start_pos = self._target = int(round(pos))
+            self._duration = 0.0
+            self._t0 = self.clock() - self.settle_time
+
+    def set_position(self, value):
+        """論理位置を書き換える（POS n / POS=n）。移動中なら止める"""
+        offset = int(value) - self.position
+        self.stop()
+        with self._lock:
+            self._start_pos += offset
+            self._target += offset
+
+    def status(self):
+        value = SB1_BUSY if self.is_busy() else 0
+        if self.position == 0:
+            value |= SB1_ORIGIN
+        return value
+
+    # --- コマンド -----------------------------------------------------------
+
+    def handle(self, line):
+        """1 行（CR なし）を処理し、応答（無ければ None）を返す"""
+        line = line.strip()
+        if not line:
+            return None
+        reply = None
+        parts = line.split(":")
+        if re.match(r"^AXI(?:s)?\d+$", parts[0], re.IGNORECASE):
+            parts = parts[1:]
+        for part in parts:
+            out = self._command(part.strip())
+            if out is not None:
+                reply = out
+        return reply
+
+    def _command(self, text):
+        m = _COMMAND.match(text.lstrip("*"))
+        if not m:
+            return None
+        name, query, arg = m.group(1).upper(), m.group(2), m.group(3)
+        # 省略形（大文字部分）と完全形のどちらでも受ける
+        key = {
+            "FSPEED0": "F0", "F0": "F0", "LSPEED0": "L0", "L0": "L0", "RATE0": "R0", "R0": "R0",
+            "PULS": "PULS", "PULSE": "PULS", "GO": "GO", "STOP": "STOP",
+            "POS": "POS", "POSITION": "POS", "HOMEP": "HOMEP", "HOMEPOSITION": "HOMEP",
+            "SB1": "SB1", "SB2": "SB2", "SB3": "SB3", "MOTION": "MOTION", "ORG": "ORG",
+            "IDN": "IDN", "DS102VER": "VER", "CONTA": "CONTA",
+            "MEMORYSWITCH0": "MEMSW0", "MEMSW0": "MEMSW0", "DRIVERDIVISION": "DRDIV", "DRDIV": "DRDIV",
+            "SELECTSPEED": "SELSP", "SELSP": "SELSP", "RESOLUTION": "RESOLUT", "RESOLUT": "RESOLUT",
+            "UNIT": "UNIT",
+        }.get(name, name)
+        if query:
+            return self._query(key)
+        if key == "F0":
+            self.fspeed = int(arg)
+        elif key == "L0":
+            self.lspeed = int(arg)
+        elif key == "R0":
+            self.rate_ms = int(arg)
+        elif key == "PULS":
+            self._pulses = int(arg)
+        elif key == "GO":
+            self._go(arg.strip().upper())
+        elif key == "STOP":
+            self.stop()
+        elif key == "POS":
+            self.set_position(int(arg))
+        elif key == "HOMEP":
+            self.home = int(arg)
+        elif arg is not None:
+            self.settings[key] = arg.strip()
+        return None
+
+    def _go(self, mode):
+        pos = self.position
+        pulses = self._pulses
+        if mode == "0":
+            self.start_move(pos + pulses)
+        elif mode == "1":
+            self.start_move(pos - pulses)
+        elif mode == "3":
+            self.start_move(self.home)
+        elif mode in ("4", "ORG"):
+            self.start_move(0)
+        elif mode == "CWJ":
+            self.start_move(self.limits[1])
+        elif mode == "CCWJ":
+            self.start_move(self.limits[0])
+
+    def _query(self, key):
+        if key == "POS":
+            return str(self.position)
+        if key == "SB1":
+            return str(self.status())
+        if key in ("SB2", "SB3"):
+            return "0"
+        if key == "MOTION":
+            return "1" if self.is_busy() else "0"
+        if key == "HOMEP":
+            return str(self.home)
+        if key == "ORG":
+            return "0"
+        if key == "F0":
+            return str(self.fspeed)
+        if key == "IDN":
+            return DS102_IDN
+        if key == "VER":
+            return "1.00"
+        if key == "CONTA":
+            return "2"
+        return self.settings.get(key, "0")
+
+    def reply_delay(self, n_bytes):
+        """9600 bps なら 1 バイト約 1 ms の転送時間"""
+        return n_bytes * 10 / self.baudrate if self.baudrate else 0.0
+
+
+class EmulatedSerial:
+    """pyserial の Serial の代わりに DS102Model と直接つなぐ（write / read_until / readline）"""
+
+    def __init__(self, model=None, timeout=1.0, port="emulated-ds102"):
+        self.model = model or DS102Model()
+        self.timeout = timeout
+        self.port = port
+        self.is_open = True
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._ready_at = 0.0
+
+    def write(self, data):
+        self._tx += data
+        n_in = len(data)
+        while b"\r" in self._tx:
+            line, _, rest = bytes(self._tx).partition(b"\r")
+            self._tx = bytearray(rest)
+            reply = self.model.handle(line.decode("utf-8", "replace"))
+            if reply is not None:
+                out = (reply + "\r").encode("utf-8")
+                self._ready_at = time.perf_counter() + self.model.reply_delay(n_in + len(out))
+                self._rx += out
+        return len(data)
+
+    def read_until(self, expected=b"\r", size=None):
+        wait = self._ready_at - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        i = self._rx.find(expected)
+        if i < 0:
+            if self.timeout:
+                time.sleep(self.timeout)
+            data, self._rx = bytes(self._rx), bytearray()
+            return data
+        data = bytes(self._rx[:i + len(expected)])
+        del self._rx[:i + len(expected)]
+        return data
+
+    def readline(self):
+        return self.read_until(b"\n")
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def close(self):
+        self.is_open = False
+
+
+class PtyDS102:
+    """擬似端末の向こう側で DS102Model を動かす（Linux / macOS）"""
+
+    def __init__(self, model=None):
+        import pty
+        import tty
+
+        self.model = model or DS102Model()
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="ds102-emulator", daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        import select
+
+        buf = b""
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self.master, 1024)
+            except OSError:
+                break
+            buf += chunk
+            while b"\r" in buf:
+                line, _, buf = buf.partition(b"\r")
+                reply = self.model.handle(line.decode("utf-8", "replace"))
+                if reply is not None:
+                    out = (reply + "\r").encode("utf-8")
+                    time.sleep(self.model.reply_delay(len(line) + 1 + len(out)))
+                    os.write(self.master, out)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def usb4000_wavelengths(n_pixels=3648):
+    """USB4000 らしい 2 次の波長校正（画素 1002 が約 390 nm）"""
+    p = np.arange(n_pixels, dtype=float)
+    return 177.0 + 0.2215 * p - 1.05e-5 * p ** 2
+
+
+def shg_frog_trace(wavelengths, delays, center_nm=800.0, duration_fs=30.0, chirp=0.5, n_time=1024):
+    """ガウスパルス（線形チャープ付き）の SHG-FROG トレース（delays × wavelengths, 最大 1）
+
+    E_sig(t, τ) = E(t) E(t - τ) を時間方向に FFT し、2 倍波の周波数から波長の画素へ補間する。
+    """
+    c = 299792458e-6  # nm/fs
+    t_span = max(16 * duration_fs, 2 * np.max(np.abs(delays)) + 8 * duration_fs)
+    t = np.linspace(-t_span / 2, t_span / 2, n_time, endpoint=False)
+    dt = t[1] - t[0]
+    tau_g = duration_fs / (2 * np.sqrt(np.log(2)))
+    field = np.exp(-(t / tau_g) ** 2 * (1 - 1j * chirp))
+    # 遅延は時間格子にそろえずに、周波数領域の位相で任意にずらす
+    freq = np.fft.fftfreq(n_time, dt)
+    spec = np.fft.fft(field)
+    delays = np.asarray(delays, dtype=float)
+    shifted = np.fft.ifft(spec[None, :] * np.exp(-2j * np.pi * freq[None, :] * delays[:, None]), axis=1)
+    sig = field[None, :] * shifted
+    power = np.abs(np.fft.fftshift(np.fft.fft(sig, axis=1), axes=1)) ** 2
+    nu = np.fft.fftshift(freq) + 2 * c / center_nm  # 2 倍波の周波数 [1/fs]
+    target = c / np.asarray(wavelengths, dtype=float)
+    idx = np.clip(np.searchsorted(nu, target), 1, n_time - 1)
+    w = np.clip((target - nu[idx - 1]) / (nu[idx] - nu[idx - 1]), 0.0, 1.0)
+    trace = power[:, idx - 1] * (1 - w) + power[:, idx] * w
+    trace /= trace.max()
+    return trace
+
+
+class MockSpectrometer:
+    """seabreeze.spectrometers.Spectrometer の代わりに合成 SHG-FROG スペクトルを返す
+
+    stage は位置を返す呼び出し可能オブジェクトか DS102Model。
+    zero_position [pulse] で遅延ゼロ、peak_rate [counts/ms] がトレース最大のカウントレート。
+    """
+
+    model = "USB4000"
+    serial_number = "EMU00001"
+    max_intensity = 65535.0
+
+    def __init__(self, stage=None, zero_position=40.0, peak_rate=200.0, dark_offset=1500.0,
+                 dark_rate=0.5, read_noise=8.0, transfer_time=0.004, n_pixels=3648,
+                 delay_range_fs=1500.0, seed=None, clock=time.perf_counter, **pulse):
+        if isinstance(stage, DS102Model):
+            self._position = stage.position_at
+        else:
+            self._position = stage or (lambda: zero_position)
+        self.zero_position = zero_position
+        self.peak_rate = peak_rate
+        self.dark_offset = dark_offset
+        self.dark_rate = dark_rate
+        self.read_noise = read_noise
+        self.transfer_time = transfer_time
+        self.clock = clock
+        self.pixels = n_pixels
+        self._wavelengths = usb4000_wavelengths(n_pixels)
+        self._delay_grid = np.linspace(-delay_range_fs, delay_range_fs, 601)
+        self._trace = shg_frog_trace(self._wavelengths, self._delay_grid, **pulse)
+        self._rng = np.random.default_rng(seed)
+        self._integration_us = 100000
+        self._trigger_mode = 0
+        self._t0 = clock()
+        self.closed = False
+
+    # seabreeze と同じ呼び出し
+    def wavelengths(self):
+        return self._wavelengths.copy()
+
+    def integration_time_micros(self, us):
+        self._integration_us = int(us)
+        self._t0 = self.clock()
+
+    def trigger_mode(self, mode):
+        self._trigger_mode = int(mode)
+
+    def close(self):
+        self.closed = True
+
+    def signal(self, delay_fs):
+        """遅延 delay_fs [fs] での正規化スペクトル（0〜1）"""
+        g = self._delay_grid
+        x = np.clip((delay_fs - g[0]) / (g[1] - g[0]), 0, len(g) - 1)
+        i = min(int(x), len(g) - 2)
+        w = x - i
+        return self._trace[i] * (1 - w) + self._trace[i + 1] * w
+
+    def intensities(self, correct_dark_counts=False, correct_nonlinearity=False):
+        period = self._integration_us / 1e6
+        now = self.clock()
+        if self._trigger_mode == 0:
+            # フリーラン: 次のフレーム境界で露光が終わったフレームを返す
+            k = math.floor((now - self._t0) / period) + 1
+            end = self._t0 + k * period
+        else:
+            end = now + period
+        wait = end + self.transfer_time - self.clock()
+        if wait > 0:
+            time.sleep(wait)
+        delay = (self._position_at(end - period / 2) - self.zero_position) * FS_PER_PULSE
+        t_ms = period * 1000
+        mean = self.peak_rate * t_ms * self.signal(delay)
+        counts = mean + self._rng.normal(0.0, 1.0, self.pixels) * np.sqrt(mean + self.read_noise ** 2)
+        counts += self.dark_offset + self.dark_rate * t_ms
+        return np.clip(np.round(counts), 0, self.max_intensity)
+
+    def _position_at(self, t):
+        try:
+            return self._position(t)
+        except TypeError:
+            return self._position()
+
+
+def mock_seabreeze(spectrometers):
+    """seabreeze.spectrometers の代わりのモジュール（list_devices / Spectrometer）を作る"""
+    module = types.ModuleType("seabreeze.spectrometers")
+    devices = list(spectrometers)
+    module.list_devices = lambda: list(devices)
+    module.Spectrometer = lambda device: device
+    module.Spectrometer.from_first_available = lambda: devices[0]
+    return module
+
+
+def install(stage_model=None, spectrometer=None, pty_port=True):
+    """擬似端末の DS102 と模擬分光器を立て、serial.tools.list_ports と seabreeze を差し替える
+
+    戻り値は (PtyDS102 または EmulatedSerial, MockSpectrometer)。
+    """
+    import serial.tools.list_ports
+    from serial.tools.list_ports_common import ListPortInfo
+
+    stage_model = stage_model or DS102Model()
+    spectrometer = spectrometer or MockSpectrometer(stage_model)
+    link = PtyDS102(stage_model) if pty_port else EmulatedSerial(stage_model)
+    info = ListPortInfo(link.port, skip_link_detection=True)
+    info.description = DS102_DESCRIPTION
+    info.hwid = "USB VID:PID=0403:6001 SER=EMULATED"
+    info.manufacturer = "SURUGA SEIKI"
+    real_comports = serial.tools.list_ports.comports
+    serial.tools.list_ports.comports = lambda *a, **k: list(real_comports(*a, **k)) + [info]
+
+    package = sys.modules.get("seabreeze") or types.ModuleType("seabreeze")
+    package.spectrometers = mock_seabreeze([spectrometer])
+    sys.modules["seabreeze"] = package
+    sys.modules["seabreeze.spectrometers"] = package.spectrometers
+    return link, spectrometer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DS102 / USB4000 エミュレータ")
+    parser.add_argument("script", nargs="?", help="エミュレータにつないで実行するスクリプト（省略時はポートを開いて待つ）")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="スクリプトへの引数")
+    parser.add_argument("--zero", type=float, default=40.0, help="遅延ゼロのステージ位置 [pulse]")
+    parser.add_argument("--peak-rate", type=float, default=200.0, help="トレース最大のカウントレート [counts/ms]")
+    parser.add_argument("--duration", type=float, default=30.0, help="パルス幅 FWHM [fs]")
+    parser.add_argument("--chirp", type=float, default=0.5, help="線形チャープ係数")
+    args = parser.parse_args(argv)
+
+    model = DS102Model()
+    spec = MockSpectrometer(model, zero_position=args.zero, peak_rate=args.peak_rate,
+                            duration_fs=args.duration, chirp=args.chirp)
+    link, _ = install(model, spec)
+    print(f"DS102 エミュレータ: {link.port}（{DS102_DESCRIPTION}）")
+    if args.script is None:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            link.close()
+        return
+    # スクリプトからはリポジトリ直下と自分のディレクトリが見えるようにする
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    finally:
+        link.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,919 @@
+# -*- coding: utf-8 -*-
+"""
+GUI を使わない FROG スキャンエンジン
+
+DS102 と分光器のセッションを受け取り、ステップスキャン（適応サンプリング・HDR・往復マルチパスを含む）
+または連続スキャンを実行して、トレース・txt・csv・所要時間を書き出す。
+進捗・取得した列・ステージ位置はコールバックで知らせるので、GUI（bata/FROG_Measure_GUI_ver.2.0.py）は
+コールバックから Qt のシグナルを出すだけになる。
+
+config_frog.yml のスキャンをまとめて実行する:
+
+    python -m frog.engine config_frog.yml
+    python -m frog.engine config_frog.yml --emulate      # 実機なし（frog.emulator）
+    python -m frog.engine config_frog.yml --resume data/20250515_183554_FROG.checkpoint.npz
+
+scan はスキャン 1 本分の既定値で、scans にリストを書くと順に実行する（各要素が scan を上書きする）:
+
+    scan: {start_step: 0, end_step: 100, step_size: 1}
+    scans:
+      - {name: coarse, step_size: 5}
+      - {name: fine, start_step: 30, end_step: 70, n_average: 4, hdr: true}
+
+start_step / end_step はスキャン開始時のステージ位置（HOME）からのパルス数。
+
+spectrometer.background: true なら各スキャンの前に BG を取る。background_position（HOME 基準の
+パルス数。パルスが重ならない遅延）を書けばステージをそこへ動かして取り、書かなければビームを止める・
+戻すのを Enter で確認してから進む:
+
+    spectrometer: {integration_time_us: 100000, background: true, background_position: -2000}
+"""
+
+import argparse
+import contextlib
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from frog.checkpoint import CHECKPOINT_INTERVAL, EXTENSION as CHECKPOINT_EXTENSION, Checkpoint
+from frog.ds102 import DS102
+from frog.hdr import HDRAcquirer
+from frog.logutil import LOG_FORMAT, DATE_FORMAT, LOGGER_NAME, setup_logging
+from frog.metrics import ScanMetrics
+from frog.passes import REVERSE, BacklashTable, merge_passes, pass_positions
+from frog.planner import AdaptiveDelayPlanner
+from frog.spectrometer import SpectrometerSession
+from frog.tracefile import ColumnStore, Trace, TraceWriter, export_csv, export_txt, write_wavelength_major_csv
+
+logger = logging.getLogger("frog.measure")
+
+DS102_DESCRIPTION = "SURUGA SEIKI DS102 USB Serial Port"
+
+# パイプライン各段の間のキュー長（処理・書き込みが遅れたときは取得側を待たせる）
+PIPELINE_QUEUE_SIZE = 8
+
+# 1 点で複数フレームを平均するときの外れ値判定 [σ]
+CLIP_SIGMA = 3.0
+
+# HDR 取得で使う最短の積分時間 [ms]（USB4000 の下限 3.8ms より少し上）
+HDR_MIN_MS = 4.0
+
+# 適応サンプリング: 細かくする区間の判定閾値（最大信号・最大曲率に対する比）
+ADAPTIVE_THRESHOLD = 0.05
+# 後ろ向きに戻るときの行き過ぎ量 [pulse]（位置決めは常に前進方向から行う）
+BACKLASH_PULSES = 20
+
+# 連続スキャンの速度を決めるために、止まったまま回すループの回数
+FLY_CALIBRATION_LOOPS = 5
+
+# YAML の scan に書けるキーの既定値（GUI の初期値と同じ）
+SCAN_DEFAULTS = {
+    'start_step': 0,
+    'end_step': 75,
+    'step_size': 1,
+    'n_average': 1,
+    'fspeed': 1000,
+    'fly_scan': False,
+    'adaptive': False,
+    'coarse_step': 5,
+    'hdr': False,
+    'hdr_bracket': 1,
+    'n_passes': 1,
+    'bidirectional': True,
+}
+
+
+def start_stage_move(stage, fspeed, pulses, direction):
+    """移動コマンドを送るだけで停止は待たない"""
+    stage.start_move(pulses, direction, fspeed)
+
+
+def make_hdr(session, params, background=None):
+    """params の積分時間を上限として HDRAcquirer を作る"""
+    bracket = params.get('hdr_bracket', 1)
+    return HDRAcquirer(
+        session, min_ms=HDR_MIN_MS, max_ms=max(params['integration_time_ms'], HDR_MIN_MS),
+        brackets=(1, bracket) if bracket > 1 else (1,), n_frames=params.get('n_average', 1),
+        clip_sigma=CLIP_SIGMA, background=background
+    )
+
+
+def start_stage_move_by(stage, fspeed, delta, approach=True):
+    """delta [pulse] 先への移動を開始する
+
+    approach=True なら戻る場合も行き過ぎてから前進方向で止める。
+    往復スキャンの復路では approach=False でそのまま戻り、ずれはオフセット表で補正する。
+    """
+    if delta < 0 and approach:
+        stage.move(-delta + BACKLASH_PULSES, 1, fspeed)
+        delta = BACKLASH_PULSES
+    start_stage_move(stage, fspeed, abs(delta), 0 if delta >= 0 else 1)
+
+
+def wait_stage_stop(stage, start_time, metrics=None, point=None):
+    """停止を待つ。metrics を渡すと待ち時間（wait）と移動全体（move）のスパンを残す"""
+    try:
+        t0 = time.perf_counter()
+        ok = stage.wait_motion()
+        if metrics is not None:
+            t1 = time.perf_counter()
+            metrics.record("wait", point, t0, t1)
+            if ok and stage.last_move_time is not None:
+                metrics.record("move", point, t1 - stage.last_move_time, t1)
+        if ok:
+            end_time = datetime.datetime.now()
+            logger.debug(f"ステージ停止検出: {end_time.strftime('%H:%M:%S.%f')[:-3]}（移動に{(end_time - start_time).total_seconds():.2f}秒）")
+            return True
+        logger.error("ステージ移動タイムアウトエラー")
+        return False
+    except Exception as e:
+        logger.error(f"ステージ移動例外エラー: {e}")
+        return False
+
+
+def move_stage_to(stage, fspeed, target, label="目標位置"):
+    """絶対位置 target [pulse] へ前進方向から位置決めして停止を待つ"""
+    try:
+        pos = stage.position()
+    except Exception:
+        logger.error(f"現在位置を取得できないため{label}へ移動できません")
+        return False
+    if pos == target:
+        return True
+    logger.info(f"{label}へ移動: {pos} → {target}")
+    moving_since = datetime.datetime.now()
+    start_stage_move_by(stage, fspeed, target - pos)
+    return wait_stage_stop(stage, moving_since)
+
+
+def interpolate_delay(t, pos_times, positions, origin, fs_per_pulse):
+    """時刻 t におけるステージ位置をタイムスタンプ付き位置から線形補間し、遅延[fs]に変換"""
+    pos = np.interp(t, pos_times, positions)
+    return (pos - origin) * fs_per_pulse
+
+
+class PipelineStage(threading.Thread):
+    """上流キューから取り出して func を適用し、結果を下流キューへ流すワーカー
+
+    None を受け取ると下流へ None を伝えて終了する。例外は error に保持し、
+    以降の要素は読み捨てて上流が詰まらないようにする。
+    """
+
+    def __init__(self, func, in_queue, out_queue=None, name=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                result = self.func(item)
+            except Exception as e:
+                self.error = e
+                continue
+            if self.out_queue is not None and result is not None:
+                self.out_queue.put(result)
+        if self.out_queue is not None:
+            self.out_queue.put(None)
+
+
+class ScanEngine:
+    """1 本のスキャンを実行する
+
+    params は GUI の測定条件と同じ dict（integration_time_ms, n_average, step_size, range_input,
+    home_position, fspeed, dt, fly_scan, adaptive, coarse_step, hdr, hdr_bracket, hdr_background,
+    n_passes, bidirectional）。start_position [pulse] があれば先にそこへ移動し、
+    遅延は home_position を 0 fs として数える。name はファイル名の末尾に付ける。
+
+    コールバック: on_progress(%), on_column(点番号, 遅延[fs], スペクトル), on_position(位置 or None),
+    on_saved(csv のパス)。run() の戻り値は点数・中断の有無・出力ファイルの dict。
+
+    ステップスキャンはチェックポイントを書く。resume_from に Checkpoint を渡すと、
+    その測定条件・BG で次の点から同じファイルに続けて測る（params は使わない）。
+    """
+
+    def __init__(self, stage, session, params, data_dir, backlash_table=None,
+                 on_progress=None, on_column=None, on_position=None, on_saved=None, resume_from=None):
+        self.stage = stage
+        self.session = session
+        if resume_from is not None:
+            params = dict(resume_from.params, hdr_background=resume_from.hdr_background)
+        self.params = params
+        self.resume_from = resume_from
+        self.data_dir = data_dir
+        self.backlash_table = backlash_table
+        self.on_progress = on_progress
+        self.on_column = on_column
+        self.on_position = on_position
+        self.on_saved = on_saved
+        self.metrics = None
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def get_position(self):
+        try:
+            return self.stage.position()
+        except Exception:
+            return None
+
+    def report_position(self):
+        if self.on_position is not None:
+            self.on_position(self.get_position())
+
+    @property
+    def fs_per_pulse(self):
+        return self.params['dt'] / self.params['step_size']
+
+    @property
+    def origin_offset(self):
+        """スキャン開始位置の HOME からのずれ [pulse]"""
+        start = self.params.get('start_position')
+        return 0 if start is None else start - self.params.get('home_position', start)
+
+    def planned_delays(self):
+        """ライブ表示に使う遅延軸 [fs]"""
+        n = self.params['range_input'] // self.params['step_size']
+        if self.params.get('fly_scan') or self.params.get('adaptive'):
+            n += 1
+        return np.arange(max(n, 1)) * self.params['dt'] + self.origin_offset * self.fs_per_pulse
+
+    def delay_positions(self):
+        """測定位置 [pulse, 開始位置基準] の生成器と、最大点数・planner・パスの並びを返す
+
+        適応サンプリングでは planner も返すので、測定後に planner.record() で信号を渡す。
+        マルチパスでは pass_positions() の (方向, 位置) のリストも返す。
+        """
+        step_size = self.params['step_size']
+        range_input = self.params['range_input']
+        if self.params.get('adaptive'):
+            planner = AdaptiveDelayPlanner(
+                0, range_input, self.params.get('coarse_step', 5 * step_size), step_size,
+                threshold=ADAPTIVE_THRESHOLD
+            )
+            return iter(planner), planner.max_points, planner, None
+        loop_num = range_input // step_size
+        n_passes = self.params.get('n_passes', 1)
+        if n_passes > 1:
+            passes = pass_positions(0, (loop_num - 1) * step_size, step_size, n_passes,
+                                    self.params.get('bidirectional', True))
+            positions = (int(p) for _, pos in passes for p in pos)
+            return positions, loop_num * n_passes, None, passes
+        return iter(range(0, loop_num * step_size, step_size)), loop_num, None, None
+
+    def load_backlash(self):
+        """復路のオフセット表を読む。無ければ補正なし"""
+        if not self.params.get('bidirectional', True) or self.backlash_table is None:
+            return None
+        if os.path.exists(self.backlash_table):
+            logger.info(f"バックラッシュ補正: {self.backlash_table}")
+            return BacklashTable.load(self.backlash_table)
+        logger.warning(f"バックラッシュのオフセット表 {self.backlash_table} が無いので復路を補正せずに平均します")
+        return None
+
+    def write_merged_trace(self, passes, t_axis, data2d, wavelengths, file_name_trc, metadata):
+        """パスごとの点を往路の格子で平均したトレースを書き、パスの統計を返す"""
+        fs_per_pulse = self.fs_per_pulse
+        bounds = np.cumsum([0] + [len(pos) for _, pos in passes])
+        # 最後まで測れたパスだけを平均する
+        acquired = [
+            (direction, pos, data2d[b0:b1])
+            for (direction, pos), b0, b1 in zip(passes, bounds[:-1], bounds[1:]) if b1 <= len(t_axis)
+        ]
+        if not acquired:
+            return None
+        grid = np.sort(passes[0][1]).astype(float)
+        mean, var, stats = merge_passes(acquired, grid, self.load_backlash())
+        for st in stats:
+            st['shift_fs'] = st.pop('shift') * fs_per_pulse
+            logger.info(
+                f"パス {st['pass']}（方向 {st['direction']}, {st['n_points']} 点）: 重心ずれ {st['shift_fs']:+.2f} fs, "
+                f"強度比 {st['intensity_ratio']:.3f}, 残差 {st['rms_residual']:.3f}"
+            )
+        metadata = dict(metadata, merged_passes=len(acquired), pass_stats=stats)
+        with TraceWriter(file_name_trc, wavelengths, metadata=metadata, variance=len(acquired) > 1) as merged:
+            for k, t in enumerate((grid + self.origin_offset) * fs_per_pulse):
+                merged.append(mean[k], t, variance=var[k])
+        return stats
+
+    def trace_metadata(self):
+        """トレースファイルのヘッダに残す測定条件"""
+        meta = {k: v for k, v in self.params.items() if isinstance(v, (int, float, bool, str))}
+        meta['model'] = self.session.model
+        if self.params.get('hdr'):
+            meta['units'] = 'counts/ms'
+            meta['background_subtracted'] = self.params.get('hdr_background') is not None
+        else:
+            meta['background_subtracted'] = self.session.background is not None
+        return meta
+
+    def file_names(self):
+        """(txt, csv, frogtrc, 拡張子なしの共通部分) のパス"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        name = self.params.get('name')
+        base = os.path.join(self.data_dir, f"{now}_FROG_{name}" if name else f"{now}_FROG")
+        return base + ".txt", base + ".csv", base + ".frogtrc", base
+
+    def move_to_start(self):
+        """start_position が指定されていれば前進方向から位置決めする"""
+        target = self.params.get('start_position')
+        if target is None:
+            return True
+        return move_stage_to(self.stage, self.params['fspeed'], target, "開始位置")
+
+    def verify_position(self, expected):
+        pos = self.get_position()
+        if pos != expected:
+            raise RuntimeError(f"位置の確認に失敗しました: 現在 {pos} pulse, 期待値 {expected} pulse")
+        logger.info(f"位置を確認しました: {pos} pulse")
+
+    def seek_resume_position(self, origin, pos, reverse=False):
+        """HOME へ戻って位置を確かめ、スキャン位置 pos へ測定時と同じ向きから近づける"""
+        fspeed = self.params['fspeed']
+        home = self.params.get('home_position')
+        home = origin if home is None else home
+        if not move_stage_to(self.stage, fspeed, home, "HOME"):
+            raise RuntimeError("HOME へ戻れませんでした")
+        self.verify_position(home)
+        target = origin + pos
+        if reverse:
+            # 復路の点は上から近づける（オフセット表は復路の向きで測ったずれ）
+            if not move_stage_to(self.stage, fspeed, target + BACKLASH_PULSES, "再開位置の手前"):
+                raise RuntimeError("再開位置へ移動できませんでした")
+            moving_since = datetime.datetime.now()
+            start_stage_move_by(self.stage, fspeed, -BACKLASH_PULSES, approach=False)
+            ok = wait_stage_stop(self.stage, moving_since)
+        else:
+            ok = move_stage_to(self.stage, fspeed, target, "再開位置")
+        if not ok:
+            raise RuntimeError("再開位置へ移動できませんでした")
+        self.verify_position(target)
+
+    def run(self):
+        result = {'name': self.params.get('name'), 'points': 0, 'completed': False, 'files': {}}
+        try:
+            if self.resume_from is not None:
+                self.run_stepwise(result)
+                return result
+            if not self.move_to_start():
+                result['error'] = "開始位置への移動に失敗しました"
+                return result
+            if self.params.get('fly_scan'):
+                self.run_fly_scan(result)
+            else:
+                self.run_stepwise(result)
+        except Exception as e:
+            msg_err = f"測定中エラー: {e}"
+            logger.error(msg_err)
+            result['error'] = str(e)
+        return result
+
+    def run_stepwise(self, result):
+        step_size = self.params['step_size']
+        integration_time_ms = self.params['integration_time_ms']
+        fspeed = self.params['fspeed']
+
+        fs_per_pulse = self.fs_per_pulse
+        delay_offset = self.origin_offset * fs_per_pulse
+        positions, loop_num, planner, passes = self.delay_positions()
+
+        wavelengths = self.session.wavelengths
+        n_wl = self.session.n_pixels
+        # 遅延は測定順に追加する（適応サンプリングでは昇順とは限らない）
+        t_axis = []
+        data2d = np.zeros((loop_num, n_wl))
+        # 複数フレーム平均のときは画素ごとの分散も残す
+        n_average = self.params.get('n_average', 1)
+        var2d = np.full((loop_num, n_wl), np.nan) if n_average > 1 else None
+        # HDR: 点ごとに積分時間を選び、カウント/ms に揃えたスペクトルを記録する
+        hdr = make_hdr(self.session, self.params, self.params.get('hdr_background')) if self.params.get('hdr') else None
+
+        resume = self.resume_from
+        if resume is None:
+            file_name, file_name_csv, file_name_trc, base = self.file_names()
+            origin = self.get_position()
+            logger.info(f"測定データを {file_name_trc} に記録し、{file_name} (txt) および {file_name_csv} (csv) に保存します")
+        else:
+            files = resume.files
+            file_name, file_name_csv, file_name_trc, base = files['txt'], files['csv'], files['trace'], files['base']
+            origin = resume.origin
+            if origin is None:
+                raise RuntimeError("チェックポイントにスキャン原点が無いので再開できません")
+            if resume.background is not None:
+                self.session.background = resume.background.copy()
+            logger.info(f"{file_name_trc} の {resume.n_done} 点目から測定を再開します")
+        # 点ごと・フェーズごとの所要時間（GUI は metrics から p50/p95 を読む）
+        metrics = self.metrics = ScanMetrics(base + (".metrics.npz" if resume is None else "_resumed.metrics.npz"))
+        point_started = {}
+        result['files'] = {'trace': file_name_trc, 'metrics': metrics.path}
+        checkpoint = Checkpoint(
+            base + CHECKPOINT_EXTENSION, self.params,
+            {'trace': file_name_trc, 'csv': file_name_csv, 'txt': file_name, 'base': base}, origin,
+            background=None if self.session.background is None else self.session.background.copy(),
+            hdr_background=self.params.get('hdr_background'),
+        )
+        last_checkpoint = [time.monotonic()]
+
+        # 取得（このスレッド）→ 処理 → 書き込み → 通知 をキューでつなぐ
+        proc_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        write_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        notify_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+        def process(item):
+            i, measure_start = item
+            t0 = time.perf_counter()
+            y = data2d[i]
+            if self.session.background is not None:
+                msg_bg = f"BG減算: 測定点 {i} でBGスペクトルを引きました"
+                logger.debug(msg_bg)
+            max_int = np.nanmax(y)
+            measure_end = datetime.datetime.now()
+            msg2 = f"測定完了: index={i}, max_intensity={max_int:.2f}, {measure_end.strftime('%H:%M:%S.%f')[:-3]}（測定{(measure_end-measure_start).total_seconds():.2f}秒）"
+            logger.debug(msg2)
+            metrics.record("process", i, t0)
+            return i, measure_end.timestamp()
+
+        self.session.set_integration_time_ms(integration_time_ms)
+        if resume is None:
+            trace = TraceWriter(file_name_trc, wavelengths, metadata=self.trace_metadata(),
+                                variance=var2d is not None)
+        else:
+            trace = TraceWriter.reopen(file_name_trc, resume.n_done)
+            done = Trace(file_name_trc)
+            n_done = trace.n_records
+            data2d[:n_done] = done.frames[:n_done]
+            if var2d is not None and done.variances is not None:
+                var2d[:n_done] = done.variances[:n_done]
+            t_axis.extend(float(t) for t in done.delays[:n_done])
+            del done
+        # CSV 用に波長×遅延へ転置した列をディスク上に足していく
+        columns = ColumnStore(file_name_csv + ".cols", wavelengths, capacity=loop_num)
+        for k in range(len(t_axis)):
+            columns.append(data2d[k], t_axis[k])
+
+        def save_checkpoint(n_done, position=None):
+            trace.flush()
+            checkpoint.n_done = n_done
+            checkpoint.position = position
+            checkpoint.save()
+            last_checkpoint[0] = time.monotonic()
+
+        with trace:
+
+            def write(item):
+                i, timestamp = item
+                with metrics.span("write", i):
+                    trace.append(data2d[i], t_axis[i], timestamp, None if var2d is None else var2d[i])
+                    columns.append(data2d[i], t_axis[i])
+                    if time.monotonic() - last_checkpoint[0] >= CHECKPOINT_INTERVAL:
+                        save_checkpoint(trace.n_records)
+                return i
+
+            def notify(i):
+                with metrics.span("update", i):
+                    done = planner.progress() if planner is not None else (i + 1) / loop_num
+                    if self.on_progress is not None:
+                        self.on_progress(int(done * 100))
+                    if self.on_column is not None:
+                        self.on_column(i, t_axis[i], data2d[i])
+                # 取得開始から通知まで
+                metrics.record("point", i, point_started[i])
+
+            stages = [
+                PipelineStage(process, proc_q, write_q, name="frog-process"),
+                PipelineStage(write, write_q, notify_q, name="frog-write"),
+                PipelineStage(notify, notify_q, name="frog-notify"),
+            ]
+            for stage in stages:
+                stage.start()
+            finished = False
+            try:
+                moving_since = None
+                i = len(t_axis)
+                # 再開時は記録済みの点の位置を測定条件から作り直して突き合わせる（適応サンプリングは信号も渡す）
+                for k in range(i):
+                    p = next(positions, None)
+                    if p is None or abs(p * fs_per_pulse + delay_offset - t_axis[k]) > 1e-3:
+                        raise RuntimeError(f"記録済みの {k} 点目の遅延が測定条件と合いません")
+                    if planner is not None:
+                        planner.record(p, np.sum(data2d[k]))
+                pos = next(positions, None)
+                if resume is not None and pos is not None:
+                    reverse = False
+                    if passes is not None and self.params.get('bidirectional', True):
+                        bounds = np.cumsum([len(p) for _, p in passes])
+                        reverse = passes[int(np.searchsorted(bounds, i, side="right"))][0] == REVERSE
+                    self.seek_resume_position(origin, pos, reverse)
+                while pos is not None:
+                    if not self.running:
+                        msg = "測定をユーザーが中断しました。"
+                        logger.info(msg)
+                        break
+                    failed = next((st for st in stages if st.error is not None), None)
+                    if failed is not None:
+                        raise RuntimeError(f"{failed.name}: {failed.error}")
+                    if moving_since is not None:
+                        ok = wait_stage_stop(self.stage, moving_since, metrics, i)
+                        moving_since = None
+                        if not ok:
+                            msg = "ステージ移動失敗により測定中断"
+                            logger.warning(msg)
+                            break
+                    self.report_position()
+                    measure_start = datetime.datetime.now()
+                    point_started[i] = time.perf_counter()
+                    t_axis.append(pos * fs_per_pulse + delay_offset)
+                    msg1 = f"測定開始: index={i}, delay={t_axis[i]:.2f}fs, {measure_start.strftime('%H:%M:%S.%f')[:-3]}"
+                    logger.debug(msg1)
+                    # BG減算済みスペクトル（n_average 枚の σ クリップ平均）を data2d の行へ直接書き込む
+                    with metrics.span("acquire", i):
+                        if hdr is not None:
+                            hdr.read(out=data2d[i], var_out=None if var2d is None else var2d[i])
+                        else:
+                            self.session.read_averaged(
+                                n_average, out=data2d[i], var_out=None if var2d is None else var2d[i],
+                                clip_sigma=CLIP_SIGMA
+                            )
+                    if hdr is not None:
+                        logger.debug(f"HDR: index={i}, 積分時間={hdr.last_times} ms, 飽和画素={int(hdr.saturated.sum())}")
+                    if planner is not None:
+                        planner.record(pos, np.sum(data2d[i]))
+                    # 読み出し直後に次の点への移動を開始し、処理・保存・描画は移動と並行させる
+                    next_pos = next(positions, None) if self.running else None
+                    # 往復スキャンの折り返し点は移動せずにもう一度測る
+                    if next_pos is not None and next_pos != pos:
+                        moving_since = datetime.datetime.now()
+                        msg = f"ステージ移動開始: fspeed={fspeed}, pulses={next_pos - pos}"
+                        logger.debug(msg)
+                        start_stage_move_by(self.stage, fspeed, next_pos - pos,
+                                            approach=passes is None or not self.params.get('bidirectional', True))
+                    proc_q.put((i, measure_start))
+                    pos = next_pos
+                    i += 1
+                finished = pos is None and self.running
+                if moving_since is not None:
+                    wait_stage_stop(self.stage, moving_since, metrics, i)
+            finally:
+                proc_q.put(None)
+                for stage in stages:
+                    stage.join()
+                save_checkpoint(trace.n_records, self.get_position())
+                metrics.save()
+                logger.info(f"所要時間の記録: {metrics.path}")
+                # 中断・エラー時もそこまでの点で CSV を残す
+                if len(columns) > 0:
+                    columns.write_csv(file_name_csv)
+                    result['files']['csv'] = file_name_csv
+                columns.close()
+                result['points'] = len(t_axis)
+            failed = next((st for st in stages if st.error is not None), None)
+            if failed is not None:
+                raise RuntimeError(f"{failed.name}: {failed.error}")
+            if passes is not None:
+                n = len(t_axis)
+                starts = np.cumsum([0] + [len(pos) for _, pos in passes[:-1]])
+                trace.header['metadata'].update(
+                    pass_lengths=[int(min(len(pos), n - b0)) for (_, pos), b0 in zip(passes, starts) if b0 < n],
+                    pass_directions=[int(d) for (d, _), b0 in zip(passes, starts) if b0 < n],
+                )
+            trace.close(complete=finished)
+            if finished:
+                checkpoint.remove()
+            else:
+                logger.info(f"途中から再開できます: python -m frog.engine --resume {checkpoint.path}")
+            merged = None
+            if passes is not None:
+                # txt / csv はパスを平均したトレースから書く（全パスの生データは元のトレースに残る）
+                file_name_merged = base + "_merged.frogtrc"
+                stats = self.write_merged_trace(passes, t_axis, data2d, wavelengths, file_name_merged, trace.header['metadata'])
+                if stats:
+                    merged = file_name_merged
+                    result['files']['merged'] = merged
+                    result['pass_stats'] = stats
+                    export_csv(merged, file_name_csv)
+            export_txt(merged or file_name_trc, file_name)
+            result['files']['txt'] = file_name
+            if planner is not None:
+                logger.info(f"適応サンプリング: {len(t_axis)} 点（等間隔なら {loop_num} 点）, {planner.passes} パス")
+            self.report_position()
+            result['completed'] = finished
+            msg_fin = "測定完了"
+            logger.info(msg_fin)
+            if self.on_saved is not None:
+                self.on_saved(file_name_csv)
+
+    def measure_loop_period(self, n_loops=FLY_CALIBRATION_LOOPS):
+        """連続スキャンのループ 1 周（フレーム取得 + 位置の問い合わせ）の周期 [s] を止まったまま実測する"""
+        self.session.frames.acquire(settled=False)
+        periods = []
+        t0 = time.perf_counter()
+        for _ in range(n_loops):
+            self.session.read(settled=False)
+            self.get_position()
+            t = time.perf_counter()
+            periods.append(t - t0)
+            t0 = t
+        return float(np.median(periods))
+
+    def run_fly_scan(self, result):
+        """連続スキャン: ステージを一定速度で動かしながらスペクトルを連続取得する"""
+        step_size = self.params['step_size']
+        range_input = self.params['range_input']
+        integration_time_ms = self.params['integration_time_ms']
+        fspeed = self.params['fspeed']
+        fs_per_pulse = self.fs_per_pulse
+
+        wavelengths = self.session.wavelengths
+        n_wl = self.session.n_pixels
+        data2d = np.zeros((range_input // step_size + 16, n_wl))
+        t_axis = []
+
+        file_name, file_name_csv, file_name_trc, base = self.file_names()
+        logger.info(f"測定データを {file_name_trc} に記録し、{file_name} (txt) および {file_name_csv} (csv) に保存します")
+        result['files'] = {'trace': file_name_trc}
+
+        start_pos = self.get_position()
+        if start_pos is None:
+            msg = "現在位置を取得できないため連続スキャンを中止します"
+            logger.warning(msg)
+            return
+        end_pos = start_pos + range_input
+        origin = start_pos - self.origin_offset
+
+        # 実測したループ周期（フレーム取得 + 位置の問い合わせ）から、1 周で step_size パルス進む速度を決める（fspeed が上限）
+        self.session.set_integration_time_ms(integration_time_ms)
+        if self.params.get('n_average', 1) > 1:
+            logger.info("連続スキャンではフレーム平均を行いません")
+        frame_period = self.session.frames.frame_period
+        loop_period = self.measure_loop_period()
+        fly_speed = max(1, min(fspeed, int(round(step_size / loop_period))))
+        msg = (f"連続スキャン開始: 露光周期={frame_period*1000:.1f}ms, ループ周期={loop_period*1000:.1f}ms, "
+               f"速度={fly_speed}pps, {start_pos}→{end_pos}")
+        logger.info(msg)
+
+        # タイムスタンプ付き位置列（移動開始時点を含む）
+        pos_times = [time.perf_counter()]
+        positions = [start_pos]
+        self.stage.start_move(range_input, 0, fly_speed)
+        # 移動開始前から露光していたフレームは捨てる
+        self.session.frames.acquire(settled=False)
+        deadline = time.perf_counter() + 2 * range_input / fly_speed + 5
+
+        # 終点に着いた・ステージが止まったときだけ完了扱い（中断・タイムアウトは未完）
+        finished = False
+        with TraceWriter(file_name_trc, wavelengths, metadata=self.trace_metadata()) as trace:
+            n = 0
+            while True:
+                if not self.running:
+                    self.stage.send("STOP 0")
+                    msg = "測定をユーザーが中断しました。"
+                    logger.info(msg)
+                    break
+                if n == len(data2d):
+                    data2d = np.vstack([data2d, np.zeros_like(data2d)])
+                y = self.session.read(out=data2d[n], settled=False)
+                t_end = time.perf_counter()
+                pos = self.get_position()
+                t_pos = time.perf_counter()
+                if pos is not None:
+                    pos_times.append((t_end + t_pos) / 2)
+                    positions.append(pos)
+                # 露光区間の中心時刻における位置から遅延を決める
+                delay = float(interpolate_delay(t_end - frame_period / 2, pos_times, positions, origin, fs_per_pulse))
+                t_axis.append(delay)
+                trace.append(y, delay)
+                n += 1
+                if pos is not None:
+                    if self.on_position is not None:
+                        self.on_position(pos)
+                    if self.on_progress is not None:
+                        self.on_progress(min(100, int((pos - start_pos) / range_input * 100)))
+                if self.on_column is not None:
+                    self.on_column(n - 1, delay, y)
+                if pos is not None and pos >= end_pos:
+                    finished = True
+                    break
+                if pos is not None and len(positions) >= 3 and positions[-2] == pos:
+                    if not self.stage.is_busy():
+                        finished = True
+                        break
+                if time.perf_counter() > deadline:
+                    msg = "連続スキャンがタイムアウトしました"
+                    logger.warning(msg)
+                    break
+            trace.close(complete=finished)
+
+        msg = f"連続スキャン終了: {n} フレーム取得"
+        logger.info(msg)
+        result['points'] = n
+        export_txt(file_name_trc, file_name)
+        result['files']['txt'] = file_name
+        if n > 0:
+            write_wavelength_major_csv(file_name_csv, wavelengths, t_axis, data2d[:n].T)
+            result['files']['csv'] = file_name_csv
+            if self.on_saved is not None:
+                self.on_saved(file_name_csv)
+        self.report_position()
+        result['completed'] = finished
+
+
+def load_config(path):
+    """config_frog.yml を読む（相対パスは YAML のあるディレクトリ基準にする）"""
+    import yaml
+    with open(path, encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    root = os.path.dirname(os.path.abspath(path))
+    for key, default in (('log_dir', 'logs'), ('output_dir', 'data')):
+        config[key] = os.path.join(root, config.get(key) or default)
+    return config
+
+
+def scan_list(config):
+    """scan の既定値に scans の各要素を重ねた dict のリスト"""
+    base = dict(SCAN_DEFAULTS)
+    base['integration_time_us'] = (config.get('spectrometer') or {}).get('integration_time_us', 100000)
+    base.update(config.get('scan') or {})
+    scans = config.get('scans') or [{}]
+    return [dict(base, **scan) for scan in scans]
+
+
+def scan_params(scan, home_position):
+    """YAML のスキャン 1 本分を ScanEngine の params に直す"""
+    step_size = int(scan['step_size'])
+    start = int(scan['start_step'])
+    end = int(scan['end_step'])
+    if end <= start:
+        raise ValueError(f"end_step ({end}) は start_step ({start}) より大きくしてください")
+    params = {k: v for k, v in scan.items() if k not in ('start_step', 'end_step', 'integration_time_us')}
+    params.update(
+        integration_time_ms=scan['integration_time_us'] / 1000,
+        step_size=step_size,
+        range_input=end - start,
+        home_position=home_position,
+        start_position=home_position + start,
+        dt=2 * step_size * 10 ** (-6) / 299792458 * 10 ** 15,
+    )
+    return params
+
+
+def find_ds102_port():
+    import serial.tools.list_ports
+    for port in serial.tools.list_ports.comports():
+        if DS102_DESCRIPTION in (port.description or ""):
+            return port.device
+    return None
+
+
+def open_devices(config, emulate=False):
+    """(DS102, SpectrometerSession) を開く。emulate=True なら frog.emulator につなぐ"""
+    stage_cfg = config.get('stage') or {}
+    spec_cfg = config.get('spectrometer') or {}
+    if emulate:
+        from frog.emulator import DS102Model, EmulatedSerial, MockSpectrometer
+        model = DS102Model(baudrate=stage_cfg.get('baudrate', 9600))
+        first = scan_list(config)[0]
+        zero = (first['start_step'] + first['end_step']) / 2
+        stage = DS102(EmulatedSerial(model))
+        session = SpectrometerSession(MockSpectrometer(model, zero_position=zero))
+        logger.info(f"エミュレータで実行します（遅延ゼロ {zero:.0f} pulse）")
+        return stage, session
+    import serial
+    port = stage_cfg.get('port')
+    if not port or port == 'auto':
+        port = find_ds102_port()
+        if port is None:
+            raise RuntimeError("DS102 が見つかりません")
+    stage = DS102(serial.Serial(port, baudrate=stage_cfg.get('baudrate', 9600), timeout=1))
+    session = SpectrometerSession.open(spec_cfg.get('model'))
+    if session is None:
+        raise RuntimeError("分光器が見つかりません")
+    logger.info(f"DS102 ({port}) と {session.model} に接続しました")
+    return stage, session
+
+
+@contextlib.contextmanager
+def background_conditions(config, stage, home_position, fspeed, prompt=input):
+    """BG を取る間だけ信号が出ない状態にする
+
+    spectrometer.background_position があれば、その位置（パルスが重ならない遅延）へ移動する。
+    スキャンは run() が開始位置へ戻してから始める。なければ操作者にビームを止めてもらい、
+    取り終えたら戻してもらう。
+    """
+    position = (config.get('spectrometer') or {}).get('background_position')
+    if position is not None:
+        if not move_stage_to(stage, fspeed, home_position + int(position), "BG 位置"):
+            raise RuntimeError("BG 位置へ移動できませんでした")
+        yield
+        return
+    prompt(">> ビームを遮ってから Enter を押してください（BG 測定）: ")
+    yield
+    prompt(">> ビームを戻してから Enter を押してください（スキャン開始）: ")
+    logger.info("ビームを戻しました")
+
+
+def prepare_background(session, params):
+    """BG を取る（HDR では段ごとの BG モデル）。background_conditions() の中で呼ぶ"""
+    if params.get('hdr'):
+        params['hdr_background'] = make_hdr(session, params).measure_background()
+    else:
+        session.set_integration_time_ms(params['integration_time_ms'])
+        session.measure_background()
+    logger.info("BG測定完了")
+
+
+def run_scans(config, stage, session):
+    """config のスキャンを順に実行し、各 run() の結果のリストを返す"""
+    home_position = stage.position()
+    scans = scan_list(config)
+    measure_bg = (config.get('spectrometer') or {}).get('background', False)
+    results = []
+    for k, scan in enumerate(scans):
+        if len(scans) > 1 and not scan.get('name'):
+            scan['name'] = f"scan{k}"
+        params = scan_params(scan, home_position)
+        if measure_bg:
+            with background_conditions(config, stage, home_position, params['fspeed']):
+                prepare_background(session, params)
+        engine = ScanEngine(stage, session, params, config['output_dir'],
+                            backlash_table=config.get('backlash_table'))
+        logger.info(f"スキャン {k + 1}/{len(scans)} {params.get('name') or ''}: "
+                    f"{scan['start_step']}→{scan['end_step']} pulse, step {params['step_size']}")
+        result = engine.run()
+        results.append(result)
+        if not result['completed']:
+            logger.warning("スキャンが最後まで終わらなかったので残りを実行しません")
+            break
+    return results
+
+
+def close_devices(stage, session):
+    if session is not None:
+        session.close()
+    if stage is not None:
+        stage.ser.close()
+
+
+def cli_logging(config, suffix):
+    """log_dir へのログファイルと、log_level 以上を表示するコンソール出力"""
+    os.makedirs(config['log_dir'], exist_ok=True)
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    logs = setup_logging(os.path.join(config['log_dir'], f"{now}_FROG_{suffix}.log"))
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    console.setLevel(logging.getLevelName(str(config.get('log_level', 'INFO')).upper()))
+    logging.getLogger(LOGGER_NAME).addHandler(console)
+    return logs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="config_frog.yml のスキャンを GUI なしで実行する")
+    parser.add_argument("config", nargs="?", default="config_frog.yml", help="設定ファイル（YAML）")
+    parser.add_argument("--emulate", action="store_true", help="実機の代わりに frog.emulator を使う")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="中断したスキャンを *.checkpoint.npz から再開する")
+    args = parser.parse_args(argv)
+    config = load_config(args.config)
+
+    logs = cli_logging(config, "engine")
+    stage = session = None
+    try:
+        stage, session = open_devices(config, emulate=args.emulate)
+        if args.resume:
+            checkpoint = Checkpoint.load(args.resume)
+            engine = ScanEngine(stage, session, None, os.path.dirname(os.path.abspath(args.resume)),
+                                backlash_table=config.get('backlash_table'), resume_from=checkpoint)
+            results = [engine.run()]
+        else:
+            results = run_scans(config, stage, session)
+    except KeyboardInterrupt:
+        # 測定中の点までは run() の後始末でトレースと CSV に書き出される
+        logger.info("中断しました")
+        return 1
+    finally:
+        close_devices(stage, session)
+        logs.close()
+    for result in results:
+        status = "完了" if result['completed'] else result.get('error', "中断")
+        print(f"{result.get('name') or '-'}: {result['points']} 点, {status}, {result['files'].get('trace', '')}")
+    return 0 if results and all(r['completed'] for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+曲線をまとめてフィットするエンジン（一括 Levenberg–Marquardt）
+
+同じ x 上の M 本の曲線 y (M, n) に、ガウス・sech²・ローレンツのどれかを
+    f(x) = a · shape((x − μ) / w) + c      （w は FWHM）
+の形で一度にフィットする。ヤコビアンは解析的に作り、正規方程式 (M, 4, 4) を
+np.linalg.solve でまとめて解く。減衰係数 λ は曲線ごとに持つ。
+初期値はモーメントから（c: 最小値, a: 最大 − c, μ: 半値以上の重心, w: 半値以上の幅）。
+不確かさは残差から求めた共分散 (JᵀJ)⁻¹ · χ²/(n − 4) の対角の平方根。
+
+    result = fit_curves(x, y, "sech2")
+    result.center, result.fwhm, result.errors["fwhm"]
+
+    # 波長ごとの遅延方向のフィット（チャープ）と、遅延ごとの波長方向のフィット
+    rows = fit_trace(load_frog(path), "gaussian", axis="delay")
+    rows.coordinate, rows.center          # 波長 [nm] ごとのピーク遅延 [fs]
+
+    python -m frog.fitting 01_Mesurement/data/20241008_212100_FROG.txt --model sech2 --axis delay --png chirp.png
+"""
+
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from frog.loader import load_frog
+from frog.preprocess import BACKGROUNDS, signal_support, subtract_background
+
+PARAMETERS = ("amplitude", "center", "fwhm", "offset")
+
+# sech²(k x) の FWHM が 1 になる k
+SECH2_K = 2 * np.arccosh(np.sqrt(2))
+GAUSS_K = 4 * np.log(2)
+
+MAX_ITERATIONS = 100
+# 振幅がその不確かさのこの倍数に満たない曲線（ノイズだけの行など）は valid にしない
+MIN_SNR = 3.0
+
+
+def _gaussian(u):
+    """shape(u) と d shape / du"""
+    f = np.exp(-GAUSS_K * u * u)
+    return f, -2 * GAUSS_K * u * f
+
+
+def _sech2(u):
+    s = 1 / np.cosh(np.clip(SECH2_K * u, -350, 350))
+    f = s * s
+    return f, -2 * SECH2_K * f * np.tanh(SECH2_K * u)
+
+
+def _lorentzian(u):
+    f = 1 / (1 + 4 * u * u)
+    return f, -8 * u * f * f
+
+
+MODELS = {"gaussian": _gaussian, "sech2": _sech2, "lorentzian": _lorentzian}
+
+
+def evaluate(model, x, params):
+    """params (..., 4) のモデル値（最後の軸が x）"""
+    a, mu, w, c = (params[..., k, None] for k in range(4))
+    f, _ = MODELS[model]((x - mu) / w)
+    return a * f + c
+
+
+class FitResult:
+    """M 本の曲線のフィット結果
+
+    params と stderr は (M, 4)（amplitude, center, fwhm, offset の順）、errors は名前ごとの stderr。
+    converged は収束したか、valid は収束して振幅が不確かさの MIN_SNR 倍以上あり、
+    中心が x の範囲内で幅の不確かさが幅より小さいもの。
+    """
+
+    def __init__(self, model, x, params, stderr, chi2, converged, iterations, elapsed, coordinate=None):
+        self.model = model
+        self.x = x
+        self.params = params
+        self.stderr = stderr
+        self.chi2 = chi2
+        self.converged = converged
+        self.iterations = iterations
+        self.elapsed = elapsed
+        self.coordinate = coordinate
+        self.errors = {name: stderr[:, k] for k, name in enumerate(PARAMETERS)}
+        with np.errstate(invalid="ignore"):
+            self.valid = (converged & np.isfinite(stderr).all(axis=1)
+                          & (params[:, 0] >= MIN_SNR * stderr[:, 0]) & (stderr[:, 2] < params[:, 2])
+                          & (params[:, 1] >= x.min()) & (params[:, 1] <= x.max()))
+
+    amplitude = property(lambda self: self.params[:, 0])
+    center = property(lambda self: self.params[:, 1])
+    fwhm = property(lambda self: self.params[:, 2])
+    offset = property(lambda self: self.params[:, 3])
+
+    def curve(self, x=None):
+        return evaluate(self.model, self.x if x is None else x, self.params)
+
+
+def initial_guess(x, y):
+    """モーメントから (M, 4) の初期値"""
+    c = y.min(axis=1)
+    a = y.max(axis=1) - c
+    excess = y - c[:, None]
+    above = excess >= 0.5 * a[:, None]
+    weight = np.where(above, excess, 0)
+    total = weight.sum(axis=1)
+    mu = np.where(total > 0, (weight * x).sum(axis=1) / np.where(total > 0, total, 1), x[np.argmax(y, axis=1)])
+    dx = np.abs(np.diff(x)).mean() if len(x) > 1 else 1.0
+    w = np.maximum(above.sum(axis=1) * dx, dx)
+    return np.stack([a, mu, w, c], axis=1)
+
+
+def fit_curves(x, y, model="gaussian", p0=None, max_iterations=MAX_ITERATIONS, tol=1e-7):
+    """y (M, n) の各行を model でフィットして FitResult を返す"""
+    t_start = time.perf_counter()
+    if model not in MODELS:
+        raise ValueError(f"モデルは {', '.join(MODELS)} のどれかです: {model}")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    m, n = y.shape
+    if n < 5:
+        raise ValueError(f"フィットには 5 点以上必要です（{n} 点）")
+    shape = MODELS[model]
+    params = initial_guess(x, y) if p0 is None else np.array(np.broadcast_to(p0, (m, 4)), dtype=np.float64)
+    # 幅が 0 や負にならないよう、幅の下限は x の刻みの 1/10
+    min_width = 0.1 * np.abs(np.diff(x)).min()
+    params[:, 2] = np.maximum(np.abs(params[:, 2]), min_width)
+    damping = np.full(m, 1e-3)
+    active = np.ones(m, dtype=bool)
+    converged = np.zeros(m, dtype=bool)
+    jacobian = np.empty((m, n, 4))
+    eye = np.eye(4)
+    span = float(x.max() - x.min())
+    middle = 0.5 * float(x.max() + x.min())
+
+    def residual_and_jacobian(p, target, out):
+        a, mu, w, c = (p[:, k, None] for k in range(4))
+        u = (x - mu) / w
+        f, df = shape(u)
+        out[:, :, 0] = f
+        out[:, :, 1] = -a * df / w
+        out[:, :, 2] = -a * df * u / w
+        out[:, :, 3] = 1
+        return a * f + c - target
+
+    residual = residual_and_jacobian(params, y, jacobian)
+    cost = np.einsum("mn,mn->m", residual, residual)
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+        jac = jacobian[rows]
+        jac_t = jac.transpose(0, 2, 1)
+        jtj = jac_t @ jac
+        grad = (jac_t @ residual[rows, :, None])[:, :, 0]
+        diag = np.einsum("mii->mi", jtj)
+        lhs = jtj + damping[rows, None, None] * (diag[:, :, None] * eye)
+        try:
+            step = np.linalg.solve(lhs, -grad[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # 平らな曲線などで特異になったときだけ擬似逆行列で解く
+            step = np.einsum("mij,mj->mi", np.linalg.pinv(lhs), -grad)
+        trial = params[rows] + step
+        trial[:, 2] = np.maximum(np.abs(trial[:, 2]), min_width)
+        trial_jacobian = np.empty((len(rows), n, 4))
+        trial_residual = residual_and_jacobian(trial, y[rows], trial_jacobian)
+        trial_cost = np.einsum("mn,mn->m", trial_residual, trial_residual)
+        better = trial_cost < cost[rows]
+        accept = rows[better]
+        # 相対的な改善が tol 未満、または λ が大きくなりすぎた（どの向きにも下がらない）ら収束とみなす
+        small = np.abs(cost[rows] - np.where(better, trial_cost, cost[rows])) <= tol * np.maximum(cost[rows], 1e-300)
+        params[accept] = trial[better]
+        jacobian[accept] = trial_jacobian[better]
+        residual[accept] = trial_residual[better]
+        cost[accept] = trial_cost[better]
+        damping[rows] = np.where(better, damping[rows] / 10, damping[rows] * 10)
+        done = rows[(better & small) | (damping[rows] > 1e10)]
+        converged[done] = True
+        active[done] = False
+        # 山の無い曲線では中心が範囲の外へ、幅が際限なく広がっていくので打ち切る（収束扱いにしない）
+        runaway = (np.abs(params[:, 1] - middle) > span) | (params[:, 2] > 10 * span)
+        active &= ~runaway
+
+    jtj = jacobian.transpose(0, 2, 1) @ jacobian
+    dof = max(n - 4, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = np.linalg.pinv(jtj) * (cost / dof)[:, None, None]
+        stderr = np.sqrt(np.einsum("mii->mi", cov))
+    return FitResult(model, x, params, stderr, cost / dof, converged, iteration, time.perf_counter() - t_start)
+
+
+def fit_trace(data, model="gaussian", axis="delay", background="first"):
+    """トレースの行（axis="delay": 波長ごとに遅延方向）または列（"wavelength": 遅延ごとに波長方向）をフィットする
+
+    フィットするのは信号のある範囲（frog.preprocess.signal_support）の行・列だけで、それ以外は NaN。
+    BG に使った遅延（background="first" なら最初の遅延）の行は結果に含まない。
+    波長方向のフィットは x も信号のある波長帯（前後に同じ幅の余白）に切り出す。
+    """
+    data = subtract_background(data.sorted(), background)
+    intensity = data.intensity.astype(np.float64)
+    wl_lo, wl_hi, _ = signal_support(data.wavelengths, intensity.sum(axis=0))
+    t_lo, t_hi, _ = signal_support(data.delays, intensity.sum(axis=1))
+    if axis == "delay":
+        coordinate = data.wavelengths
+        keep = (coordinate >= wl_lo) & (coordinate <= wl_hi)
+        x, y = data.delays, intensity.T[keep]
+    elif axis == "wavelength":
+        coordinate = data.delays
+        keep = (coordinate >= t_lo) & (coordinate <= t_hi)
+        pad = wl_hi - wl_lo
+        band = (data.wavelengths >= wl_lo - pad) & (data.wavelengths <= wl_hi + pad)
+        x, y = data.wavelengths[band], intensity[keep][:, band]
+    else:
+        raise ValueError(f"axis は delay か wavelength です: {axis}")
+    fitted = fit_curves(x, y, model)
+    params = np.full((len(coordinate), 4), np.nan)
+    stderr = np.full((len(coordinate), 4), np.nan)
+    converged = np.zeros(len(coordinate), dtype=bool)
+    params[keep], stderr[keep], converged[keep] = fitted.params, fitted.stderr, fitted.converged
+    chi2 = np.full(len(coordinate), np.nan)
+    chi2[keep] = fitted.chi2
+    return FitResult(model, x, params, stderr, chi2, converged, fitted.iterations, fitted.elapsed, coordinate)
+
+
+def write_csv(result, path, coordinate_name):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([coordinate_name, *PARAMETERS, *(f"{name}_err" for name in PARAMETERS), "chi2", "valid"])
+        for k in range(len(result.params)):
+            writer.writerow([f"{result.coordinate[k]:.6g}", *(f"{v:.6g}" for v in result.params[k]),
+                             *(f"{v:.3g}" for v in result.stderr[k]), f"{result.chi2[k]:.4g}", int(result.valid[k])])
+    return path
+
+
+def render_png(path, result, axis, title=""):
+    """行・列ごとの中心と FWHM（誤差棒つき）を Agg で描く"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 4.5))
+    FigureCanvasAgg(fig)
+    ax_center, ax_width = fig.subplots(1, 2)
+    valid = result.valid
+    coord = result.coordinate[valid]
+    unit, coord_label = ("fs", "Wavelength [nm]") if axis == "delay" else ("nm", "Delay [fs]")
+    ax_center.errorbar(coord, result.center[valid], yerr=result.errors["center"][valid], fmt=".", ms=3)
+    ax_center.set_xlabel(coord_label)
+    ax_center.set_ylabel(f"Center [{unit}]")
+    ax_width.errorbar(coord, result.fwhm[valid], yerr=result.errors["fwhm"][valid], fmt=".", ms=3)
+    ax_width.set_xlabel(coord_label)
+    ax_width.set_ylabel(f"FWHM [{unit}]")
+    for ax in (ax_center, ax_width):
+        ax.grid(True)
+    fig.suptitle(f"{title} ({result.model}, {int(valid.sum())}/{len(valid)} valid)")
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="トレースの全ての波長（または遅延）を一度にフィットする")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--model", choices=tuple(MODELS), default="gaussian")
+    parser.add_argument("--axis", choices=("delay", "wavelength"), default="delay",
+                        help="delay: 波長ごとに遅延方向, wavelength: 遅延ごとに波長方向")
+    parser.add_argument("--background", choices=BACKGROUNDS, default="first")
+    parser.add_argument("--csv", default=None, help="結果の CSV（ファイルが複数なら出力ディレクトリ）")
+    parser.add_argument("--png", default=None, help="図の出力先（ファイルが複数なら出力ディレクトリ）")
+    args = parser.parse_args(argv)
+
+    def output(option, path, suffix):
+        if len(args.paths) == 1:
+            return option
+        os.makedirs(option, exist_ok=True)
+        return os.path.join(option, os.path.splitext(os.path.basename(path))[0] + suffix)
+
+    for path in args.paths:
+        try:
+            result = fit_trace(load_frog(path), args.model, args.axis, args.background)
+        except (ValueError, OSError) as e:
+            print(f"{path}: フィットできません（{e}）")
+            continue
+        valid = result.valid
+        line = (f"{os.path.basename(path)}: {len(valid)} 本中 {int(valid.sum())} 本が有効, "
+                f"{result.iterations} 回, {result.elapsed * 1000:.0f} ms")
+        if valid.sum() >= 2:
+            line += f", FWHM 中央値 {np.median(result.fwhm[valid]):.4g}"
+            if args.axis == "delay":
+                slope = np.polyfit(result.coordinate[valid], result.center[valid], 1,
+                                   w=1 / np.maximum(result.errors["center"][valid], 1e-12))[0]
+                line += f", チャープ {slope:.4g} fs/nm"
+        print(line)
+        coordinate_name = "wavelength_nm" if args.axis == "delay" else "delay_fs"
+        if args.csv:
+            write_csv(result, output(args.csv, path, f"_fit_{args.axis}.csv"), coordinate_name)
+        if args.png:
+            render_png(output(args.png, path, f"_fit_{args.axis}.png"), result, args.axis, os.path.basename(path))
+
+
+if __name__ == "__main__":
+    main()
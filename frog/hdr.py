@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+点ごとに積分時間を自動で決める高ダイナミックレンジ取得
+
+前の点のピークカウントから、ピークが飽和の target 倍になる積分時間を積分時間の
+段（min_ms × 2^k）から選ぶ。brackets に倍率を並べると同じ点で長い露光も取り、
+飽和した画素を除いてカウント/ms に揃えてから合成する。時間ゼロ付近のピークは
+短い露光で、裾は長い露光で測れるので、1 回のスキャンで全体のダイナミックレンジが得られる。
+
+BG は積分時間で変わる（読み出しオフセット + 暗電流 × 時間）ので、ビームを止めた状態で
+measure_background() を呼び、段ごとの BG から画素ごとのオフセットと暗電流を当てはめておく。
+
+    hdr = HDRAcquirer(session, min_ms=4, max_ms=500, brackets=(1, 8))
+    hdr.measure_background()
+    for ...:
+        hdr.read(out=data2d[i])               # カウント/ms（BG 減算済み）
+"""
+
+import numpy as np
+
+# ピークをこの割合より上、target より下に収まっている間は積分時間を変えない
+HYSTERESIS = 0.5
+
+
+class BackgroundModel:
+    """画素ごとの BG = offset + dark_rate × 積分時間 [ms]"""
+
+    def __init__(self, offset, dark_rate):
+        self.offset = offset
+        self.dark_rate = dark_rate
+
+    @classmethod
+    def fit(cls, times_ms, frames):
+        """(積分時間数, 画素数) の BG フレームに画素ごとの直線を当てはめる"""
+        t = np.asarray(times_ms, dtype=float)
+        frames = np.asarray(frames, dtype=float)
+        if len(t) < 2 or np.ptp(t) == 0:
+            return cls(frames.mean(axis=0), np.zeros(frames.shape[1]))
+        tc = t - t.mean()
+        dark_rate = tc @ (frames - frames.mean(axis=0)) / (tc @ tc)
+        offset = frames.mean(axis=0) - dark_rate * t.mean()
+        return cls(offset, dark_rate)
+
+    def evaluate(self, integration_time_ms, out=None):
+        out = np.multiply(self.dark_rate, integration_time_ms, out=out)
+        np.add(out, self.offset, out=out)
+        return out
+
+
+def merge_exposures(frames, times_ms, saturation, background=None, variances=None,
+                    out=None, var_out=None):
+    """(露光数, 画素数) の生フレームを飽和画素を除いてカウント/ms に合成する
+
+    各露光を (生カウント - BG) / 積分時間 に直し、飽和していない露光を積分時間で
+    重み付けして平均する（ショットノイズでは長い露光ほど分散が小さい）。
+    全ての露光で飽和した画素は最短露光の値を使う。
+    background は BackgroundModel、variances は生カウントの分散（平均値の分散）。
+    戻り値は (カウント/ms, 全露光で飽和した画素のマスク)。
+    """
+    frames = np.asarray(frames, dtype=float)
+    t = np.asarray(times_ms, dtype=float)[:, None]
+    unsaturated = frames < saturation
+    rates = frames.copy()
+    if background is not None:
+        rates -= background.offset
+        rates -= background.dark_rate * t
+    rates /= t
+    weights = np.where(unsaturated, t, 0.0)
+    wsum = weights.sum(axis=0)
+    saturated = wsum == 0
+    shortest = int(np.argmin(t[:, 0]))
+    weights[shortest, saturated] = 1.0
+    wsum[saturated] = 1.0
+    out = np.sum(rates * weights, axis=0, out=out)
+    np.divide(out, wsum, out=out)
+    if var_out is not None:
+        if variances is None:
+            var_out.fill(np.nan)
+        else:
+            rate_var = np.asarray(variances, dtype=float) / np.square(t)
+            np.sum(rate_var * np.square(weights), axis=0, out=var_out)
+            np.divide(var_out, np.square(wsum), out=var_out)
+    return out, saturated
+
+
+class HDRAcquirer:
+    """SpectrometerSession の上で積分時間の自動調整とブラケット露光を行う
+
+    read() のたびに前回の最短露光のピークから次の積分時間を決める。
+    飽和した場合はその場で段を下げて取り直す。
+    """
+
+    def __init__(self, session, min_ms=4.0, max_ms=1000.0, target=0.8, brackets=(1,),
+                 n_frames=1, saturation=None, clip_sigma=3.0, background=None):
+        self.session = session
+        self.target = target
+        self.brackets = tuple(sorted(brackets))
+        self.n_frames = n_frames
+        self.clip_sigma = clip_sigma
+        self.saturation = 0.98 * session.max_counts if saturation is None else saturation
+        n_steps = int(np.floor(np.log2(max_ms / min_ms))) + 1 if max_ms > min_ms else 1
+        self.ladder = min_ms * 2.0 ** np.arange(max(n_steps, 1))
+        self.max_ms = max_ms
+        self.background = background
+        self.base_ms = self.ladder[-1]
+        self.last_times = ()
+        self.saturated = np.zeros(session.n_pixels, dtype=bool)
+        n_exp = len(self.brackets)
+        self._raw = np.empty((n_exp, session.n_pixels))
+        self._var = np.empty((n_exp, session.n_pixels)) if n_frames > 1 else None
+
+    def exposure_times(self, base_ms=None):
+        """base_ms とブラケット倍率から実際の積分時間の並び（max_ms で頭打ち）"""
+        base = self.base_ms if base_ms is None else base_ms
+        return tuple(float(min(base * b, self.max_ms)) for b in self.brackets)
+
+    def next_base_ms(self, peak, base_ms, offset=0.0):
+        """ピークカウント peak（積分時間 base_ms）から次の最短露光の積分時間を決める
+
+        offset は時間によらない読み出しオフセット。残りが積分時間に比例するとして外挿する。
+        """
+        level = peak / self.saturation
+        if HYSTERESIS * self.target <= level < self.target:
+            return base_ms
+        rate = max(peak - offset, 1.0) / base_ms
+        fits = self.ladder[offset + self.ladder * rate <= self.target * self.saturation]
+        return float(fits[-1]) if len(fits) else float(self.ladder[0])
+
+    def measure_background(self, n_frames=None):
+        """全ての段で BG を取り、BackgroundModel を当てはめる（ビームを止めて呼ぶ）"""
+        n_frames = self.n_frames if n_frames is None else n_frames
+        frames = np.empty((len(self.ladder), self.session.n_pixels))
+        for k, t in enumerate(self.ladder):
+            self.session.set_integration_time_ms(t)
+            self.session.read_averaged(n_frames, out=frames[k], subtract_background=False,
+                                       clip_sigma=self.clip_sigma)
+        self.background = BackgroundModel.fit(self.ladder, frames)
+        return self.background
+
+    def _expose(self, times, settled):
+        for k, t in enumerate(times):
+            self.session.set_integration_time_ms(t)
+            self.session.read_averaged(
+                self.n_frames, out=self._raw[k], var_out=None if self._var is None else self._var[k],
+                settled=settled and k == 0, subtract_background=False, clip_sigma=self.clip_sigma
+            )
+
+    def read(self, out=None, var_out=None, settled=True):
+        """カウント/ms のスペクトルを out に書き込んで返す"""
+        if out is None:
+            out = np.empty(self.session.n_pixels)
+        while True:
+            times = self.exposure_times()
+            self._expose(times, settled)
+            j = int(np.argmax(self._raw[0]))
+            peak = float(self._raw[0, j])
+            offset = 0.0 if self.background is None else float(self.background.offset[j])
+            # 最短露光で飽和したら段を下げて取り直す（最下段ならそのまま使う）
+            if peak < self.saturation or self.base_ms <= self.ladder[0]:
+                break
+            self.base_ms = self.next_base_ms(peak, self.base_ms, offset)
+            settled = False
+        self.last_times = times
+        _, self.saturated = merge_exposures(
+            self._raw, times, self.saturation, self.background, self._var, out=out, var_out=var_out
+        )
+        self.base_ms = self.next_base_ms(peak, times[0], offset)
+        return out
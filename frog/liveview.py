@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+測定中の FROG マップ（遅延×波長）の逐次描画
+
+(波長数, 遅延数) の画像バッファを最初に確保して imshow に渡しておき、測定点ごとに
+新しい列だけを書き込む。色範囲は書き込んだ列の最小・最大を累積して決めるので、
+1 点あたりの処理は列 1 本分で済む。再描画は refresh() から draw_idle で要求し、
+max_fps を超える頻度では描かない（GUI 側のタイマーから呼ぶ）。
+"""
+
+import time
+
+import numpy as np
+
+
+class LiveFrogMap:
+    """imshow の画像を列単位で更新する"""
+
+    def __init__(self, ax, wavelengths, delays, max_fps=10.0, colorbar=True):
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.delays = np.asarray(delays, dtype=float)
+        self.image = np.full((len(wavelengths), len(self.delays)), np.nan, dtype=np.float32)
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.n_columns = 0
+        self.min_interval = 1.0 / max_fps
+        self._dirty = False
+        self._last_draw = -np.inf
+
+        if len(self.delays) > 1:
+            t0, t1 = self.delays[0], self.delays[-1]
+        else:
+            t0, t1 = self.delays[0] - 0.5, self.delays[0] + 0.5
+        ax.clear()
+        self.im = ax.imshow(
+            self.image, aspect='auto', origin='lower',
+            extent=[t0, t1, wavelengths[0], wavelengths[-1]],
+            interpolation='nearest'
+        )
+        ax.set_title("Time-Wavelength Map (FROG)")
+        ax.set_xlabel("Delay [fs]")
+        ax.set_ylabel("Wavelength [nm]")
+        self.cbar = ax.figure.colorbar(self.im, ax=ax, orientation='vertical') if colorbar else None
+
+    def column_index(self, delay):
+        """delay に最も近い列の番号"""
+        i = int(np.searchsorted(self.delays, delay))
+        if i == 0:
+            return 0
+        if i >= len(self.delays):
+            return len(self.delays) - 1
+        return i if self.delays[i] - delay < delay - self.delays[i - 1] else i - 1
+
+    def add_column(self, delay, column):
+        """1 点分のスペクトルを書き込む（描画はしない）"""
+        col = self.image[:, self.column_index(delay)]
+        np.copyto(col, column, casting="unsafe")
+        self.vmin = min(self.vmin, float(np.nanmin(col)))
+        self.vmax = max(self.vmax, float(np.nanmax(col)))
+        self.n_columns += 1
+        self._dirty = True
+
+    def refresh(self, force=False):
+        """前回の描画から min_interval 以上経っていれば再描画を要求する"""
+        if not self._dirty:
+            return False
+        now = time.monotonic()
+        if not force and now - self._last_draw < self.min_interval:
+            return False
+        self.im.set_data(self.image)
+        if self.vmin <= self.vmax:
+            self.im.set_clim(self.vmin, self.vmax if self.vmax > self.vmin else self.vmin + 1)
+        self.canvas.draw_idle()
+        self._dirty = False
+        self._last_draw = now
+        return True
+
+    def remove(self):
+        if self.cbar is not None:
+            self.cbar.remove()
+            self.cbar = None
+        self.im.remove()
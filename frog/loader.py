@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+FROG のデータファイルをまとめて読むローダー
+
+1 行目から形式を判別し、数値部分は np.loadtxt（C 実装）で一度に読む。
+強度は (遅延数, 波長数) の C 連続な float32、遅延・波長の軸は float64 で返す。
+
+    形式            1 行目                                     並び
+    txt_ver3        "\\t波長\\t波長...\\t"（FROG_Ver3.0 / 3.1）   遅延ごとに 1 行、末尾タブ
+    txt_gui         "#delay/fs\\t波長...\\tmax_intensity\\ttimestamp"  遅延ごとに 1 行
+    csv_wavelength  "Wavelength[nm],t0,t1,..."（GUI の CSV）    波長ごとに 1 行
+    csv_step        "step,波長,..."                            遅延（ステップ番号）ごとに 1 行
+    csv_time        "Time,波長,..." / ",波長,..."               遅延ごとに 1 行
+    csv_index       "波長,波長,..."（1 行目が全て数値）         遅延ごとに 1 行、遅延は行番号
+    frogtrc         バイナリのトレース（frog.tracefile）
+
+    data = load_frog("01_Mesurement/data/20241008_165751_FROG_0.txt")
+    delays, wavelengths, intensity = data
+
+    python -m frog.loader 01_Mesurement/data/*.txt bata/data/*.csv
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from frog.tracefile import MAGIC, Trace
+
+# ヘッダの読み取りで試す文字コード（数値部分は ASCII）
+HEADER_ENCODINGS = ("utf-8-sig", "cp932")
+
+
+class FrogData:
+    """遅延・波長・強度（遅延数 × 波長数, float32）
+
+    delay_unit は遅延の単位（"fs"、csv_step では "step"、csv_index では行番号 "index"）。
+    for 文や代入で (delays, wavelengths, intensity) として展開できる。
+    """
+
+    def __init__(self, delays, wavelengths, intensity, fmt, delay_unit="fs", path=None):
+        self.delays = delays
+        self.wavelengths = wavelengths
+        self.intensity = intensity
+        self.format = fmt
+        self.delay_unit = delay_unit
+        self.path = path
+
+    def __iter__(self):
+        return iter((self.delays, self.wavelengths, self.intensity))
+
+    @property
+    def shape(self):
+        return self.intensity.shape
+
+    def sorted(self):
+        """遅延の昇順に並べ替えたもの（並んでいればそのまま）"""
+        if np.all(np.diff(self.delays) >= 0):
+            return self
+        order = np.argsort(self.delays, kind="stable")
+        return FrogData(self.delays[order], self.wavelengths, np.ascontiguousarray(self.intensity[order]),
+                        self.format, self.delay_unit, self.path)
+
+
+def _read_head(path):
+    """1 行目（文字列）と 2 行目（データの 1 行目, 無ければ空）"""
+    with open(path, "rb") as f:
+        first = f.readline()
+        second = f.readline().decode("latin-1").rstrip("\r\n")
+    for encoding in HEADER_ENCODINGS:
+        try:
+            return first.decode(encoding).rstrip("\r\n"), second
+        except UnicodeDecodeError:
+            continue
+    return first.decode("latin-1").rstrip("\r\n"), second
+
+
+def sniff_format(path):
+    """(形式, 区切り文字, 1 行目のセルのリスト, 2 行目のセル数)"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return "frogtrc", None, None, None
+    header, second = _read_head(path)
+    if not header.strip():
+        raise ValueError(f"空のファイルです: {path}")
+    delimiter = "\t" if "\t" in header else ","
+    cells = header.split(delimiter)
+    n_fields = len(second.split(delimiter)) if second.strip() else 0
+    label = cells[0].strip().lstrip("#").lower()
+    if label and _is_numeric_row(cells):
+        return "csv_index", delimiter, cells, n_fields
+    if label.startswith("wavelength"):
+        return "csv_wavelength", delimiter, cells, n_fields
+    if label.startswith("delay"):
+        return "txt_gui", delimiter, cells, n_fields
+    if label == "step":
+        return "csv_step", delimiter, cells, n_fields
+    if label in ("", "time", "t"):
+        return ("txt_ver3" if delimiter == "\t" else "csv_time"), delimiter, cells, n_fields
+    raise ValueError(f"FROG データの形式を判別できません: {path}（1 行目 {cells[0]!r}）")
+
+
+def _is_numeric_row(cells):
+    """空でないセルが全て数値か"""
+    values = [cell.strip() for cell in cells if cell.strip()]
+    try:
+        [float(v) for v in values]
+    except ValueError:
+        return False
+    return bool(values)
+
+
+def _axis(cells):
+    """ヘッダのセルから数値の軸を作る（末尾の空セルと数値でない列名は除く）"""
+    values = []
+    for cell in cells:
+        cell = cell.strip()
+        if not cell:
+            continue
+        try:
+            values.append(float(cell))
+        except ValueError:
+            break
+    return np.array(values)
+
+
+def _load_table(path, delimiter, n_columns):
+    """先頭 n_columns 列を float64 の 2 次元配列で読む（書きかけの最終行は捨てる）"""
+    usecols = range(n_columns)
+    try:
+        return np.loadtxt(path, delimiter=delimiter, skiprows=1, usecols=usecols, ndmin=2, encoding="latin-1")
+    except (ValueError, IndexError):
+        pass
+    # 測定中に止まったファイルは最後の行が途中で切れている
+    with open(path, encoding="latin-1") as f:
+        next(f, None)
+        lines = [line for line in f if line.count(delimiter) >= n_columns - 1]
+    if lines:
+        last = lines[-1].rstrip("\r\n").split(delimiter)
+        if len(last) < n_columns or not last[n_columns - 1].strip():
+            lines.pop()
+    if not lines:
+        return np.empty((0, n_columns))
+    return np.loadtxt(lines, delimiter=delimiter, usecols=usecols, ndmin=2)
+
+
+def load_frog(path):
+    """FROG のデータファイルを読み、FrogData を返す（遅延は記録された順のまま）"""
+    fmt, delimiter, cells, n_fields = sniff_format(path)
+    if fmt == "frogtrc":
+        trace = Trace(path)
+        return FrogData(np.array(trace.delays, dtype=float), np.array(trace.wavelengths, dtype=float),
+                        np.ascontiguousarray(trace.frames, dtype=np.float32), fmt, path=path)
+    if fmt == "csv_index":
+        # 1 行目が波長だけで遅延の列が無い（FROG_PDA が読んでいた形式）。遅延は行番号
+        axis = _axis(cells)
+        table = _load_table(path, delimiter, len(axis)) if n_fields else np.empty((0, len(axis)))
+        return FrogData(np.arange(len(table), dtype=float), axis, np.ascontiguousarray(table, dtype=np.float32),
+                        fmt, "index", path)
+    axis = _axis(cells[1:])
+    if fmt == "csv_wavelength":
+        # 中断した旧 GUI の CSV はヘッダに予定した全遅延が並び、列はそれより少ない
+        axis = axis[:max(n_fields - 1, 0)]
+    table = _load_table(path, delimiter, len(axis) + 1) if n_fields else np.empty((0, len(axis) + 1))
+    if fmt == "csv_wavelength":
+        wavelengths = np.ascontiguousarray(table[:, 0])
+        return FrogData(axis, wavelengths, np.ascontiguousarray(table[:, 1:].T, dtype=np.float32), fmt, path=path)
+    intensity = np.ascontiguousarray(table[:, 1:], dtype=np.float32)
+    delay_unit = "step" if fmt == "csv_step" else "fs"
+    return FrogData(np.ascontiguousarray(table[:, 0]), axis, intensity, fmt, delay_unit, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FROG データファイルの形式と大きさを表示する")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        t0 = time.perf_counter()
+        try:
+            data = load_frog(path)
+        except (ValueError, OSError) as e:
+            print(f"{path}: 読めません（{e}）")
+            continue
+        elapsed = (time.perf_counter() - t0) * 1000
+        n_delays, n_wl = data.shape
+        print(f"{os.path.basename(path)}: {data.format}, 遅延 {n_delays} 点 [{data.delay_unit}], 波長 {n_wl} 点, {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+キューを介したログ出力
+
+測定ループからは logging のロガーに投げるだけにして、ファイルへの書き込みは
+バックグラウンドのスレッドがまとめて行う（flush_interval 秒ごと、または batch_size 件ごと）。
+GUI には GuiLogBuffer に溜めた行をタイマーでまとめて渡し、1 回に表示する行数を制限する。
+
+    logs = setup_logging("log/20250515_FROG.log", level="DEBUG")
+    logger = logging.getLogger("frog.measure")
+    logger.info("測定開始")
+    ...
+    logs.close()
+"""
+
+import atexit
+import collections
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOGGER_NAME = "frog"
+LOG_FORMAT = "[%(asctime)s] %(message)s"
+DATE_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+_STOP = object()
+
+
+def _level(level):
+    return logging.getLevelName(level.upper()) if isinstance(level, str) else level
+
+
+class BatchFileWriter(threading.Thread):
+    """キューからレコードを取り出し、まとめてファイルに追記する"""
+
+    def __init__(self, log_queue, path, formatter, flush_interval=0.5, batch_size=512):
+        super().__init__(name="frog-log-writer", daemon=True)
+        self.log_queue = log_queue
+        self.path = path
+        self.formatter = formatter
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+    def run(self):
+        pending = []
+        last_flush = time.monotonic()
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+                try:
+                    record = self.log_queue.get(timeout=timeout)
+                except queue.Empty:
+                    record = None
+                stop = record is _STOP
+                if record is not None and not stop:
+                    pending.append(self.formatter.format(record))
+                    # 溜まっている分はまとめて取り出す
+                    while len(pending) < self.batch_size:
+                        try:
+                            record = self.log_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if record is _STOP:
+                            stop = True
+                            break
+                        pending.append(self.formatter.format(record))
+                now = time.monotonic()
+                if pending and (stop or len(pending) >= self.batch_size or now - last_flush >= self.flush_interval):
+                    f.write("\n".join(pending) + "\n")
+                    f.flush()
+                    pending = []
+                if now - last_flush >= self.flush_interval:
+                    last_flush = now
+                if stop:
+                    break
+
+
+class GuiLogBuffer(logging.Handler):
+    """GUI 表示用にログ行を溜めておくハンドラ
+
+    emit はどのスレッドから呼ばれてもよい。GUI 側はタイマーで drain() を呼び、
+    返ってきた行をまとめて 1 回で表示する。
+    """
+
+    def __init__(self, level=logging.INFO, max_buffer=10000):
+        super().__init__(level)
+        self.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        self._lines = collections.deque(maxlen=max_buffer)
+        self.overflow = 0
+
+    def emit(self, record):
+        try:
+            if len(self._lines) == self._lines.maxlen:
+                self.overflow += 1
+            self._lines.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def drain(self, max_lines=200):
+        """溜まっている行を取り出す。max_lines を超えた古い行は捨て、捨てた行数も返す"""
+        lines = self._lines
+        dropped, self.overflow = self.overflow, 0
+        while len(lines) > max_lines:
+            lines.popleft()
+            dropped += 1
+        out = []
+        while lines:
+            out.append(lines.popleft())
+        return out, dropped
+
+
+class LogSession:
+    """setup_logging() の戻り値。close() で残りを書き出して後始末する"""
+
+    def __init__(self, logger, queue_handler, writer):
+        self.logger = logger
+        self.queue_handler = queue_handler
+        self.writer = writer
+        self.path = writer.path
+        self.gui_handlers = []
+
+    def gui_buffer(self, level=logging.INFO, max_buffer=10000):
+        handler = GuiLogBuffer(_level(level), max_buffer)
+        self.logger.addHandler(handler)
+        self.gui_handlers.append(handler)
+        return handler
+
+    def close(self):
+        if not self.writer.is_alive():
+            return
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.gui_handlers:
+            self.logger.removeHandler(handler)
+        self.writer.log_queue.put(_STOP)
+        self.writer.join()
+
+
+def setup_logging(path, level=logging.DEBUG, flush_interval=0.5, batch_size=512):
+    """"frog" ロガーの出力を path へのバッチ書き込みにつなぐ"""
+    log_queue = queue.SimpleQueue()
+    formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+    writer = BatchFileWriter(log_queue, path, formatter, flush_interval, batch_size)
+    writer.start()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setLevel(_level(level))
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(queue_handler)
+    session = LogSession(logger, queue_handler, writer)
+    atexit.register(session.close)
+    return session
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+スキャン中の点ごと・フェーズごとの所要時間
+
+ログの「移動に…秒」「測定…秒」を正規表現で拾う代わりに、測定ループから
+単調時計（time.perf_counter）で計ったスパンを (点番号, フェーズ, 開始, 所要時間) の
+列として溜め、スキャン終了時に npz（列ごとの配列）へ書き出す。
+直近 window 件からフェーズごとの p50 / p95 を随時計算できるので、GUI に表示する。
+
+    metrics = ScanMetrics("data/20250515_183554_FROG.metrics.npz")
+    with metrics.span("acquire", i):
+        session.read_averaged(...)
+    metrics.save()
+
+    python -m frog.metrics data/20250515_183554_FROG.metrics.npz
+"""
+
+import argparse
+import collections
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+EXTENSION = ".metrics.npz"
+
+
+class ScanMetrics:
+    """(点番号, フェーズ, 開始 [s], 所要時間 [s]) を列ごとの配列に追記する（スレッドセーフ）"""
+
+    def __init__(self, path=None, window=256, capacity=1024):
+        self.path = path
+        self.window = window
+        self.t0 = time.perf_counter()
+        self.phases = []
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._n = 0
+        self._point = np.empty(capacity, dtype=np.int32)
+        self._phase = np.empty(capacity, dtype=np.uint8)
+        self._start = np.empty(capacity, dtype=np.float64)
+        self._duration = np.empty(capacity, dtype=np.float32)
+        self._recent = {}
+
+    def _code(self, phase):
+        code = self._codes.get(phase)
+        if code is None:
+            code = self._codes[phase] = len(self.phases)
+            self.phases.append(phase)
+            self._recent[phase] = collections.deque(maxlen=self.window)
+        return code
+
+    def _grow(self):
+        for name in ("_point", "_phase", "_start", "_duration"):
+            old = getattr(self, name)
+            new = np.empty(2 * len(old), dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def record(self, phase, point, start, end=None):
+        """perf_counter の start から end（省略時は現在）までを phase のスパンとして残す"""
+        end = time.perf_counter() if end is None else end
+        with self._lock:
+            if self._n == len(self._point):
+                self._grow()
+            n = self._n
+            self._point[n] = point
+            self._phase[n] = self._code(phase)
+            self._start[n] = start - self.t0
+            self._duration[n] = end - start
+            self._n += 1
+            self._recent[phase].append(end - start)
+
+    @contextlib.contextmanager
+    def span(self, phase, point):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, point, start)
+
+    def __len__(self):
+        return self._n
+
+    def columns(self):
+        """ここまでの記録を列ごとの配列（コピー）で返す"""
+        with self._lock:
+            n = self._n
+            return {
+                "point": self._point[:n].copy(),
+                "phase": self._phase[:n].copy(),
+                "start": self._start[:n].copy(),
+                "duration": self._duration[:n].copy(),
+                "phase_names": np.array(self.phases),
+            }
+
+    def live_summary(self):
+        """直近 window 件でのフェーズごとの {"n", "p50_ms", "p95_ms"}"""
+        with self._lock:
+            recent = {phase: np.fromiter(d, dtype=float) for phase, d in self._recent.items()}
+        out = {}
+        for phase, d in recent.items():
+            if len(d):
+                p50, p95 = np.percentile(d, (50, 95)) * 1000
+                out[phase] = {"n": len(d), "p50_ms": p50, "p95_ms": p95}
+        return out
+
+    def format_live(self):
+        """GUI 表示用の 1 行（フェーズ p50/p95 [ms]）"""
+        return "  ".join(
+            f"{phase} {s['p50_ms']:.0f}/{s['p95_ms']:.0f}" for phase, s in self.live_summary().items()
+        )
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            return None
+        np.savez_compressed(path, **self.columns())
+        return path
+
+
+def load_metrics(path):
+    with np.load(path) as f:
+        return {key: f[key] for key in f.files}
+
+
+def summarize(columns):
+    """列の dict からフェーズごとの {"n", "total_s", "mean_ms", "p50_ms", "p95_ms", "max_ms"}"""
+    out = {}
+    for code, phase in enumerate(columns["phase_names"]):
+        d = columns["duration"][columns["phase"] == code].astype(float)
+        if not len(d):
+            continue
+        p50, p95 = np.percentile(d, (50, 95)) * 1000
+        out[str(phase)] = {
+            "n": int(len(d)), "total_s": float(d.sum()), "mean_ms": float(d.mean() * 1000),
+            "p50_ms": float(p50), "p95_ms": float(p95), "max_ms": float(d.max() * 1000),
+        }
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スキャンのフェーズ別所要時間を集計する")
+    parser.add_argument("paths", nargs="+", help="*.metrics.npz")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        columns = load_metrics(path)
+        n_points = len(np.unique(columns["point"]))
+        wall = float((columns["start"] + columns["duration"]).max()) if len(columns["start"]) else 0.0
+        print(f"{path}: {n_points} 点, {wall:.1f} 秒")
+        print(f"  {'phase':10s} {'n':>6s} {'合計[s]':>9s} {'平均':>8s} {'p50':>8s} {'p95':>8s} {'最大':>8s}  [ms]")
+        for phase, s in summarize(columns).items():
+            print(f"  {phase:10s} {s['n']:6d} {s['total_s']:9.2f} {s['mean_ms']:8.1f} "
+                  f"{s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['max_ms']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
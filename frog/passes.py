@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+往復（双方向）マルチパススキャン
+
+往路（方向 0）で start → stop、復路（方向 1）で stop → start と交互に測り、
+HOME へ戻るだけの移動をなくす。復路の点はバックラッシュのぶん実際の位置がずれるので、
+実測したオフセット表（位置 [pulse] → オフセット [pulse]）で補正してから
+往路の格子へ線形補間し、全パスを平均する。パスごとの重心のずれ・強度比・残差を
+ドリフトの統計として返す。
+
+オフセット表は「位置 オフセット」の 2 列のテキストで、往復スキャンのトレースから作れる:
+
+    python -m frog.passes data/20250515_183554_FROG.frogtrc --table backlash.txt
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+FORWARD = 0
+REVERSE = 1
+
+
+class BacklashTable:
+    """復路で測った点の位置 [pulse] に足すオフセット [pulse]（位置の間は線形補間）"""
+
+    def __init__(self, positions=(0.0,), offsets=(0.0,)):
+        order = np.argsort(positions)
+        self.positions = np.asarray(positions, dtype=float)[order]
+        self.offsets = np.asarray(offsets, dtype=float)[order]
+
+    @classmethod
+    def load(cls, path):
+        table = np.loadtxt(path, ndmin=2)
+        return cls(table[:, 0], table[:, 1])
+
+    def save(self, path):
+        np.savetxt(path, np.column_stack((self.positions, self.offsets)), fmt="%.3f",
+                   header="position[pulse] offset[pulse]  (復路の点に足すオフセット)")
+        return path
+
+    def update(self, position, offset):
+        """position のオフセットを追加・上書きする"""
+        keep = self.positions != position
+        positions = np.append(self.positions[keep], position)
+        offsets = np.append(self.offsets[keep], offset)
+        self.__init__(positions, offsets)
+
+    def correct(self, positions, direction):
+        """方向 direction で測った点の実際の位置を返す"""
+        positions = np.asarray(positions, dtype=float)
+        if direction == FORWARD:
+            return positions
+        return positions + np.interp(positions, self.positions, self.offsets)
+
+
+def pass_positions(start, stop, step, n_passes, bidirectional=True):
+    """各パスの (方向, 位置の配列 [pulse]) のリスト
+
+    往復なら偶数番目のパスは stop から start へ戻りながら測る。
+    """
+    forward = np.arange(start, stop + 1, step)
+    passes = []
+    for k in range(n_passes):
+        if bidirectional and k % 2 == 1:
+            passes.append((REVERSE, forward[::-1]))
+        else:
+            passes.append((FORWARD, forward))
+    return passes
+
+
+def interp_frames(positions, frames, grid):
+    """(点数, 画素数) の frames を位置 grid へ遅延方向に線形補間する（範囲外は端の値）"""
+    order = np.argsort(positions, kind="stable")
+    x = np.asarray(positions, dtype=float)[order]
+    y = np.asarray(frames)[order]
+    idx = np.clip(np.searchsorted(x, grid), 1, len(x) - 1)
+    x0, x1 = x[idx - 1], x[idx]
+    w = np.clip((grid - x0) / np.where(x1 > x0, x1 - x0, 1.0), 0.0, 1.0)[:, None]
+    return y[idx - 1] * (1 - w) + y[idx] * w
+
+
+def _centroid(positions, frames):
+    marginal = np.asarray(frames, dtype=float).sum(axis=1)
+    total = marginal.sum()
+    return float(positions @ marginal / total) if total != 0 else float("nan")
+
+
+def merge_passes(passes, grid, backlash=None):
+    """パスごとの (方向, 位置 [pulse], フレーム) を grid 上で平均する
+
+    戻り値は (平均, パス間の分散（1 パスなら NaN）, パスごとの統計のリスト)。
+    統計の shift はパス間平均に対する時間周辺分布の重心のずれ [pulse]。
+    """
+    grid = np.asarray(grid, dtype=float)
+    backlash = backlash or BacklashTable()
+    stack = np.stack([
+        interp_frames(backlash.correct(pos, direction), frames, grid)
+        for direction, pos, frames in passes
+    ])
+    mean = stack.mean(axis=0)
+    var = stack.var(axis=0, ddof=1) if len(stack) > 1 else np.full(mean.shape, np.nan)
+    mean_centroid = _centroid(grid, mean)
+    mean_total = mean.sum()
+    scale = np.sqrt(np.mean(np.square(mean))) or 1.0
+    stats = []
+    for k, ((direction, pos, _), frames) in enumerate(zip(passes, stack)):
+        stats.append({
+            "pass": k,
+            "direction": int(direction),
+            "n_points": int(len(pos)),
+            "shift": _centroid(grid, frames) - mean_centroid,
+            "intensity_ratio": float(frames.sum() / mean_total) if mean_total != 0 else float("nan"),
+            "rms_residual": float(np.sqrt(np.mean(np.square(frames - mean))) / scale),
+        })
+    return mean, var, stats
+
+
+def estimate_backlash(positions, forward, reverse, max_shift=None):
+    """同じ位置で測った往路・復路のフレームから、復路に足すオフセット [pulse] を求める
+
+    時間周辺分布の相互相関のピークを放物線で補間する。positions は等間隔とする。
+    """
+    positions = np.asarray(positions, dtype=float)
+    step = positions[1] - positions[0]
+    a = np.asarray(forward, dtype=float).sum(axis=1)
+    b = np.asarray(reverse, dtype=float).sum(axis=1)
+    a = a - a.mean()
+    b = b - b.mean()
+    corr = np.correlate(a, b, mode="full")
+    lags = np.arange(-len(b) + 1, len(a))
+    if max_shift is not None:
+        corr = np.where(np.abs(lags * step) <= max_shift, corr, -np.inf)
+    k = int(np.argmax(corr))
+    frac = 0.0
+    if 0 < k < len(corr) - 1 and np.isfinite(corr[k - 1]) and np.isfinite(corr[k + 1]):
+        c = corr[k - 1:k + 2]
+        # ピーク付近が正ならガウス型（対数の放物線）、そうでなければ放物線で補間する
+        if np.all(c > 0):
+            c = np.log(c)
+        denom = c[0] - 2 * c[1] + c[2]
+        if denom != 0:
+            frac = 0.5 * (c[0] - c[2]) / denom
+    # 復路の像が往路より -lag だけ後ろに見えている → 復路の位置に lag を足す
+    return float((lags[k] + frac) * step)
+
+
+def split_trace_passes(trace, fs_per_pulse):
+    """往復スキャンのトレースをヘッダの pass_lengths / pass_directions でパスに分ける"""
+    meta = trace.metadata
+    lengths = meta.get("pass_lengths") or [len(trace)]
+    directions = meta.get("pass_directions") or [FORWARD] * len(lengths)
+    bounds = np.cumsum([0] + list(lengths))
+    positions = np.asarray(trace.delays, dtype=float) / fs_per_pulse
+    return [
+        (directions[k], np.round(positions[bounds[k]:bounds[k + 1]]), trace.frames[bounds[k]:bounds[k + 1]])
+        for k in range(len(lengths))
+    ]
+
+
+def main(argv=None):
+    from frog.tracefile import Trace
+
+    parser = argparse.ArgumentParser(description="往復スキャンのトレースからバックラッシュのオフセットを求める")
+    parser.add_argument("path", help="往復スキャンの *.frogtrc")
+    parser.add_argument("--table", help="結果を追記するオフセット表（位置 オフセット）")
+    args = parser.parse_args(argv)
+    trace = Trace(args.path)
+    meta = trace.metadata
+    fs_per_pulse = meta["dt"] / meta["step_size"]
+    passes = split_trace_passes(trace, fs_per_pulse)
+    fwd = [p for p in passes if p[0] == FORWARD]
+    rev = [p for p in passes if p[0] == REVERSE]
+    if not fwd or not rev:
+        parser.error("往路と復路の両方を含むトレースではありません")
+    grid = np.sort(fwd[0][1])
+    forward = np.mean([interp_frames(pos, frames, grid) for _, pos, frames in fwd], axis=0)
+    reverse = np.mean([interp_frames(pos, frames, grid) for _, pos, frames in rev], axis=0)
+    offset = estimate_backlash(grid, forward, reverse)
+    center = _centroid(grid, forward)
+    print(f"{args.path}: 復路オフセット {offset:+.2f} pulse（{offset * fs_per_pulse:+.2f} fs）, 位置 {center:.0f} pulse")
+    if args.table:
+        table = BacklashTable.load(args.table) if os.path.exists(args.table) else BacklashTable([], [])
+        table.update(round(center), offset)
+        print(f"  -> {table.save(args.table)}")
+
+
+if __name__ == "__main__":
+    main()
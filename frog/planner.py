@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+遅延点の適応サンプリング
+
+まず coarse_step 間隔で全範囲を粗く測り、その後は隣り合う測定点の間隔ごとに
+「信号の大きさ」と「信号の曲率」を見て、どちらかが閾値を超える間隔に中点を足す。
+間隔が min_step まで細かくなるか、足すべき間隔がなくなったら終わる。
+SHG-FROG では時間ゼロ付近だけが密になり、裾の点数が大きく減る。
+
+    planner = AdaptiveDelayPlanner(0, 300, coarse_step=10, min_step=1)
+    for pos in planner:
+        ...                                   # pos [pulse] へ移動して測定
+        planner.record(pos, spectrum.sum())   # 次の点を決めるために信号を返す
+
+信号は粗いパスの下位 BASELINE_PERCENTILE % を床として引いてから規格化する
+（BG を引かない測定でも床の高さで全区間が閾値を超えないように）。
+床からの山の高さが床のノイズ（粗いパスの隣り合う差の中央値から見積もる）の min_snr 倍に
+満たなければ、細かくせず粗いパスだけで終える。山があっても、床のノイズに埋もれた区間は細かくしない。
+
+位置はステージのパルス単位（整数）で扱い、各パスの中は昇順に並べる。
+"""
+
+import numpy as np
+
+# 粗いパスの信号の床とみなす下位パーセンタイル
+BASELINE_PERCENTILE = 10
+# 正規分布で MAD を標準偏差に直す係数
+MAD_TO_SIGMA = 1.4826
+
+
+class AdaptiveDelayPlanner:
+    """粗いパスのあと、信号または曲率の大きい区間を細かくしていく遅延点の生成器"""
+
+    def __init__(self, start, stop, coarse_step, min_step=1, threshold=0.05,
+                 curvature_threshold=None, max_passes=16, min_snr=5.0):
+        if coarse_step < min_step:
+            coarse_step = min_step
+        self.start = int(start)
+        self.stop = int(stop)
+        self.coarse_step = int(coarse_step)
+        self.min_step = int(min_step)
+        self.threshold = threshold
+        self.curvature_threshold = threshold if curvature_threshold is None else curvature_threshold
+        self.max_passes = max_passes
+        self.min_snr = min_snr
+        self.baseline = None    # 粗いパスの信号の床とそのノイズ（最初の refine_positions で決める）
+        self.noise = 0.0
+        self.measured = {}      # 位置 [pulse] -> 積分信号
+        self.passes = 0
+        self._pending = []
+
+    @property
+    def max_points(self):
+        """最も細かくなった場合の点数（バッファ確保用）"""
+        return (self.stop - self.start) // self.min_step + 1
+
+    def coarse_positions(self):
+        positions = list(range(self.start, self.stop + 1, self.coarse_step))
+        if positions[-1] != self.stop:
+            positions.append(self.stop)
+        return positions
+
+    def record(self, position, signal):
+        self.measured[int(position)] = float(signal)
+
+    def refine_positions(self):
+        """今までの測定から、次のパスで測る位置（昇順）を決める"""
+        pos = np.array(sorted(self.measured))
+        if len(pos) < 2:
+            return []
+        sig = np.array([self.measured[p] for p in pos])
+        if self.baseline is None:
+            # 以降のパスは山の付近にしか点を足さないので、床は粗いパスだけから決めて固定する
+            self.baseline = float(np.percentile(sig, BASELINE_PERCENTILE))
+            self.noise = MAD_TO_SIGMA * float(np.median(np.abs(np.diff(sig)))) / np.sqrt(2)
+        sig = sig - self.baseline
+        scale = np.max(np.abs(sig))
+        if scale <= 0 or scale < self.min_snr * self.noise:
+            return []
+        sig = sig / scale
+        # 不等間隔の 2 階差分（端点は隣の値を使う）
+        curv = np.zeros_like(sig)
+        if len(pos) >= 3:
+            h0 = np.diff(pos)[:-1]
+            h1 = np.diff(pos)[1:]
+            curv[1:-1] = 2 * (h0 * sig[2:] - (h0 + h1) * sig[1:-1] + h1 * sig[:-2]) / (h0 * h1 * (h0 + h1))
+            curv[0], curv[-1] = curv[1], curv[-2]
+            # 粗いパスの間隔での変化量に直して比べる
+            curv = np.abs(curv) * self.coarse_step ** 2
+            if curv.max() > 0:
+                curv = curv / curv.max()
+        width = np.diff(pos)
+        level = np.maximum(np.abs(sig[:-1]), np.abs(sig[1:]))
+        bend = np.maximum(curv[:-1], curv[1:])
+        # 床のノイズに埋もれた区間は細かくしない（細かい間隔ではノイズでも曲率が大きくなる）
+        above_noise = level * scale >= self.min_snr * self.noise
+        split = (width >= 2 * self.min_step) & above_noise & (
+            (level >= self.threshold) | (bend >= self.curvature_threshold))
+        mids = pos[:-1][split] + width[split] // 2
+        # min_step の格子に揃える
+        mids = self.start + np.round((mids - self.start) / self.min_step).astype(int) * self.min_step
+        return sorted(set(int(m) for m in mids) - set(self.measured))
+
+    def progress(self):
+        """おおよその進捗（0〜1）"""
+        done = len(self.measured)
+        return done / max(done + len(self._pending), 1)
+
+    def __iter__(self):
+        self.passes = 0
+        self.baseline = None
+        self.noise = 0.0
+        self._pending = self.coarse_positions()
+        while self._pending and self.passes < self.max_passes:
+            while self._pending:
+                yield self._pending.pop(0)
+            self.passes += 1
+            self._pending = self.refine_positions()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+解析の前処理（BG 補正と信号のある範囲）
+
+frog.batch・frog.retrieval・frog.fitting が共通で使う。
+    subtract_background  BG に使う遅延（first: 最初, edges: 最初と最後）のスペクトルを引き、
+                         その行を除いた FrogData を返す。負の値は切らない
+    signal_support       マージナルの中央値をノイズの床として引き、ピークから続く信号の範囲
+
+    data = subtract_background(load_frog(path).sorted(), "first")
+    lo, hi, center = signal_support(data.wavelengths, data.intensity.sum(axis=0))
+"""
+
+import numpy as np
+
+from frog.loader import FrogData
+
+BACKGROUNDS = ("first", "edges", "none")
+
+# 信号があるとみなす範囲（ノイズの床を引いたマージナルのピークに対する割合）
+SUPPORT_LEVEL = 0.01
+
+
+def subtract_background(data, mode="first"):
+    """BG を引いた FrogData（強度は float32 の写し）。BG に使った遅延の行は除く
+
+    data は遅延の昇順（sorted()）で渡す。負の値は 0 にしない（切ってから和を取ると
+    ノイズが正の側だけ積もってマージナルに床ができる）。
+    """
+    if mode not in BACKGROUNDS:
+        raise ValueError(f"BG は {', '.join(BACKGROUNDS)} のどれかです: {mode}")
+    intensity = np.asarray(data.intensity, dtype=np.float32)
+    if mode == "none":
+        return FrogData(data.delays, data.wavelengths, intensity.copy(), data.format, data.delay_unit, data.path)
+    if len(data.delays) < (2 if mode == "first" else 3):
+        raise ValueError(f"BG（{mode}）を除くと遅延が残りません（{len(data.delays)} 点）")
+    if mode == "first":
+        background, rows = intensity[0], slice(1, None)
+    else:
+        background, rows = 0.5 * (intensity[0] + intensity[-1]), slice(1, -1)
+    return FrogData(data.delays[rows], data.wavelengths, intensity[rows] - background,
+                    data.format, data.delay_unit, data.path)
+
+
+def signal_support(x, marginal):
+    """(下端, 上端, 重心)。中央値をノイズの床として引き、ピークから SUPPORT_LEVEL 以上が続く範囲"""
+    excess = marginal - np.median(marginal)
+    k = int(np.argmax(excess))
+    above = excess >= SUPPORT_LEVEL * excess[k]
+    lo = hi = k
+    while lo > 0 and above[lo - 1]:
+        lo -= 1
+    while hi < len(x) - 1 and above[hi + 1]:
+        hi += 1
+    weight = excess[lo:hi + 1]
+    if weight.sum() <= 0:
+        return float(x[lo]), float(x[hi]), float(x[k])
+    return float(x[lo]), float(x[hi]), float(np.sum(x[lo:hi + 1] * weight) / weight.sum())
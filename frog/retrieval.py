@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+SHG-FROG の位相回復（PCGPA: principal components generalized projections）
+
+frog.loader で読んだトレースを N × N の格子（遅延 dt 刻み、周波数 1/(N dt) 刻み）へ
+補間し、PCGPA で電場 E(t) を求める。1 反復は
+    外積 O = E ⊗ G → 行ごとに回して時間領域の FROG 信号 → 時間方向の FFT
+    → 振幅を測定値の平方根に置き換え → 逆 FFT → 回転を戻して O'
+    → E ← O' O'^† E,  G ← O'^T O'^* G（べき乗法で主成分を 1 回更新）
+で、回転は前もって作った添字（置換）の gather 1 回、FFT は scipy.fft の一括変換。
+作業配列は最初に確保して使い回す。n_starts 本の初期値を束ねて同時に回し、
+FROG エラー G が最小のものを返す。
+
+    data = load_frog("01_Mesurement/data/20241008_174338_FROG_0_withoutSAP.txt")
+    result = retrieve(data, n=128)
+    result.time, result.field, result.phase, result.wavelength, result.spectrum, result.error
+
+    python -m frog.retrieval 01_Mesurement/data/20241008_174338_FROG_0_withoutSAP.txt --grid 128 --png retrieval.png
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import scipy.fft
+
+from frog.loader import load_frog
+from frog.preprocess import BACKGROUNDS, signal_support, subtract_background
+
+# 光速 [nm/fs]
+C_NM_PER_FS = 299.792458
+
+MAX_ITERATIONS = 300
+# G がこの回数のあいだ rel_tol 以上下がらなければ止める
+PATIENCE = 30
+
+
+class RetrievalResult:
+    """回復した電場と、そこから求めた量
+
+    time [fs] と field（複素振幅, 最大 1）、intensity と phase [rad]（ピークで 0、unwrap 済み）。
+    frequency [PHz]・wavelength [nm] は基本波の軸で、spectrum と spectral_phase がその上の値。
+    trace は回復した電場の FROG トレース、measured は格子へ補間した測定値（遅延 × SH 周波数、最大 1）。
+    """
+
+    def __init__(self, time, field, frequency, spectrum_field, delays, sh_frequency, measured, trace,
+                 error, errors, iterations, elapsed):
+        self.time = time
+        self.field = field
+        self.intensity = np.abs(field) ** 2
+        self.phase = _phase(field)
+        self.frequency = frequency
+        self.wavelength = C_NM_PER_FS / frequency
+        self.spectrum = np.abs(spectrum_field) ** 2
+        self.spectrum /= self.spectrum.max()
+        self.spectral_phase = _phase(spectrum_field)
+        self.delays = delays
+        self.sh_frequency = sh_frequency
+        self.measured = measured
+        self.trace = trace
+        self.error = error
+        self.errors = errors
+        self.iterations = iterations
+        self.elapsed = elapsed
+
+    def fwhm(self):
+        """時間強度の FWHM [fs]（半値の位置は線形補間）"""
+        return _fwhm(self.time, self.intensity)
+
+
+def _phase(field):
+    """unwrap した位相（ピークで 0）"""
+    phase = np.unwrap(np.angle(field))
+    return phase - phase[np.argmax(np.abs(field))]
+
+
+def _fwhm(x, y):
+    k = int(np.argmax(y))
+    half = 0.5 * y[k]
+    left = k
+    while left > 0 and y[left - 1] >= half:
+        left -= 1
+    right = k
+    while right < len(y) - 1 and y[right + 1] >= half:
+        right += 1
+    x_left = x[left] if left == 0 else np.interp(half, [y[left - 1], y[left]], [x[left - 1], x[left]])
+    x_right = x[right] if right == len(y) - 1 else np.interp(half, [y[right + 1], y[right]], [x[right + 1], x[right]])
+    return float(x_right - x_left)
+
+
+def _interp_columns(x, values, x_new):
+    """values[..., len(x)] を最後の軸について x_new へ線形補間する（範囲外は 0）"""
+    i = np.clip(np.searchsorted(x, x_new) - 1, 0, len(x) - 2)
+    w = (x_new - x[i]) / (x[i + 1] - x[i])
+    out = values[..., i] * (1 - w) + values[..., i + 1] * w
+    out[..., (x_new < x[0]) | (x_new > x[-1])] = 0
+    return out
+
+
+def prepare_trace(data, n=128, dt=None, background="first"):
+    """トレースを (遅延 n, SH 周波数 n) の格子へ補間する
+
+    周波数方向は波長の強度を λ²/c を掛けて周波数あたりに直してから補間する。
+    dt を省略すると、信号のある遅延幅と周波数幅の両方に同じ余裕が残る刻みにする。
+    戻り値は (measured（最大 1）, delays [fs], sh_frequency [PHz（昇順）], dt)。
+    """
+    data = subtract_background(data.sorted(), background)
+    if min(data.shape) < 2:
+        raise ValueError(f"トレースが小さすぎます: {data.shape}")
+    intensity = data.intensity.astype(np.float64)
+    nu = C_NM_PER_FS / data.wavelengths[::-1]
+    intensity = intensity[:, ::-1] * (data.wavelengths[::-1] ** 2 / C_NM_PER_FS)
+    delay_marginal = intensity.sum(axis=1)
+    nu_marginal = intensity.sum(axis=0)
+    if delay_marginal.max() <= 0:
+        raise ValueError("BG を引くと信号が残りません")
+    t0, t1, delay_center = signal_support(data.delays, delay_marginal)
+    nu0, nu1, nu_center = signal_support(nu, nu_marginal)
+    if dt is None:
+        t_span = max(t1 - t0, np.min(np.diff(data.delays)))
+        nu_span = max(nu1 - nu0, np.min(np.abs(np.diff(nu))))
+        dt = float(np.sqrt(t_span / (n * nu_span)))
+    delays = (np.arange(n) - n // 2) * dt
+    sh_frequency = nu_center + scipy.fft.fftshift(scipy.fft.fftfreq(n, dt))
+    on_nu = _interp_columns(nu, intensity, sh_frequency)
+    measured = _interp_columns(data.delays, on_nu.T, delays + delay_center).T
+    np.clip(measured, 0, None, out=measured)
+    measured /= measured.max()
+    return measured, delays, sh_frequency, dt
+
+
+class PCGPA:
+    """n × n 格子の SHG-FROG PCGPA（n_starts 本の初期値を束ねて回す）"""
+
+    def __init__(self, n, n_starts=1):
+        self.n = n
+        self.n_starts = n_starts
+        i = np.arange(n)
+        k = np.arange(n)[:, None]
+        # 時間領域の FROG 信号 S[k, i] = E(t_i) G(t_i - τ_k) = O[i, (i - k + n/2) mod n]
+        self.shift = (i * n + (i - k + n // 2) % n).ravel()
+        self.unshift = np.argsort(self.shift)
+        shape = (n_starts, n, n)
+        self.outer = np.empty(shape, dtype=np.complex128)
+        self.signal = np.empty(shape, dtype=np.complex128)
+        self.magnitude = np.empty(shape, dtype=np.float64)
+
+    def _trace_fields(self, pulse, gate):
+        """外積 → 回転 → FFT。signal に周波数領域の FROG 信号（FFT 順）を入れる"""
+        np.multiply(pulse[:, :, None], gate[:, None, :], out=self.outer)
+        outer = self.outer.reshape(self.n_starts, -1)
+        signal = self.signal.reshape(self.n_starts, -1)
+        np.take(outer, self.shift, axis=1, out=signal)
+        self.signal[...] = scipy.fft.fft(self.signal, axis=2, overwrite_x=True, workers=-1)
+
+    def run(self, amplitude, pulse, gate, max_iterations=MAX_ITERATIONS, rel_tol=1e-4):
+        """amplitude は測定トレースの平方根（遅延 × 周波数, FFT 順, 最大 1）
+
+        (pulse, gate, G の履歴（最良の初期値）, 反復回数) を返す。
+        """
+        measured = amplitude ** 2
+        best_pulse = pulse.copy()
+        best_gate = gate.copy()
+        best_error = np.full(self.n_starts, np.inf)
+        history = []
+        stale = 0
+        iteration = 0
+        for iteration in range(1, max_iterations + 1):
+            self._trace_fields(pulse, gate)
+            np.abs(self.signal, out=self.magnitude)
+            error = _frog_error(measured, self.magnitude ** 2)
+            improved = error < best_error
+            best_pulse[improved] = pulse[improved]
+            best_gate[improved] = gate[improved]
+            best = float(best_error.min())
+            if float(error.min()) < best * (1 - rel_tol):
+                stale = 0
+            else:
+                stale += 1
+            np.minimum(best_error, error, out=best_error)
+            history.append(float(best_error.min()))
+            if stale >= PATIENCE:
+                break
+            # 振幅の置き換え（位相はそのまま）
+            np.maximum(self.magnitude, 1e-30, out=self.magnitude)
+            self.signal *= amplitude / self.magnitude
+            self.signal[...] = scipy.fft.ifft(self.signal, axis=2, overwrite_x=True, workers=-1)
+            signal = self.signal.reshape(self.n_starts, -1)
+            outer = self.outer.reshape(self.n_starts, -1)
+            np.take(signal, self.unshift, axis=1, out=outer)
+            # 主成分の更新（べき乗法 1 回）
+            new_pulse = np.einsum("bij,bj->bi", self.outer, np.einsum("bij,bi->bj", self.outer.conj(), pulse))
+            new_gate = np.einsum("bij,bi->bj", self.outer, np.einsum("bij,bj->bi", self.outer.conj(), gate))
+            pulse = new_pulse / np.linalg.norm(new_pulse, axis=1, keepdims=True)
+            gate = new_gate / np.linalg.norm(new_gate, axis=1, keepdims=True)
+        k = int(np.argmin(best_error))
+        return best_pulse[k], best_gate[k], history, iteration
+
+
+def _frog_error(measured, retrieved):
+    """FROG エラー G（retrieved は最小二乗で倍率を合わせる）。measured は最大 1、retrieved は (b, n, n)"""
+    mu = np.einsum("bij,ij->b", retrieved, measured) / np.einsum("bij,bij->b", retrieved, retrieved)
+    diff = measured - mu[:, None, None] * retrieved
+    return np.sqrt(np.einsum("bij,bij->b", diff, diff) / measured.size)
+
+
+def initial_fields(measured, delays, n_starts=1, seed=0):
+    """遅延マージナル（SHG では自己相関）の幅 / √2 のガウスに乱数の位相を載せた (n_starts, n)"""
+    rng = np.random.default_rng(seed)
+    width = _fwhm(delays, measured.sum(axis=1)) / np.sqrt(2)
+    envelope = np.exp(-2 * np.log(2) * (delays / max(width, delays[1] - delays[0])) ** 2)
+    phase = rng.uniform(-np.pi, np.pi, size=(n_starts, len(delays))) * 0.5
+    return envelope * np.exp(1j * phase)
+
+
+def retrieve(data, n=128, dt=None, background="first", n_starts=1, max_iterations=MAX_ITERATIONS, seed=0):
+    """FrogData（frog.loader）から電場を回復して RetrievalResult を返す"""
+    t_start = time.perf_counter()
+    measured, delays, sh_frequency, dt = prepare_trace(data, n, dt, background)
+    amplitude = scipy.fft.ifftshift(np.sqrt(measured), axes=1)
+    pulse = initial_fields(measured, delays, n_starts, seed)
+    gate = pulse.copy()
+    pulse, gate, errors, iterations = PCGPA(n, n_starts).run(amplitude, pulse, gate, max_iterations)
+
+    # 時間の原点は決まらないので、強度の重心を中央へ回す
+    intensity = np.abs(pulse) ** 2
+    angle = np.angle(np.sum(intensity * np.exp(2j * np.pi * np.arange(n) / n)))
+    pulse = np.roll(pulse, n // 2 - int(round(angle / (2 * np.pi) * n)) % n)
+    pulse /= np.abs(pulse).max()
+
+    engine = PCGPA(n)
+    engine._trace_fields(pulse[None], pulse[None])
+    trace = scipy.fft.fftshift(np.abs(engine.signal[0]) ** 2, axes=1)
+    trace /= trace.max()
+    error = float(_frog_error(measured, trace[None])[0])
+    spectrum_field = scipy.fft.fftshift(scipy.fft.ifft(scipy.fft.ifftshift(pulse)))
+    frequency = 0.5 * sh_frequency.mean() + scipy.fft.fftshift(scipy.fft.fftfreq(n, dt))
+    return RetrievalResult(delays.copy(), pulse, frequency, spectrum_field, delays, sh_frequency, measured,
+                           trace, error, errors, iterations, time.perf_counter() - t_start)
+
+
+def render_png(path, result, title=""):
+    """測定・回復トレース、時間の強度と位相、スペクトルと位相を Agg で描く"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(12, 8))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, 2)
+    extent = [result.delays[0], result.delays[-1], C_NM_PER_FS / result.sh_frequency[0],
+              C_NM_PER_FS / result.sh_frequency[-1]]
+    for ax, image, name in ((axes[0, 0], result.measured, "Measured"), (axes[0, 1], result.trace, "Retrieved")):
+        ax.imshow(image.T, aspect='auto', origin='lower', extent=extent, interpolation='nearest')
+        ax.set_xlabel("Delay [fs]")
+        ax.set_ylabel("SH Wavelength [nm]")
+        ax.set_title(name)
+    axes[0, 1].set_title(f"Retrieved (G = {result.error:.2e})")
+    mask = result.intensity > 1e-2
+    ax = axes[1, 0]
+    ax.plot(result.time, result.intensity, label=f"FWHM {result.fwhm():.1f} fs")
+    ax.set_xlabel("Time [fs]")
+    ax.set_ylabel("Intensity")
+    ax.legend(loc="upper left")
+    ax.twinx().plot(result.time[mask], result.phase[mask], "r--")
+    ax = axes[1, 1]
+    order = np.argsort(result.wavelength)
+    ax.plot(result.wavelength[order], result.spectrum[order])
+    ax.set_xlabel("Wavelength [nm]")
+    ax.set_ylabel("Spectrum")
+    mask = result.spectrum[order] > 1e-2
+    ax.twinx().plot(result.wavelength[order][mask], result.spectral_phase[order][mask], "r--")
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SHG-FROG トレースから PCGPA で電場を回復する")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--grid", type=int, default=128, help="格子の点数 N（N × N）")
+    parser.add_argument("--dt", type=float, default=None, help="時間刻み [fs]（既定は自動）")
+    parser.add_argument("--background", choices=BACKGROUNDS, default="first")
+    parser.add_argument("--starts", type=int, default=1, help="同時に回す初期値の数")
+    parser.add_argument("--iterations", type=int, default=MAX_ITERATIONS)
+    parser.add_argument("--png", default=None, help="図の出力先（ファイルが複数なら出力ディレクトリ）")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        try:
+            result = retrieve(load_frog(path), args.grid, args.dt, args.background, args.starts, args.iterations)
+        except (ValueError, OSError) as e:
+            print(f"{path}: 回復できません（{e}）")
+            continue
+        print(f"{os.path.basename(path)}: G = {result.error:.3e}, FWHM {result.fwhm():.1f} fs, "
+              f"dt {result.time[1] - result.time[0]:.2f} fs, {result.iterations} 回, {result.elapsed:.2f} 秒")
+        if args.png:
+            out = args.png
+            if len(args.paths) > 1:
+                os.makedirs(out, exist_ok=True)
+                out = os.path.join(out, os.path.splitext(os.path.basename(path))[0] + "_retrieval.png")
+            render_png(out, result, os.path.basename(path))
+
+
+if __name__ == "__main__":
+    main()
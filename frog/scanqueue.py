@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+無人で続けて測るスキャンキュー
+
+config_frog.yml の scans に並べたスキャン（積分時間・範囲・ステップ・開始オフセットの違うもの）を、
+ステージの移動量が最小になる順に並べ替えて続けて実行する。スキャンの間に HOME へは戻らず、
+次のスキャンの開始位置へ直接移動し、最後に 1 回だけ HOME へ戻る。
+BG は設定（積分時間・HDR・平均枚数）ごとにセッションの最初に 1 回だけ取り、同じ設定のスキャンで使い回す
+（spectrometer.background: true のとき。background_position があればそこで取り、なければ最初にビームを
+止め、全部取り終えたら戻すよう Enter で確認する。frog.engine.background_conditions）。
+スキャンごとのファイルに加えて、セッションのまとめ（*_FROG_session.json）を書く。
+
+    python -m frog.scanqueue config_frog.yml
+    python -m frog.scanqueue config_frog.yml --emulate
+    python -m frog.scanqueue config_frog.yml --dry-run     # 実行順と移動量だけ表示
+
+    scans:
+      - {name: FROG_0,  start_step: 0,  end_step: 100}
+      - {name: plus3,   start_step: 60, end_step: 160, integration_time_us: 200000}
+      - {name: lowGate, start_step: 0,  end_step: 100, n_average: 4}
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import time
+
+from frog.engine import (
+    BACKLASH_PULSES, ScanEngine, background_conditions, cli_logging, close_devices, load_config, make_hdr,
+    move_stage_to, open_devices, scan_list, scan_params,
+)
+
+logger = logging.getLogger("frog.measure")
+
+# これ以下のスキャン数なら全ての順番を調べる（それより多ければ最近傍法）
+EXHAUSTIVE_MAX = 8
+
+
+def scan_span(scan):
+    """スキャンの (最初の位置, 最後の位置) [pulse, HOME 基準]"""
+    start, end, step = int(scan['start_step']), int(scan['end_step']), int(scan['step_size'])
+    if scan.get('fly_scan') or scan.get('adaptive'):
+        return start, end
+    last = start + max((end - start) // step - 1, 0) * step
+    n_passes = int(scan.get('n_passes', 1))
+    # 往復で偶数パスなら開始位置へ戻って終わる
+    if n_passes > 1 and scan.get('bidirectional', True) and n_passes % 2 == 0:
+        return start, start
+    return start, last
+
+
+def travel(src, dst):
+    """src から dst への移動量 [pulse]（戻る場合は行き過ぎて戻すぶんを足す）"""
+    return abs(dst - src) + (2 * BACKLASH_PULSES if dst < src else 0)
+
+
+def route_length(spans, order, home=0):
+    """HOME から order の順に測って HOME へ戻るまでの移動量 [pulse]"""
+    pos = home
+    total = 0
+    for k in order:
+        first, last = spans[k]
+        total += travel(pos, first) + (last - first if last > first else 0)
+        pos = last
+    return total + travel(pos, home)
+
+
+def order_scans(scans, home=0):
+    """移動量が最小になるスキャンの順番（scans の添字のリスト）"""
+    spans = [scan_span(scan) for scan in scans]
+    n = len(spans)
+    if n <= EXHAUSTIVE_MAX:
+        return list(min(itertools.permutations(range(n)), key=lambda order: route_length(spans, order, home)))
+    order = []
+    remaining = set(range(n))
+    pos = home
+    while remaining:
+        k = min(remaining, key=lambda j: (travel(pos, spans[j][0]), j))
+        order.append(k)
+        remaining.remove(k)
+        pos = spans[k][1]
+    return order
+
+
+class BackgroundCache:
+    """設定ごとに 1 回だけ測った BG（通常は BG スペクトル、HDR は BackgroundModel）"""
+
+    def __init__(self):
+        self.frames = {}
+        self.uses = {}
+
+    @staticmethod
+    def key(params):
+        if params.get('hdr'):
+            return ('hdr', params['integration_time_ms'], params.get('n_average', 1))
+        return ('frame', params['integration_time_ms'])
+
+    def measure(self, session, params):
+        key = self.key(params)
+        if key in self.frames:
+            return False
+        if params.get('hdr'):
+            self.frames[key] = make_hdr(session, params).measure_background()
+        else:
+            session.set_integration_time_ms(params['integration_time_ms'])
+            self.frames[key] = session.measure_background().copy()
+        logger.info(f"BG測定完了: {key}")
+        return True
+
+    def apply(self, session, params):
+        """params に合う BG をセッションに設定する。無ければ BG なし"""
+        key = self.key(params)
+        background = self.frames.get(key)
+        self.uses[key] = self.uses.get(key, 0) + 1
+        if params.get('hdr'):
+            params['hdr_background'] = background
+        elif background is not None:
+            # measure_background() はこの配列に上書きするので写しを渡す
+            session.background = background.copy()
+        else:
+            session.clear_background()
+        return background is not None
+
+
+def run_queue(config, stage, session):
+    """scans を並べ替えて実行し、セッションのまとめの dict を返す"""
+    scans = scan_list(config)
+    for k, scan in enumerate(scans):
+        scan.setdefault('name', f"scan{k}")
+    home_position = stage.position()
+    spans = [scan_span(scan) for scan in scans]
+    order = order_scans(scans)
+    listed = route_length(spans, range(len(scans)))
+    planned = route_length(spans, order)
+    logger.info(f"実行順: {' → '.join(scans[k]['name'] for k in order)}（移動量 {planned} pulse, 並べた順なら {listed} pulse）")
+
+    all_params = [scan_params(scan, home_position) for scan in scans]
+    backgrounds = BackgroundCache()
+    if (config.get('spectrometer') or {}).get('background', False):
+        fspeed = max(params['fspeed'] for params in all_params)
+        with background_conditions(config, stage, home_position, fspeed):
+            for k in order:
+                backgrounds.measure(session, all_params[k])
+        logger.info(f"BG を {len(backgrounds.frames)} 通りの設定で測定しました")
+
+    summary = {
+        'started': datetime.datetime.now().isoformat(timespec="seconds"),
+        'home_position': home_position,
+        'order': [scans[k]['name'] for k in order],
+        'travel_pulses': {'planned': planned, 'listed': listed},
+        'scans': [],
+    }
+    for n, k in enumerate(order):
+        scan, params = scans[k], all_params[k]
+        reused = backgrounds.apply(session, params)
+        logger.info(f"スキャン {n + 1}/{len(order)} {scan['name']}: {scan['start_step']}→{scan['end_step']} pulse, "
+                    f"step {params['step_size']}, {params['integration_time_ms']} ms")
+        t0 = time.perf_counter()
+        result = ScanEngine(stage, session, params, config['output_dir'],
+                            backlash_table=config.get('backlash_table')).run()
+        # 無人運転なので失敗しても次のスキャンへ進む
+        if not result['completed']:
+            logger.warning(f"スキャン {scan['name']} は最後まで終わりませんでした: {result.get('error', '中断')}")
+        summary['scans'].append({
+            'name': scan['name'],
+            'listed_index': k,
+            'settings': {key: scan[key] for key in scan if isinstance(scan[key], (int, float, bool, str))},
+            'background': BackgroundCache.key(params)[0] if reused else None,
+            'duration_s': round(time.perf_counter() - t0, 3),
+            **result,
+        })
+    move_stage_to(stage, max(params['fspeed'] for params in all_params), home_position, "HOME")
+    summary['finished'] = datetime.datetime.now().isoformat(timespec="seconds")
+    return summary
+
+
+def write_summary(summary, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(output_dir, f"{now}_FROG_session.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def format_summary(summary):
+    lines = [f"{'name':12s} {'点数':>6s} {'時間[s]':>8s}  状態  ファイル"]
+    for s in summary['scans']:
+        status = "完了" if s['completed'] else "未完"
+        lines.append(f"{s['name']:12s} {s['points']:6d} {s['duration_s']:8.1f}  {status}  {s['files'].get('trace', '')}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="config_frog.yml の scans を移動量が最小の順に続けて実行する")
+    parser.add_argument("config", nargs="?", default="config_frog.yml", help="設定ファイル（YAML）")
+    parser.add_argument("--emulate", action="store_true", help="実機の代わりに frog.emulator を使う")
+    parser.add_argument("--dry-run", action="store_true", help="実行順と移動量を表示するだけ")
+    args = parser.parse_args(argv)
+    config = load_config(args.config)
+    if args.dry_run:
+        scans = scan_list(config)
+        spans = [scan_span(scan) for scan in scans]
+        order = order_scans(scans)
+        for n, k in enumerate(order):
+            print(f"{n + 1:3d}. {scans[k].get('name') or f'scan{k}':12s} {spans[k][0]:6d} → {spans[k][1]:6d} pulse")
+        print(f"移動量 {route_length(spans, order)} pulse（並べた順なら {route_length(spans, range(len(scans)))} pulse）")
+        return 0
+
+    logs = cli_logging(config, "queue")
+    stage = session = None
+    try:
+        stage, session = open_devices(config, emulate=args.emulate)
+        summary = run_queue(config, stage, session)
+    finally:
+        close_devices(stage, session)
+        logs.close()
+    path = write_summary(summary, config['output_dir'])
+    for line in format_summary(summary):
+        print(line)
+    print(f"まとめ: {path}")
+    return 0 if all(s['completed'] for s in summary['scans']) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
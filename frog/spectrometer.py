@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+USB4000 (seabreeze) からのフレーム取得
+
+固定の sleep で待つ代わりに、積分時間を変えたときにフレーム周期と
+待機後の読み出し遅延を実測し、ステージ静定後に捨てるべき古いフレーム数を決める。
+SpectrometerSession は波長校正・積分時間・ROI・BG をキャッシュし、
+呼び出し側が用意した配列にスペクトルを直接書き込む。
+read_averaged() は 1 点で複数フレームを取り、画素ごとに σ クリップして平均する。
+"""
+
+import time
+
+import numpy as np
+
+# 390nm 以降を使う（従来スクリプトの [1002:] と同じ）
+ROI_START = 1002
+
+# seabreeze の trigger_mode に渡す値（USB4000）
+TRIGGER_NORMAL = 0          # フリーラン
+TRIGGER_SOFTWARE = 1        # ソフトウェアトリガー
+TRIGGER_EXTERNAL_SYNC = 2   # 外部同期
+TRIGGER_EXTERNAL_HW = 3     # 外部ハードウェアトリガー
+
+
+class FrameAcquirer:
+    """ステージ静定後に新しいフレームだけを返す取得レイヤー"""
+
+    def __init__(self, spectrometer, trigger_mode=None):
+        self.spectrometer = spectrometer
+        self.trigger_mode = None
+        self.integration_time_us = None
+        self.frame_period = None   # 連続取得時のフレーム周期 [s]
+        self.read_latency = None   # 待機後に要求してから返るまでの最短時間 [s]
+        self.stale_frames = 1      # 静定後に捨てるフレーム数
+        self._calibrations = {}    # 積分時間 [us] -> (frame_period, read_latency, stale_frames)
+        self._pending_discard = 0  # 積分時間を変えた直後に捨てる旧設定のフレーム数
+        if trigger_mode is not None:
+            self.set_trigger_mode(trigger_mode)
+
+    def set_trigger_mode(self, mode):
+        if mode == self.trigger_mode:
+            return
+        self.spectrometer.trigger_mode(mode)
+        self.trigger_mode = mode
+        self._calibrations.clear()
+        if self.integration_time_us is not None:
+            self.calibrate()
+
+    def set_integration_time_ms(self, integration_time_ms):
+        """積分時間を設定する。値が変わらなければドライバは呼ばない
+
+        一度実測した積分時間に戻すときは calibrate() をやり直さず、
+        旧設定で露光したフレームを次の取得で 1 枚捨てるだけにする。
+        """
+        us = int(round(integration_time_ms * 1000))
+        if us == self.integration_time_us:
+            return False
+        self.spectrometer.integration_time_micros(us)
+        self.integration_time_us = us
+        if us in self._calibrations:
+            self.frame_period, self.read_latency, self.stale_frames = self._calibrations[us]
+            self._pending_discard = 1
+        else:
+            self.calibrate()
+        return True
+
+    def calibrate(self, n_frames=3):
+        """フレーム周期と読み出し遅延を実測し、捨てるフレーム数を決める
+
+        積分時間を変えた直後のフレームは旧設定のものなので最初に 1 枚捨てる。
+        その後 1 周期以上待ってから読むのを位相をずらして数回行い、最短の遅延が
+        フレーム周期に近ければ要求ごとに露光が始まっている（古いフレームなし）、
+        短ければフリーランで待機中のフレームが返っているとみなす。
+        """
+        sp = self.spectrometer
+        sp.intensities()
+        t0 = time.perf_counter()
+        for _ in range(n_frames):
+            sp.intensities()
+        self.frame_period = (time.perf_counter() - t0) / n_frames
+        latencies = []
+        for k in range(4):
+            time.sleep(self.frame_period * (1 + k / 4))
+            t0 = time.perf_counter()
+            sp.intensities()
+            latencies.append(time.perf_counter() - t0)
+        self.read_latency = min(latencies)
+        self.stale_frames = 0 if self.read_latency >= 0.75 * self.frame_period else 1
+        self._pending_discard = 0
+        if self.integration_time_us is not None:
+            self._calibrations[self.integration_time_us] = (self.frame_period, self.read_latency, self.stale_frames)
+
+    def acquire(self, settled=True):
+        """新しいフレームを 1 枚返す
+
+        settled=True のときはステージ停止前から露光していたフレームを捨てる。
+        """
+        sp = self.spectrometer
+        discard = self.stale_frames if settled else 0
+        discard = max(discard, self._pending_discard)
+        self._pending_discard = 0
+        for _ in range(discard):
+            sp.intensities()
+        return sp.intensities()
+
+
+def clipped_mean(stack, clip_sigma=3.0, iterations=3, center="median", out=None, var_out=None):
+    """(フレーム数, 画素数) の stack を画素ごとに σ クリップして平均する
+
+    center="median" では中央値と MAD（×1.4826）で外れ値を判定する。枚数が少なくても
+    単発のスパイク（宇宙線など）を外せる。center="mean" は平均と標準偏差で判定する。
+    var_out には平均値の分散（残ったフレームの不偏分散 / 枚数）を書き込む。
+    戻り値は (平均, 画素ごとの採用フレーム数)。
+    """
+    n_frames = stack.shape[0]
+    keep = np.ones(stack.shape, dtype=bool)
+    if clip_sigma and n_frames > 2:
+        for _ in range(iterations):
+            masked = np.where(keep, stack, np.nan)
+            if center == "median":
+                c = np.nanmedian(masked, axis=0)
+                std = 1.4826 * np.nanmedian(np.abs(masked - c), axis=0)
+            else:
+                c = np.nanmean(masked, axis=0)
+                std = np.nanstd(masked, axis=0, ddof=1)
+            new_keep = np.abs(stack - c) <= clip_sigma * std
+            new_keep |= ~(std > 0)
+            # 全フレームが外れ扱いになった画素は元のまま残す
+            new_keep[:, ~new_keep.any(axis=0)] = True
+            if np.array_equal(new_keep, keep):
+                break
+            keep = new_keep
+    n = keep.sum(axis=0)
+    mean = np.sum(stack, axis=0, where=keep, out=out)
+    np.divide(mean, n, out=mean)
+    if var_out is not None:
+        resid = np.square(stack - mean)
+        np.sum(resid, axis=0, where=keep, out=var_out)
+        np.divide(var_out, np.maximum(n - 1, 1) * n, out=var_out)
+        var_out[n < 2] = np.nan
+    return mean, n
+
+
+class SpectrometerSession:
+    """分光器 1 台分の状態をまとめて保持するセッション
+
+    波長軸は ROI で切り出して一度だけ読み、以後は read() で
+    前もって確保したバッファに ROI のスペクトル（BG 減算済み）を書き込む。
+    """
+
+    def __init__(self, spectrometer, roi=slice(ROI_START, None), trigger_mode=None):
+        self.spectrometer = spectrometer
+        self.frames = FrameAcquirer(spectrometer, trigger_mode)
+        self.roi = roi
+        self.wavelengths = np.array(spectrometer.wavelengths()[roi], dtype=float)
+        self.n_pixels = len(self.wavelengths)
+        self.background = None
+        self._frame = np.empty(self.n_pixels)
+        self._stack = None
+
+    @classmethod
+    def open(cls, model=None, **kwargs):
+        """seabreeze で見つかった分光器（model 指定時はその型番）でセッションを開く"""
+        import seabreeze.spectrometers as sb
+        for device in sb.list_devices():
+            spec = sb.Spectrometer(device)
+            if model is None or spec.model == model:
+                return cls(spec, **kwargs)
+            spec.close()
+        return None
+
+    @property
+    def model(self):
+        return self.spectrometer.model
+
+    @property
+    def max_counts(self):
+        """飽和カウント（ドライバが値を出さなければ 16 bit とみなす）"""
+        return float(getattr(self.spectrometer, "max_intensity", 65535))
+
+    @property
+    def integration_time_ms(self):
+        us = self.frames.integration_time_us
+        return None if us is None else us / 1000
+
+    def set_integration_time_ms(self, integration_time_ms):
+        return self.frames.set_integration_time_ms(integration_time_ms)
+
+    def read(self, out=None, settled=True, subtract_background=True):
+        """ROI のスペクトルを out（省略時は内部バッファ）に書き込んで返す"""
+        if out is None:
+            out = self._frame
+        raw = self.frames.acquire(settled)
+        np.copyto(out, raw[self.roi])
+        if subtract_background and self.background is not None:
+            np.subtract(out, self.background, out=out)
+        return out
+
+    def read_averaged(self, n_frames, out=None, var_out=None, settled=True,
+                      subtract_background=True, clip_sigma=3.0, center="median"):
+        """n_frames 枚を連続して取り、σ クリップ平均を out に書き込んで返す
+
+        静定待ちは最初の 1 枚だけで、残りは続けて読む。
+        var_out を渡すと画素ごとの平均値の分散を書き込む（1 枚なら NaN）。
+        """
+        if out is None:
+            out = self._frame
+        if n_frames <= 1:
+            self.read(out, settled, subtract_background)
+            if var_out is not None:
+                var_out.fill(np.nan)
+            return out
+        if self._stack is None or self._stack.shape[0] != n_frames:
+            self._stack = np.empty((n_frames, self.n_pixels))
+        for k in range(n_frames):
+            raw = self.frames.acquire(settled and k == 0)
+            np.copyto(self._stack[k], raw[self.roi])
+        clipped_mean(self._stack, clip_sigma, center=center, out=out, var_out=var_out)
+        if subtract_background and self.background is not None:
+            np.subtract(out, self.background, out=out)
+        return out
+
+    def measure_background(self):
+        """現在の積分時間で BG スペクトルを取得して保持する"""
+        if self.background is None:
+            self.background = np.empty(self.n_pixels)
+        return self.read(out=self.background, subtract_background=False)
+
+    def clear_background(self):
+        self.background = None
+
+    def close(self):
+        self.spectrometer.close()
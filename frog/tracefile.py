@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+FROG トレースのバイナリ形式（追記のみ）
+
+    [0:8)      マジック b"FROGTRC1"
+    [8:12)     ヘッダ JSON の長さ (uint32, little endian)
+    [12:4096)  ヘッダ JSON（測定条件など）。残りは空白で埋める
+    [4096:)    波長軸 float64 × 画素数
+    以降       レコード（遅延 float64, 時刻 float64, フレーム float32/uint16 × 画素数
+               [, 分散 float32 × 画素数]）の繰り返し
+
+レコードは固定長なので、測定中に落ちても末尾の書きかけレコードを除けばそのまま読める。
+読み出しは np.memmap、従来の txt / csv への変換は測定後に別途行う:
+
+    python -m frog.tracefile data/20250515_183554_FROG.frogtrc --txt --csv
+"""
+
+import argparse
+import datetime
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"FROGTRC1"
+HEADER_SIZE = 4096
+EXTENSION = ".frogtrc"
+FRAME_DTYPES = ("float32", "uint16")
+
+
+def record_dtype(n_pixels, frame_dtype="float32", variance=False):
+    fields = [
+        ("delay", "<f8"),
+        ("time", "<f8"),
+        ("frame", np.dtype(frame_dtype).newbyteorder("<"), (n_pixels,)),
+    ]
+    if variance:
+        # 複数フレーム平均したときの画素ごとの分散
+        fields.append(("variance", "<f4", (n_pixels,)))
+    return np.dtype(fields)
+
+
+# close() で書き戻す点数の最大桁（ヘッダの大きさの見積もり用）
+MAX_RECORDS = 2 ** 63 - 1
+
+
+def _pack_header(header):
+    body = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    if len(body) > HEADER_SIZE - 12:
+        raise ValueError("ヘッダが大きすぎます（メタデータを減らしてください）")
+    return MAGIC + struct.pack("<I", len(body)) + body.ljust(HEADER_SIZE - 12, b" ")
+
+
+def read_header(path):
+    """ヘッダの dict と、(レコードの dtype, 先頭レコードの位置, ファイル中の完全なレコード数)"""
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if head[:8] != MAGIC:
+        raise ValueError(f"トレースファイルではありません: {path}")
+    (length,) = struct.unpack("<I", head[8:12])
+    header = json.loads(head[12:12 + length].decode("utf-8"))
+    n_pixels = header["n_pixels"]
+    dtype = record_dtype(n_pixels, header["frame_dtype"], header.get("variance", False))
+    data_offset = HEADER_SIZE + 8 * n_pixels
+    n = max(0, (os.path.getsize(path) - data_offset) // dtype.itemsize)
+    return header, dtype, data_offset, n
+
+
+class TraceWriter:
+    """1 点ごとにフレームを追記する
+
+    append() は固定長レコードへのコピーと write だけで、文字列変換はしない。
+    flush_every 点または flush_interval 秒ごとに flush し、fsync=True なら OS にも書き出させる。
+    variance=True ならフレームと一緒に画素ごとの分散も記録する。
+    """
+
+    def __init__(self, path, wavelengths, frame_dtype="float32", metadata=None,
+                 flush_every=16, flush_interval=1.0, fsync=False, variance=False):
+        if np.dtype(frame_dtype).name not in FRAME_DTYPES:
+            raise ValueError(f"未対応のフレーム型です: {frame_dtype}")
+        wavelengths = np.asarray(wavelengths, dtype="<f8")
+        self.path = path
+        self.n_pixels = len(wavelengths)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.n_records = 0
+        self.header = {
+            "version": 1,
+            "n_pixels": self.n_pixels,
+            "frame_dtype": np.dtype(frame_dtype).name,
+            "variance": variance,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "complete": False,
+            "n_records": None,
+            "metadata": metadata or {},
+        }
+        self.variance = variance
+        self._record = np.zeros(1, dtype=record_dtype(self.n_pixels, frame_dtype, variance))
+        # close() で complete と n_records を書き戻しても収まるか、ファイルを作る前に確かめる
+        _pack_header(dict(self.header, n_records=MAX_RECORDS))
+        self._f = open(path, "wb")
+        self._f.write(_pack_header(self.header))
+        self._f.write(wavelengths.tobytes())
+        self._flush()
+
+    @classmethod
+    def reopen(cls, path, n_records=None, flush_every=16, flush_interval=1.0, fsync=False):
+        """中断したトレースに追記を再開する
+
+        n_records 点より後ろのレコード（チェックポイント以降に書かれたものと、書きかけのもの）は切り捨てる。
+        """
+        header, dtype, data_offset, n = read_header(path)
+        self = cls.__new__(cls)
+        self.path = path
+        self.n_pixels = header["n_pixels"]
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.n_records = n if n_records is None else min(n, n_records)
+        self.header = dict(header, complete=False, n_records=None)
+        self.variance = header.get("variance", False)
+        self._record = np.zeros(1, dtype=dtype)
+        self._f = open(path, "r+b")
+        self._f.truncate(data_offset + self.n_records * dtype.itemsize)
+        self._f.write(_pack_header(self.header))
+        self._f.seek(0, os.SEEK_END)
+        self._flush()
+        return self
+
+    def append(self, frame, delay, timestamp=None, variance=None):
+        rec = self._record
+        rec["delay"] = delay
+        rec["time"] = time.time() if timestamp is None else timestamp
+        np.copyto(rec["frame"][0], frame, casting="unsafe")
+        if self.variance:
+            rec["variance"][0] = np.nan if variance is None else variance
+        self._f.write(rec)
+        self.n_records += 1
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """ここまでのレコードをファイルに書き出す（チェックポイントの前に呼ぶ）"""
+        self._flush()
+
+    def close(self, complete=True):
+        """ヘッダに完了フラグと点数を書き戻して閉じる"""
+        if self._f.closed:
+            return
+        try:
+            self._flush()
+            self.header["complete"] = complete
+            self.header["n_records"] = self.n_records
+            self._f.seek(0)
+            self._f.write(_pack_header(self.header))
+        finally:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+class Trace:
+    """トレースファイルを memmap で開く（書き込み中・中断したファイルも読める）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.header, dtype, data_offset, n = read_header(path)
+        self.metadata = self.header.get("metadata", {})
+        n_pixels = self.header["n_pixels"]
+        self.wavelengths = np.fromfile(path, dtype="<f8", count=n_pixels, offset=HEADER_SIZE)
+        if n > 0:
+            self.records = np.memmap(path, dtype=dtype, mode="r", offset=data_offset, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+
+    @property
+    def complete(self):
+        return bool(self.header.get("complete"))
+
+    @property
+    def delays(self):
+        return self.records["delay"]
+
+    @property
+    def timestamps(self):
+        return self.records["time"]
+
+    @property
+    def frames(self):
+        """(点数, 画素数) のビュー"""
+        return self.records["frame"]
+
+    @property
+    def variances(self):
+        """画素ごとの分散（記録していなければ None）"""
+        if "variance" not in self.records.dtype.names:
+            return None
+        return self.records["variance"]
+
+    def __len__(self):
+        return len(self.records)
+
+
+def open_trace(path):
+    return Trace(path)
+
+
+def _as_trace(trace):
+    return trace if isinstance(trace, Trace) else Trace(trace)
+
+
+def _default_path(trace, suffix):
+    return os.path.splitext(trace.path)[0] + suffix
+
+
+def export_txt(trace, path=None):
+    """GUI の従来 txt 形式（#delay/fs, 波長..., max_intensity, timestamp）に遅延の昇順で書き出す"""
+    trace = _as_trace(trace)
+    path = path or _default_path(trace, ".txt")
+    frames = trace.frames
+    max_int = frames.max(axis=1) if len(trace) else np.zeros(0)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#delay/fs\t" + "\t".join(str(x) for x in trace.wavelengths) + "\tmax_intensity\ttimestamp\n")
+        row_fmt = "\t".join(["%.7g"] * trace.header["n_pixels"])
+        for k in np.argsort(trace.delays, kind="stable"):
+            delay, t, y, m = trace.delays[k], trace.timestamps[k], frames[k], max_int[k]
+            stamp = datetime.datetime.fromtimestamp(t).strftime("%Y/%m/%d %H:%M:%S.%f")[:-3]
+            f.write(f"{delay:.2f}\t" + row_fmt % tuple(y.tolist()) + f"\t{m:.2f}\t{stamp}\n")
+    return path
+
+
+def write_wavelength_major_csv(path, wavelengths, delays, columns, block=256, sort=True):
+    """(波長数, 点数) の配列 columns を Wavelength[nm], t0, t1, ... の CSV にする
+
+    columns は memmap やその転置ビューでよい。block 行ずつまとめて savetxt に渡すので、
+    全体をメモリ上にコピーし直すことはない。sort=True なら列を遅延の昇順に並べる
+    （適応サンプリングでは測定順と遅延順が一致しない）。
+    """
+    delays = np.asarray(delays, dtype=float)
+    n = len(delays)
+    order = np.argsort(delays, kind="stable") if sort else np.arange(n)
+    fmt = ["%.1f"] + ["%.4f"] * n
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(",".join(["Wavelength[nm]"] + [f"{t:.2f}" for t in delays[order]]) + "\n")
+        for start in range(0, len(wavelengths), block):
+            stop = min(start + block, len(wavelengths))
+            rows = np.column_stack((wavelengths[start:stop], columns[start:stop, :n][:, order]))
+            np.savetxt(f, rows, fmt=fmt, delimiter=",")
+    return path
+
+
+def export_csv(trace, path=None):
+    """GUI の CSV 形式（Wavelength[nm], t0, t1, ...：波長ごとに 1 行）に書き出す"""
+    trace = _as_trace(trace)
+    path = path or _default_path(trace, ".csv")
+    return write_wavelength_major_csv(path, trace.wavelengths, trace.delays, trace.frames.T)
+
+
+class ColumnStore:
+    """遅延ごとのスペクトルを列として足していく、ディスク上の (波長数, 点数) バッファ
+
+    波長ごとに 1 行の CSV をそのまま書けるよう、ファイルを mmap した配列に転置した形で持つ。
+    容量が足りなくなったら倍の大きさのファイルに移す。
+    """
+
+    def __init__(self, path, wavelengths, capacity=256, dtype="float32"):
+        self.path = path
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.dtype = dtype
+        self.delays = []
+        self._generation = 0
+        self._map, self._buf = self._create(max(1, capacity))
+
+    def _buffer_path(self, generation):
+        return self.path if generation == 0 else f"{self.path}.{generation}"
+
+    def _create(self, capacity):
+        """(mmap, その上の配列)。マップは自分で持ち、消すときに閉じる"""
+        shape = (len(self.wavelengths), capacity)
+        size = shape[0] * shape[1] * np.dtype(self.dtype).itemsize
+        with open(self._buffer_path(self._generation), "w+b") as f:
+            f.truncate(size)
+            buffer_map = mmap.mmap(f.fileno(), size)
+        return buffer_map, np.ndarray(shape, dtype=self.dtype, buffer=buffer_map)
+
+    def _release(self, buffer_map, generation):
+        # Windows ではマップしたままのファイルを消せないので、先にマップを閉じる
+        buffer_map.close()
+        os.remove(self._buffer_path(generation))
+
+    def _grow(self):
+        old_map, old, old_generation = self._map, self._buf, self._generation
+        self._generation += 1
+        self._map, self._buf = self._create(2 * old.shape[1])
+        self._buf[:, :old.shape[1]] = old
+        del old
+        self._release(old_map, old_generation)
+
+    def append(self, column, delay):
+        n = len(self.delays)
+        if n == self._buf.shape[1]:
+            self._grow()
+        self._buf[:, n] = column
+        self.delays.append(float(delay))
+
+    @property
+    def columns(self):
+        return self._buf[:, :len(self.delays)]
+
+    def __len__(self):
+        return len(self.delays)
+
+    def write_csv(self, path):
+        self._map.flush()
+        return write_wavelength_major_csv(path, self.wavelengths, self.delays, self._buf)
+
+    def close(self):
+        """バッファファイルを消す"""
+        if self._map is not None:
+            self._buf = None
+            self._release(self._map, self._generation)
+            self._map = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FROG トレースファイルを txt / csv に変換する")
+    parser.add_argument("paths", nargs="+", help="*.frogtrc")
+    parser.add_argument("--txt", action="store_true", help="従来の txt 形式を出力")
+    parser.add_argument("--csv", action="store_true", help="波長×遅延の CSV を出力")
+    args = parser.parse_args(argv)
+    if not args.txt and not args.csv:
+        args.txt = args.csv = True
+    for path in args.paths:
+        trace = Trace(path)
+        state = "完了" if trace.complete else "未完了（中断されたスキャン）"
+        print(f"{path}: {len(trace)} 点, {trace.header['n_pixels']} 画素, {state}")
+        if args.txt:
+            print(f"  -> {export_txt(trace)}")
+        if args.csv:
+            print(f"  -> {export_csv(trace)}")
+
+
+if __name__ == "__main__":
+    main()